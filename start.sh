@@ -0,0 +1,18 @@
+#!/usr/bin/env sh
+
+# The schema is created once, before any process that uses it starts
+python -m step_ingestor.client.schema || exit 1
+
+# The login callback only queues a refresh, the worker runs it. It is restarted when it exits,
+# the web server stays in the foreground so the container stops with it.
+(
+  while true; do
+    python -m step_ingestor.client.worker --processes "${REFRESH_WORKER_PROCESSES:-1}"
+    sleep 5
+  done
+) &
+
+exec gunicorn step_ingestor:app \
+  -b 0.0.0.0:5000 \
+  --keyfile localhost+2-key.pem \
+  --certfile localhost+2.pem
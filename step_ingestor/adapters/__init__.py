@@ -1,5 +1,6 @@
-from .adapter import Adapter
+from .adapter import Adapter, AsyncAdapter
 
 __all__ = [
-    "Adapter"
-]
\ No newline at end of file
+    "Adapter",
+    "AsyncAdapter"
+]
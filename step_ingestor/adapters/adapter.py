@@ -1,6 +1,7 @@
+import asyncio
 import datetime as dt
-from typing import Any, Sequence, TypeAlias, Mapping
-from step_ingestor.dto import ActivitySummaryDTO, UserDTO
+from typing import Any, AsyncIterator, Iterator, Sequence, TypeAlias, Mapping
+from step_ingestor.dto import ActivitySummaryDTO, StepSampleColumns, StepSeries, UserDTO
 
 RawDailyPayload: TypeAlias = Mapping[str, Any] # Raw JSON Response from API
 
@@ -10,8 +11,18 @@ class Adapter:
     Source: Polar API interface
     Target: Repository"""
 
-    def __init__(self, dto_dact, dto_step, adaptee=None):
+    def __init__(self, dto_dact, dto_step, adaptee=None, archive=None, columnar=False, series=False):
+        """
+        :param archive: optional `PayloadArchive` that keeps every raw response for later replay
+        :param columnar: parse the step samples of a day into one `StepSampleColumns`
+            instead of a `dto_step` per sample
+        :param series: parse the step samples of a day into one `StepSeries` of counts per interval,
+            days whose samples are not on the interval grid are parsed into `StepSampleColumns`
+        """
         self._adaptee = adaptee
+        self._archive = archive
+        self._columnar = columnar
+        self._series = series
         self._out_forms = {"dto_dact": dto_dact,
                            "dto_step": dto_step}
 
@@ -22,9 +33,17 @@ class Adapter:
         # Polar response is empty
         if not raw:
             return None
+        if self._archive:
+            self._archive.write(user_id, day, day, raw)
         return self._raw_payload_to_dto(raw, user_id)
 
     def get_activity_date_range(self, date_from, date_to, user: UserDTO) -> Sequence[ActivitySummaryDTO] | None:
+        raw = self.fetch_activity_date_range(date_from=date_from, date_to=date_to, user=user)
+        return self.parse_payload(raw, user_id=user.user_id)
+
+    def fetch_activity_date_range(self, date_from, date_to, user: UserDTO) -> RawDailyPayload | list | None:
+        """Raw response of the range, mapped by `parse_payload`. Together they are `get_activity_date_range`
+        split in its I/O and CPU parts."""
         raw = self._adaptee.get_activity_date_range(date_from=date_from,
                                                     date_to=date_to,
                                                     access_token=user.access_token.token,
@@ -32,7 +51,36 @@ class Adapter:
         # Polar response is empty
         if not raw:
             return None
-        return self._raw_payload_to_dto(raw, user_id=user.user_id)
+        if self._archive:
+            self._archive.write(user.user_id, date_from, date_to, raw)
+        return raw
+
+    def parse_payload(self, raw, user_id) -> Sequence[ActivitySummaryDTO] | None:
+        """Map a raw response of `fetch_activity_date_range` to DTOs"""
+        return self._raw_payload_to_dto(raw, user_id=user_id)
+
+    def iter_activity_date_range(self, date_from, date_to, user: UserDTO) -> Iterator[ActivitySummaryDTO]:
+        """Days of the range one at a time, mapped while the response is received"""
+        if self._archive:
+            # The archive stores the window as one document, so it is read whole
+            payload = self.get_activity_date_range(date_from=date_from, date_to=date_to, user=user)
+            yield from (payload if isinstance(payload, list) else [payload] if payload else [])
+            return
+
+        for raw in self._adaptee.iter_activity_date_range(date_from=date_from,
+                                                          date_to=date_to,
+                                                          access_token=user.access_token.token,
+                                                          steps=True):
+            summary = self._raw_payload_to_dto(raw, user_id=user.user_id)
+            if summary:
+                yield summary
+
+    def replay(self, archive, user_id=None) -> Iterator[tuple[str, Sequence[ActivitySummaryDTO] | ActivitySummaryDTO]]:
+        """Map archived raw responses to DTOs without calling the API, yields (user_id, payload)"""
+        for archived in archive.iter_payloads(user_id=user_id):
+            payload = self._raw_payload_to_dto(archived.raw, user_id=archived.user_id)
+            if payload:
+                yield archived.user_id, payload
 
     def _raw_payload_to_dto(self, raw, user_id) -> Sequence[ActivitySummaryDTO] | None:
         if not raw:
@@ -55,7 +103,12 @@ class Adapter:
                 continue
 
             # Parse step samples
-            if step_samples:
+            if step_samples and self._series:
+                step_samples = StepSeries.from_samples(step_samples, user_id,
+                                                       r["samples"]["steps"].get("interval_ms", 60_000))
+            elif step_samples and self._columnar:
+                step_samples = StepSampleColumns.from_samples(step_samples, user_id)
+            elif step_samples:
                 step_samples = [self._out_forms["dto_step"](**{**s, "user_id": user_id}) for s in step_samples]
 
             # Parse daily activity
@@ -71,3 +124,51 @@ class Adapter:
         if len(payloads_) == 1:
             return payloads_.pop()
         return payloads_
+
+
+class AsyncAdapter(Adapter):
+    """`Adapter` for an asynchronous source such as `AsyncAccessLink`"""
+
+    async def get_activity_day(self, day: str, access_token, user_id) -> Sequence[ActivitySummaryDTO] | None:
+        raw = await self._adaptee.get_activity_day(day=day,
+                                                   access_token=access_token,
+                                                   steps=True)
+        # Polar response is empty
+        if not raw:
+            return None
+        if self._archive:
+            await asyncio.to_thread(self._archive.write, user_id, day, day, raw)
+        return self._raw_payload_to_dto(raw, user_id)
+
+    async def get_activity_date_range(self, date_from, date_to, user: UserDTO) -> Sequence[ActivitySummaryDTO] | None:
+        raw = await self.fetch_activity_date_range(date_from=date_from, date_to=date_to, user=user)
+        return self.parse_payload(raw, user_id=user.user_id)
+
+    async def fetch_activity_date_range(self, date_from, date_to, user: UserDTO) -> RawDailyPayload | list | None:
+        raw = await self._adaptee.get_activity_date_range(date_from=date_from,
+                                                          date_to=date_to,
+                                                          access_token=user.access_token.token,
+                                                          steps=True)
+        # Polar response is empty
+        if not raw:
+            return None
+        if self._archive:
+            await asyncio.to_thread(self._archive.write, user.user_id, date_from, date_to, raw)
+        return raw
+
+    async def iter_activity_date_range(self, date_from, date_to, user: UserDTO) -> AsyncIterator[ActivitySummaryDTO]:
+        """Days of the range one at a time, mapped while the response is received"""
+        if self._archive:
+            # The archive stores the window as one document, so it is read whole
+            payload = await self.get_activity_date_range(date_from=date_from, date_to=date_to, user=user)
+            for summary in (payload if isinstance(payload, list) else [payload] if payload else []):
+                yield summary
+            return
+
+        async for raw in self._adaptee.iter_activity_date_range(date_from=date_from,
+                                                                date_to=date_to,
+                                                                access_token=user.access_token.token,
+                                                                steps=True):
+            summary = self._raw_payload_to_dto(raw, user_id=user.user_id)
+            if summary:
+                yield summary
@@ -0,0 +1,32 @@
+"""Queues refreshes of the users whose data went stale, for the workers of `step_ingestor.client.worker`.
+
+    python -m step_ingestor.client.scheduler [--stale-after-days <days>] [--limit <n>] [--every <seconds>]
+"""
+import os
+import time
+import logging
+import argparse
+import datetime as dt
+
+from step_ingestor.client.src.service.service import session_factory, make_repo
+from step_ingestor.services.ingestion import schedule_refreshes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stale-after-days", type=int, default=1,
+                        help="refresh users whose latest daily summary is older than this many days")
+    parser.add_argument("--limit", type=int, default=None, help="users queued per run, at most")
+    parser.add_argument("--every", type=float, default=None,
+                        help="run every this many seconds instead of once, with --limit this spreads out the refreshes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+    stale_after = dt.timedelta(days=args.stale_after_days)
+    while True:
+        with session_factory() as session:
+            job_ids = schedule_refreshes(make_repo(session), stale_after=stale_after, limit=args.limit)
+        print("Queued {} refresh jobs".format(len(job_ids)))
+        if args.every is None:
+            break
+        time.sleep(args.every)
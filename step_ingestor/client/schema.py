@@ -0,0 +1,18 @@
+"""Creates the database schema, run once before the web server and the workers start.
+
+    python -m step_ingestor.client.schema
+"""
+import os
+import logging
+import argparse
+
+from step_ingestor.client.src.service.service import create_schema
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+    hypertable = create_schema()
+    print("Schema is up to date, step_sample is {}".format("a hypertable" if hypertable else "a plain table"))
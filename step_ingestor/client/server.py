@@ -1,5 +1,5 @@
 import os
-from flask import render_template, g, abort
+from flask import render_template, g, abort, jsonify
 from markupsafe import Markup
 
 from step_ingestor.client.src.service.service import session_factory
@@ -8,7 +8,7 @@ from step_ingestor.client.src.security.init_app import init_app
 from step_ingestor.client.src.security.user import get_user_from_session
 from step_ingestor.client.src.security.decorators import login_required
 from step_ingestor.client.src.service.service import get_service
-from step_ingestor.services.analytics import UserStepPlotter
+from step_ingestor.services.analytics import StepSeriesPlotter
 
 app = init_app()
 with app.app_context():
@@ -48,28 +48,38 @@ def dashboard(freq):
     service = get_service()
     user = service.get_user(user_id=user_id)
 
-    freqs = {"hour": "h",
-             "day": "d",
-             "week": "W",
-             "month": "ME",
-             "quarterly": "QE",
-             "year": "YE"}
+    freqs = ["hour", "day", "week", "month", "quarterly", "year"]
 
     if freq not in freqs:
         abort(404)
     else:
-        freq = freqs.pop(freq)
+        freqs.remove(freq)
     g.freqs = freqs
 
-    # Retrieve user data to make plot
-    user_data = service.get_user_data(user=user)
+    # Shown while the worker is still importing the user's history
+    g.refresh_job = service.get_refresh_job(user=user)
+
+    # Retrieve steps aggregated per `freq` to make plot
+    step_series = service.get_step_series(user=user, freq=freq)
 
     # Create plot
-    plotter = UserStepPlotter(user_data)
-    g.plot = Markup(plotter.create_plot(freq))
+    plotter = StepSeriesPlotter(step_series)
+    g.plot = Markup(plotter.create_plot())
 
     return render_template("dashboard.html")
 
+@app.route("/refresh/status")
+@login_required
+def refresh_status():
+    """Status of the user's latest data refresh"""
+    user_id = get_user_from_session().get("user_id")
+    service = get_service()
+    user = service.get_user(user_id=user_id)
+    job = service.get_refresh_job(user=user)
+    if job is None:
+        return jsonify(status=None)
+    return jsonify(job.model_dump(mode="json", exclude={"user_id"}))
+
 if __name__ == "__main__":
     app.run(
         host=os.environ["CLIENT_HOST"],
@@ -8,6 +8,7 @@ from authlib.integrations.flask_client import OAuth
 from step_ingestor.client.src.security.user import create_user_session, clear_user_session
 from step_ingestor.client.src.service.service import get_service
 from step_ingestor.dto import UserDTO, TokenDTO
+from step_ingestor.services.ingestion import LOGIN_PRIORITY
 
 oauth = None
 
@@ -70,8 +71,8 @@ def callback():
     # Save user information in the session
     create_user_session(user_id=user.user_id)
 
-    # Update latest user data
-    service.refresh_user_data(user=user)
+    # Fetching the latest user data is left to the worker, the dashboard shows the days as they are written
+    service.enqueue_refresh(user=user, priority=LOGIN_PRIORITY)
 
     return redirect("/")
 
@@ -1,28 +1,64 @@
 import os
+import tempfile
+import datetime as dt
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from flask import g
 
-from step_ingestor.db import Base, db_url
+from step_ingestor.db import db_url, bootstrap_schema
 from step_ingestor.dto import ActivitySummaryDTO, StepSampleDTO
-from step_ingestor.interfaces import StepIngestorRepository, AccessLink
+from step_ingestor.interfaces import (StepIngestorRepository, AccessLink, RateLimiter, PayloadArchive,
+                                     ResponseCache, MemoryBackend, DiskBackend)
 from step_ingestor.adapters import Adapter
 from step_ingestor.services.ingestion import IngestionService
 
+def _response_cache():
+    """Workers share cached responses when a cache directory is configured. An in-process cache holds whole
+    parsed windows of minute samples, several MB each, in every process, so it is only used with a size."""
+    ttl = int(os.environ.get("POLAR_CACHE_TTL_SECONDS", "300"))
+    if os.environ.get("POLAR_CACHE_DIR"):
+        return ResponseCache(backend=DiskBackend(os.environ["POLAR_CACHE_DIR"]), ttl=ttl)
+    if os.environ.get("POLAR_CACHE_ENTRIES"):
+        return ResponseCache(backend=MemoryBackend(maxsize=int(os.environ["POLAR_CACHE_ENTRIES"])), ttl=ttl)
+    return None
+
 api_interface = AccessLink(api_url=os.environ["POLAR_API_URL"],
                            auth_url=os.environ["POLAR_AUTHORIZATION_URL"],
                            token_url=os.environ["POLAR_ACCESS_TOKEN_URL"],
                            client_id=os.environ["POLAR_CLIENT_ID"],
                            client_secret=os.environ["POLAR_CLIENT_SECRET"],
-                           redirect_url=os.environ["POLAR_CALLBACK_URL"])
+                           redirect_url=os.environ["POLAR_CALLBACK_URL"],
+                           # One request budget for all workers of the client application
+                           rate_limiter=RateLimiter(path=os.environ.get(
+                               "POLAR_RATE_LIMIT_FILE",
+                               os.path.join(tempfile.gettempdir(), "step_ingestor_polar_rate_limit.json")
+                           )),
+                           cache=_response_cache())
 
 data_provider = Adapter(adaptee=api_interface,
                         dto_dact=ActivitySummaryDTO,
-                        dto_step=StepSampleDTO)
+                        dto_step=StepSampleDTO,
+                        series=True,
+                        # Raw responses are kept for replay when an archive directory is configured
+                        archive=PayloadArchive(os.environ["POLAR_ARCHIVE_DIR"]) if os.environ.get("POLAR_ARCHIVE_DIR") else None)
 
 engine = create_engine(db_url, pool_pre_ping=True)
-Base.metadata.create_all(engine)
+
+def _days(name):
+    """Optional setting in days"""
+    value = os.environ.get(name)
+    return dt.timedelta(days=int(value)) if value else None
+
+def create_schema():
+    """Run once before the web server and the workers start, see `step_ingestor.client.schema`"""
+    with engine.begin() as conn:
+        return bootstrap_schema(conn,
+                                chunk_interval=_days("STEP_SAMPLE_CHUNK_DAYS") or dt.timedelta(days=7),
+                                partitions=int(os.environ.get("STEP_SAMPLE_PARTITIONS", "0")) or None,
+                                compress_after=_days("STEP_SAMPLE_COMPRESS_AFTER_DAYS"),
+                                retain_for=_days("STEP_SAMPLE_RETENTION_DAYS"))
+
 session_factory = sessionmaker(bind=engine)
 
 def get_db_session():
@@ -30,8 +66,21 @@ def get_db_session():
         g.db_session = session_factory()
     return g.db_session
 
+def make_repo(session):
+    # Packed layout: one `step_day` row per user and day instead of a row per sample
+    return StepIngestorRepository(session=session,
+                                  autocommit=True,
+                                  packed=os.environ.get("STEP_SAMPLE_LAYOUT", "rows") == "packed",
+                                  zero_runs=bool(int(os.environ.get("STEP_SAMPLE_ZERO_RUNS", "0"))))
+
+def make_service(session):
+    # Backfill windows are fetched on this many threads, the calling thread writes them
+    return IngestionService(provider=data_provider,
+                            repo=make_repo(session),
+                            workers=int(os.environ.get("POLAR_BACKFILL_WORKERS", "4")))
+
 def get_repo():
-    return StepIngestorRepository(session=get_db_session(), autocommit=True)
+    return make_repo(get_db_session())
 
 def get_service():
-    return IngestionService(provider=data_provider, repo=get_repo())
+    return make_service(get_db_session())
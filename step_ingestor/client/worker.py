@@ -0,0 +1,44 @@
+"""Runs the refresh jobs the client queues at login and the scheduler queues for stale users.
+
+    python -m step_ingestor.client.worker [--once] [--poll-interval <seconds>] [--processes <n>] [--max-running <n>]
+"""
+import os
+import logging
+import argparse
+import datetime as dt
+import multiprocessing
+
+from step_ingestor.client.src.service.service import session_factory, make_service
+from step_ingestor.services.ingestion import run_refresh_jobs
+
+
+def work(shard, once, poll_interval, max_running):
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+    return run_refresh_jobs(session_factory,
+                            make_service,
+                            once=once,
+                            poll_interval=poll_interval,
+                            lease=dt.timedelta(minutes=int(os.environ.get("REFRESH_JOB_LEASE_MINUTES", "30"))),
+                            shard=shard,
+                            max_running=max_running)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--once", action="store_true", help="exit when no job can be claimed")
+    parser.add_argument("--poll-interval", type=float, default=5.0, help="seconds between polls of an empty queue")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="worker processes, each runs the jobs of its own shard of the users")
+    parser.add_argument("--max-running", type=int, default=None,
+                        help="jobs running at the same time in all workers, including those of other hosts")
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        n_run = work(None, args.once, args.poll_interval, args.max_running)
+    else:
+        # Spawned, so no process inherits the connection pool of another
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(args.processes) as pool:
+            n_run = sum(pool.starmap(work, [((i, args.processes), args.once, args.poll_interval, args.max_running)
+                                            for i in range(args.processes)]))
+    print("Ran {} refresh jobs".format(n_run))
@@ -1,11 +1,21 @@
-from .base import db_url
-from .models import AppUser, ActivitySummary, StepSample, AccessToken, Base
+from .base import db_url, async_db_url
+from .models import AppUser, ActivitySummary, StepSample, StepDay, SyncedRange, IngestJob, AccessToken, Base
+from .maintenance import deduplicate_step_samples
+from .rollups import create_step_rollups
+from .schema import bootstrap_schema
 
 __all__ = [
     "AppUser",
     "ActivitySummary",
     "StepSample",
+    "StepDay",
+    "SyncedRange",
+    "IngestJob",
     "AccessToken",
     "Base",
-    "db_url"
+    "db_url",
+    "async_db_url",
+    "deduplicate_step_samples",
+    "create_step_rollups",
+    "bootstrap_schema"
 ]
\ No newline at end of file
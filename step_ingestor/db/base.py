@@ -17,3 +17,5 @@ db_url = URL.create(
     database=db_name
 )
 
+# Same database through an asyncio driver, for the async repository
+async_db_url = db_url.set(drivername=os.environ.get("DB_ASYNC_DRIVER", "postgresql+asyncpg"))
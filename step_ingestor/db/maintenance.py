@@ -0,0 +1,42 @@
+"""One-off maintenance routines for existing databases."""
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection
+
+from .models import StepSample
+
+
+def deduplicate_step_samples(connection: Connection) -> int:
+    """Remove duplicate step samples and enforce the natural key (user_id, timestamp).
+
+    Tables created before the natural key existed can hold the same sample several times.
+    Of each duplicate group the row with the lowest `sample_id` is kept. Afterwards the primary key
+    is moved to (user_id, timestamp) when needed, so later ingests cannot introduce duplicates again.
+    Returns the number of deleted rows.
+    """
+    table = StepSample.__table__
+
+    duplicate = table.alias("duplicate")
+    stmt = sa.delete(table).where(
+        table.c.user_id == duplicate.c.user_id,
+        table.c.timestamp == duplicate.c.timestamp,
+        table.c.sample_id > duplicate.c.sample_id,
+    )
+    deleted = connection.execute(stmt).rowcount
+
+    natural_key = [c.name for c in table.primary_key.columns]
+    primary_key = sa.inspect(connection).get_pk_constraint(table.name)
+    if primary_key["constrained_columns"] != natural_key:
+        if primary_key["name"]:
+            connection.execute(sa.text("ALTER TABLE {table} DROP CONSTRAINT {name}".format(
+                table=table.name, name=primary_key["name"])))
+        connection.execute(sa.schema.AddConstraint(table.primary_key))
+    return deleted
+
+
+if __name__ == "__main__":
+    from .base import db_url
+
+    engine = sa.create_engine(db_url)
+    with engine.begin() as conn:
+        n_deleted = deduplicate_step_samples(conn)
+    print("Removed {} duplicate step samples".format(n_deleted))
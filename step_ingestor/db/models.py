@@ -2,8 +2,10 @@ import datetime as dt
 from typing import List
 
 from sqlalchemy import (
-    TIMESTAMP, DATE, Interval, ForeignKey, Float, Integer, String, Text, func, UniqueConstraint, BigInteger
+    TIMESTAMP, DATE, Interval, ForeignKey, Float, Integer, String, Text, func, UniqueConstraint, BigInteger, Identity,
+    Index, text
 )
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -28,15 +30,16 @@ class AppUser(Base):
         back_populates="user",
         cascade="all, delete-orphan",
         passive_deletes=True,
-        lazy="selectin"
+        lazy="select"
     )
 
+    # History collections are never loaded with the user, query them through the repository instead.
     # One-to-many relationship with daily summary, indicated with Mapped[List[<table_name>]]
     daily_summaries: Mapped[List["ActivitySummary"]] = relationship(
         back_populates="user",
         cascade="all, delete-orphan",
         passive_deletes=True,
-        lazy="selectin"
+        lazy="raise"
     )
 
     # One-to-many relationship with step, indicated with Mapped[List[<table_name>]]
@@ -44,7 +47,31 @@ class AppUser(Base):
         back_populates="user",
         cascade="all, delete-orphan",
         passive_deletes=True,
-        lazy="selectin"
+        lazy="raise"
+    )
+
+    # One-to-many relationship with packed step days, indicated with Mapped[List[<table_name>]]
+    step_days: Mapped[List["StepDay"]] = relationship(
+        back_populates="user",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        lazy="raise"
+    )
+
+    # One-to-many relationship with synced date ranges, indicated with Mapped[List[<table_name>]]
+    synced_ranges: Mapped[List["SyncedRange"]] = relationship(
+        back_populates="user",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        lazy="raise"
+    )
+
+    # One-to-many relationship with ingest jobs, indicated with Mapped[List[<table_name>]]
+    ingest_jobs: Mapped[List["IngestJob"]] = relationship(
+        back_populates="user",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        lazy="raise"
     )
 
 
@@ -70,7 +97,7 @@ class AccessToken(Base):
     )
     expires_at: Mapped[dt.datetime | None] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
 
-    user: Mapped["AppUser"] = relationship(back_populates="access_token", single_parent=True, lazy="selectin")
+    user: Mapped["AppUser"] = relationship(back_populates="access_token", single_parent=True, lazy="select")
 
     __table_args__ = (UniqueConstraint("user_id"),)
 
@@ -111,7 +138,7 @@ class ActivitySummary(Base):
     )
 
     # Backref to parent: app_user
-    user: Mapped["AppUser"] = relationship(back_populates="daily_summaries", lazy="selectin")
+    user: Mapped["AppUser"] = relationship(back_populates="daily_summaries", lazy="select")
 
 
 class StepSample(Base):
@@ -122,13 +149,91 @@ class StepSample(Base):
             'time_column_name': 'timestamp'
         }
     })
-    sample_id: Mapped[int] = mapped_column(BigInteger, autoincrement=True, primary_key=True)
+    # Surrogate row number, the natural key (user_id, timestamp) is the primary key.
+    # Unique indexes of a hypertable must contain its time and partitioning columns.
+    sample_id: Mapped[int] = mapped_column(BigInteger, Identity(), nullable=False)
     user_id: Mapped[str] = mapped_column(
         String,
-        ForeignKey("app_user.user_id", ondelete="CASCADE")
+        ForeignKey("app_user.user_id", ondelete="CASCADE"),
+        primary_key=True
     )
-    timestamp: Mapped[dt.datetime] = mapped_column(TIMESTAMP(timezone=True))
+    timestamp: Mapped[dt.datetime] = mapped_column(TIMESTAMP(timezone=True), primary_key=True)
     steps: Mapped[int] = mapped_column(Integer, nullable=False)
 
     # Backref to parent: app_user
-    user: Mapped["AppUser"] = relationship(back_populates="steps", lazy="selectin")
+    user: Mapped["AppUser"] = relationship(back_populates="steps", lazy="select")
+
+
+class StepDay(Base):
+    """Step samples of one user and day packed into a single row, an alternative to one `step_sample` row
+    per sample. Element `k` of `counts` covers `start + k * interval_ms`:
+    a count, NULL when Polar sent no sample for the interval, or `-n` for a run of n samples of zero steps."""
+    __tablename__ = "step_day"
+
+    user_id: Mapped[str] = mapped_column(
+        String,
+        ForeignKey("app_user.user_id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    day: Mapped[dt.date] = mapped_column(DATE, primary_key=True)
+    start: Mapped[dt.datetime] = mapped_column(TIMESTAMP(timezone=True), nullable=False)
+    interval_ms: Mapped[int] = mapped_column(Integer, nullable=False)
+    counts: Mapped[list[int | None]] = mapped_column(ARRAY(Integer), nullable=False)
+
+    # Backref to parent: app_user
+    user: Mapped["AppUser"] = relationship(back_populates="step_days", lazy="select")
+
+
+class SyncedRange(Base):
+    """Days from `date_from` to `date_to`, both included, that were fetched from the Polar API completely,
+    including days without data. Overlapping and adjacent ranges of a user are merged into one row."""
+    __tablename__ = "synced_range"
+
+    user_id: Mapped[str] = mapped_column(
+        String,
+        ForeignKey("app_user.user_id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    date_from: Mapped[dt.date] = mapped_column(DATE, primary_key=True)
+    date_to: Mapped[dt.date] = mapped_column(DATE, nullable=False)
+    synced_at: Mapped[dt.datetime] = mapped_column(
+        TIMESTAMP(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+
+    # Backref to parent: app_user
+    user: Mapped["AppUser"] = relationship(back_populates="synced_ranges", lazy="select")
+
+
+class IngestJob(Base):
+    """Refresh of a user's data from the Polar API, queued by the client and run by a worker.
+    Workers claim queued jobs with `FOR UPDATE SKIP LOCKED`, a user has at most one queued or running job."""
+    __tablename__ = "ingest_job"
+
+    __table_args__ = (
+        Index("ix_ingest_job_active_user", "user_id", unique=True,
+              postgresql_where=text("status IN ('queued', 'running')")),
+        Index("ix_ingest_job_queued", text("priority DESC"), "created_at", postgresql_where=text("status = 'queued'")),
+    )
+
+    job_id: Mapped[int] = mapped_column(BigInteger, Identity(), primary_key=True)
+    user_id: Mapped[str] = mapped_column(
+        String,
+        ForeignKey("app_user.user_id", ondelete="CASCADE"),
+        nullable=False
+    )
+    status: Mapped[str] = mapped_column(String, server_default="queued", nullable=False)  # queued, running, done, failed
+    attempts: Mapped[int] = mapped_column(Integer, server_default="0", nullable=False)
+    priority: Mapped[int] = mapped_column(Integer, server_default="0", nullable=False)  # Higher is claimed first
+    error: Mapped[str | None] = mapped_column(Text)
+    created_at: Mapped[dt.datetime] = mapped_column(
+        TIMESTAMP(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+    started_at: Mapped[dt.datetime | None] = mapped_column(TIMESTAMP(timezone=True))
+    finished_at: Mapped[dt.datetime | None] = mapped_column(TIMESTAMP(timezone=True))
+
+    # Backref to parent: app_user
+    user: Mapped["AppUser"] = relationship(back_populates="ingest_jobs", lazy="select")
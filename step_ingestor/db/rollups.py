@@ -0,0 +1,91 @@
+"""Precomputed hourly and daily step totals per user.
+
+When `step_sample` is a TimescaleDB hypertable the rollups are continuous aggregates that
+Timescale keeps up to date. Otherwise they are plain tables that the repository refreshes
+at ingest time. Both variants expose the same columns: user_id, bucket and steps.
+"""
+import datetime as dt
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection
+
+from .models import AppUser
+
+CONTINUOUS_AGGREGATE = "continuous_aggregate"
+TABLE = "table"
+
+# Not part of `Base.metadata`, the rollups are created by `create_step_rollups`
+rollup_metadata = sa.MetaData()
+
+
+def _rollup_table(name: str) -> sa.Table:
+    return sa.Table(
+        name,
+        rollup_metadata,
+        sa.Column("user_id", sa.String, sa.ForeignKey(AppUser.user_id, ondelete="CASCADE"), primary_key=True),
+        sa.Column("bucket", sa.TIMESTAMP(timezone=True), primary_key=True),
+        sa.Column("steps", sa.BigInteger, nullable=False),
+    )
+
+
+step_rollup_hourly = _rollup_table("step_rollup_hourly")
+step_rollup_daily = _rollup_table("step_rollup_daily")
+
+# Bucket field, rollup table and Timescale bucket width / policy schedule
+STEP_ROLLUPS = {
+    "hour": (step_rollup_hourly, "1 hour", "30 minutes"),
+    "day": (step_rollup_daily, "1 day", "1 hour"),
+}
+
+
+def _has_hypertable(connection: Connection, table_name: str) -> bool:
+    has_extension = connection.execute(
+        sa.text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'timescaledb')")
+    ).scalar_one()
+    if not has_extension:
+        return False
+    return connection.execute(
+        sa.text("SELECT EXISTS (SELECT 1 FROM timescaledb_information.hypertables "
+                "WHERE hypertable_name = :name)"),
+        {"name": table_name}
+    ).scalar_one()
+
+
+def create_step_rollups(connection: Connection, refresh_window: dt.timedelta | None = None) -> str:
+    """Create the hourly and daily rollups of `step_sample` if they do not exist yet.
+    `refresh_window` limits how far back the continuous aggregate policy refreshes, None refreshes all.
+    Returns the kind of rollup in use."""
+    if not _has_hypertable(connection, "step_sample"):
+        rollup_metadata.create_all(connection)
+        return rollup_kind(connection)
+
+    for table, width, schedule in STEP_ROLLUPS.values():
+        # Real-time aggregation, reads combine materialized buckets with not yet materialized samples
+        connection.execute(sa.text(
+            """
+            CREATE MATERIALIZED VIEW IF NOT EXISTS {name}
+            WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+            SELECT user_id, time_bucket(INTERVAL '{width}', timestamp) AS bucket, sum(steps)::bigint AS steps
+            FROM step_sample
+            GROUP BY user_id, bucket
+            WITH NO DATA
+            """.format(name=table.name, width=width)
+        ))
+        connection.execute(
+            sa.text("SELECT add_continuous_aggregate_policy(:name, start_offset => CAST(:start AS INTERVAL), "
+                    "end_offset => CAST(:width AS INTERVAL), schedule_interval => CAST(:schedule AS INTERVAL), "
+                    "if_not_exists => true)"),
+            {"name": table.name, "start": refresh_window, "width": width, "schedule": schedule}
+        )
+    return rollup_kind(connection)
+
+
+def rollup_kind(connection: Connection) -> str | None:
+    """Return whether the rollups are continuous aggregates or tables, None when they do not exist."""
+    # Cast, asyncpg returns the "char" type as bytes
+    relkind = connection.execute(
+        sa.text("SELECT relkind::text FROM pg_class WHERE oid = to_regclass(:name)"),
+        {"name": step_rollup_hourly.name}
+    ).scalar_one_or_none()
+    # Continuous aggregates show up as views on top of their materialization hypertable
+    return {"r": TABLE, "v": CONTINUOUS_AGGREGATE}.get(relkind)
@@ -0,0 +1,83 @@
+"""Creates the database schema and configures `step_sample` as a TimescaleDB hypertable."""
+import datetime as dt
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection
+
+from .models import Base, StepSample
+from .rollups import create_step_rollups
+
+_SCHEMA_LOCK = 0x5354_5343  # Advisory lock key held while the schema is created
+
+
+def _enable_timescaledb(connection: Connection) -> bool:
+    """Install the TimescaleDB extension when the server provides it."""
+    available = connection.execute(
+        sa.text("SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb')")
+    ).scalar_one()
+    if available:
+        connection.execute(sa.text("CREATE EXTENSION IF NOT EXISTS timescaledb"))
+    return available
+
+
+def bootstrap_schema(connection: Connection,
+                     *,
+                     chunk_interval: dt.timedelta = dt.timedelta(days=7),
+                     partitions: int | None = None,
+                     compress_after: dt.timedelta | None = None,
+                     retain_for: dt.timedelta | None = None) -> bool:
+    """Create all tables and set up `step_sample` as a hypertable. Safe to run on every start.
+
+    :param chunk_interval: time range covered by one chunk, applies to chunks created from now on
+    :param partitions: number of hash partitions on `user_id`, only applied when the hypertable is created
+    :param compress_after: compress chunks older than this, segmented by user
+    :param retain_for: drop raw samples older than this, the rollups keep the hourly and daily totals
+    Returns True when `step_sample` is a hypertable, False on plain PostgreSQL.
+    Concurrent calls, e.g. of several containers starting at once, run one after another.
+    """
+    connection.execute(sa.text("SELECT pg_advisory_xact_lock(:key)"), {"key": _SCHEMA_LOCK})
+    Base.metadata.create_all(connection)
+
+    if not _enable_timescaledb(connection):
+        create_step_rollups(connection)
+        return False
+
+    table = StepSample.__table__.name
+    connection.execute(
+        sa.text("SELECT create_hypertable(:table, 'timestamp', "
+                "partitioning_column => :partitioning_column, number_partitions => :partitions, "
+                "chunk_time_interval => :chunk_interval, if_not_exists => true, migrate_data => true)"),
+        {"table": table,
+         "partitioning_column": "user_id" if partitions else None,
+         "partitions": partitions,
+         "chunk_interval": chunk_interval}
+    )
+    connection.execute(sa.text("SELECT set_chunk_time_interval(:table, :chunk_interval)"),
+                       {"table": table, "chunk_interval": chunk_interval})
+
+    compression_enabled = connection.execute(
+        sa.text("SELECT compression_enabled FROM timescaledb_information.hypertables "
+                "WHERE hypertable_name = :table"),
+        {"table": table}
+    ).scalar_one()
+    if compress_after is not None and not compression_enabled:
+        connection.execute(sa.text(
+            "ALTER TABLE {table} SET (timescaledb.compress, "
+            "timescaledb.compress_segmentby = 'user_id', "
+            "timescaledb.compress_orderby = 'timestamp')".format(table=table)
+        ))
+    if compress_after is not None:
+        connection.execute(
+            sa.text("SELECT add_compression_policy(:table, CAST(:after AS INTERVAL), if_not_exists => true)"),
+            {"table": table, "after": compress_after}
+        )
+
+    if retain_for is not None:
+        connection.execute(
+            sa.text("SELECT add_retention_policy(:table, CAST(:retain_for AS INTERVAL), if_not_exists => true)"),
+            {"table": table, "retain_for": retain_for}
+        )
+
+    # Continuous aggregates must not be refreshed over dropped chunks, that would remove their totals
+    create_step_rollups(connection, refresh_window=retain_for)
+    return True
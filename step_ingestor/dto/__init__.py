@@ -1,8 +1,15 @@
-from .dto import StepSampleDTO, ActivitySummaryDTO, UserDTO, TokenDTO
+from .dto import StepSampleDTO, StepSampleColumns, StepSeries, StepBucketDTO, IngestJobDTO, ActivitySummaryDTO, UserDTO, TokenDTO
+from .dto import step_sample_records, parse_timestamps
 
 __all__ = [
     "StepSampleDTO",
+    "StepSampleColumns",
+    "StepSeries",
+    "StepBucketDTO",
+    "IngestJobDTO",
     "ActivitySummaryDTO",
     "UserDTO",
-    "TokenDTO"
+    "TokenDTO",
+    "step_sample_records",
+    "parse_timestamps"
 ]
\ No newline at end of file
@@ -1,6 +1,11 @@
 """Contains DTOs for Step Samples and for Daily Activity Summary"""
 import datetime as dt
+from itertools import repeat
+from operator import itemgetter
+from typing import Any, Iterable, Iterator, Mapping, Sequence
 
+import numpy as np
+import pandas as pd
 from pydantic import BaseModel, Field, ConfigDict
 
 
@@ -28,6 +33,271 @@ class StepSampleDTO(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+# Character positions of `YYYY-MM-DDTHH:MM:SS.fffffffff`
+_TS_WIDTH = 29
+_TS_SEPARATORS = {4: b"-", 7: b"-", 10: b"T", 13: b":", 16: b":", 19: b"."}
+_TS_DIGITS = [i for i in range(_TS_WIDTH) if i not in _TS_SEPARATORS]
+# Weights that combine the digits into year, month, day, hour, minute, second and microsecond
+_TS_FIELDS = np.zeros((len(_TS_DIGITS), 7))
+for _field, _digits in enumerate([(0, 4), (4, 6), (6, 8), (8, 10), (10, 12), (12, 14), (14, 20)]):
+    _start, _stop = _digits
+    _TS_FIELDS[_start:_stop, _field] = 10.0 ** np.arange(_stop - _start - 1, -1, -1)
+
+
+def parse_timestamps(values: Sequence[str]) -> np.ndarray:
+    """Naive ISO 8601 timestamps `YYYY-MM-DDTHH:MM[:SS[.fffffffff]]` to datetime64[us] (truncated).
+    The characters of all values are combined into their fields with one matrix product,
+    other formats such as timestamps with an offset are left to NumPy's parser."""
+    try:
+        chars = np.array(values, dtype=bytes)
+    except UnicodeEncodeError:
+        chars = None
+    if chars is None or len(chars) == 0 or chars.dtype.itemsize > _TS_WIDTH:
+        return np.array(values, dtype="datetime64[ns]").astype("datetime64[us]")
+
+    codes = chars.astype("S{}".format(_TS_WIDTH)).view(np.uint8).reshape(len(chars), _TS_WIDTH)
+    digits = codes[:, _TS_DIGITS]
+    present = digits != 0  # Shorter values are padded with NUL
+    digits = np.where(present, digits - ord("0"), 0)
+    valid = (codes[:, :16] != 0).all() and (digits <= 9).all()
+    for position, separator in _TS_SEPARATORS.items():
+        valid = valid and ((codes[:, position] == ord(separator)) | (codes[:, position] == 0)).all()
+    if not valid:
+        return np.array(values, dtype="datetime64[ns]").astype("datetime64[us]")
+
+    year, month, day, hour, minute, second, microsecond = (digits @ _TS_FIELDS).astype(np.int64).T
+    days = ((year - 1970) * 12 + month - 1).astype("datetime64[M]").astype("datetime64[D]") + (day - 1)
+    microseconds = ((hour * 60 + minute) * 60 + second) * 1_000_000 + microsecond
+    return days.astype("datetime64[us]") + microseconds.astype("timedelta64[us]")
+
+
+class StepSampleColumns:
+    """Step samples of one user and day as columns: `timestamps` (datetime64[us], naive like Polar sends them)
+    and `steps` (int32). Replaces a list of `StepSampleDTO` when the adapter parses in columnar mode."""
+    __slots__ = ("user_id", "timestamps", "steps")
+
+    def __init__(self, user_id: str, timestamps: np.ndarray, steps: np.ndarray):
+        if len(timestamps) != len(steps):
+            raise ValueError("timestamps and steps must have the same length")
+        self.user_id = user_id
+        self.timestamps = timestamps
+        self.steps = steps
+
+    @classmethod
+    def from_samples(cls, samples: Sequence[Mapping[str, Any]], user_id: str) -> "StepSampleColumns":
+        """Parse Polar's `samples.steps.samples`, all timestamp strings are converted in one vectorised pass"""
+        timestamps = parse_timestamps(list(map(itemgetter("timestamp"), samples)))
+        steps = np.fromiter(map(itemgetter("steps"), samples), dtype=np.int32, count=len(samples))
+        return cls(user_id, timestamps, steps)
+
+    def records(self) -> Iterator[tuple[str, dt.datetime, int]]:
+        """(user_id, timestamp, steps) per sample"""
+        return zip(repeat(self.user_id), self.timestamps.tolist(), self.steps.tolist())
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __eq__(self, other):
+        if not isinstance(other, StepSampleColumns):
+            return NotImplemented
+        return (self.user_id == other.user_id
+                and np.array_equal(self.timestamps, other.timestamps)
+                and np.array_equal(self.steps, other.steps))
+
+    def __repr__(self):
+        return "StepSampleColumns(user_id={!r}, samples={})".format(self.user_id, len(self))
+
+
+def _count_dtype(max_count) -> type:
+    return np.uint16 if max_count <= np.iinfo(np.uint16).max else np.int32
+
+
+class StepSeries:
+    """Step samples of one user and day as a regular series: the count of interval `k` covers
+    `start + k * interval_ms`. Only `counts` is stored per interval, as uint16 when the counts fit,
+    plus a bit per interval (`packbits`) when Polar left intervals out. Missing intervals count zero steps
+    and are not stored as samples. `start` is naive, in `tz` when given (series read from the database)."""
+    __slots__ = ("user_id", "start", "interval_ms", "counts", "_present", "tz")
+
+    def __init__(self, user_id: str, start: np.datetime64, interval_ms: int, counts: np.ndarray,
+                 present: np.ndarray | None = None, tz: dt.tzinfo | None = None):
+        if present is not None and len(present) != len(counts):
+            raise ValueError("present and counts must have the same length")
+        self.user_id = user_id
+        self.start = np.datetime64(start, "us")
+        self.interval_ms = int(interval_ms)
+        self.counts = counts
+        self._present = None if present is None or present.all() else np.packbits(present)
+        self.tz = tz
+
+    @classmethod
+    def from_columns(cls, columns: StepSampleColumns, interval_ms: int) -> "StepSeries | None":
+        """Series of the same samples, or None when they are not on a grid of `interval_ms` from the first one"""
+        if not len(columns) or interval_ms <= 0:
+            return None
+        offsets = (columns.timestamps - columns.timestamps[0]).astype(np.int64)
+        slots, remainders = np.divmod(offsets, interval_ms * 1000)
+        if remainders.any() or (np.diff(slots) <= 0).any() or columns.steps.min() < 0:
+            return None
+
+        counts = np.zeros(slots[-1] + 1, dtype=_count_dtype(columns.steps.max()))
+        counts[slots] = columns.steps
+        present = None
+        if len(slots) != len(counts):
+            present = np.zeros(len(counts), dtype=bool)
+            present[slots] = True
+        return cls(columns.user_id, columns.timestamps[0], interval_ms, counts, present)
+
+    @classmethod
+    def from_samples(cls, samples: Sequence[Mapping[str, Any]], user_id: str,
+                     interval_ms: int) -> "StepSeries | StepSampleColumns":
+        """Parse Polar's `samples.steps.samples`, falls back to `StepSampleColumns` for irregular samples"""
+        columns = StepSampleColumns.from_samples(samples, user_id)
+        series = cls.from_columns(columns, interval_ms)
+        return series if series is not None else columns
+
+    @classmethod
+    def from_packed(cls, user_id: str, start: dt.datetime, interval_ms: int,
+                    packed: Sequence[int | None]) -> "StepSeries":
+        """Inverse of `pack`. An aware `start` is converted to UTC and kept as `tz`"""
+        tz = None
+        if start.tzinfo is not None:
+            start, tz = start.astimezone(dt.timezone.utc).replace(tzinfo=None), dt.timezone.utc
+        values = np.array(packed, dtype=np.float64)  # None becomes NaN
+        missing = np.isnan(values)
+        runs = values < 0
+        widths = np.where(runs, -values, 1).astype(np.int64)
+        steps = np.where(runs | missing, 0, values)
+        counts = np.repeat(steps, widths).astype(_count_dtype(steps.max(initial=0)))
+        return cls(user_id, np.datetime64(start, "us"), interval_ms, counts, np.repeat(~missing, widths), tz)
+
+    def pack(self, zero_runs: bool = False) -> list[int | None]:
+        """Counts as a list with None for missing intervals. With `zero_runs` every run of two or more
+        samples of zero steps is replaced by minus its length."""
+        values = self.counts.tolist()
+        present = self.present
+        if present is not None:
+            for slot in np.flatnonzero(~present).tolist():
+                values[slot] = None
+        if not zero_runs:
+            return values
+
+        zeros = self.counts == 0
+        if present is not None:
+            zeros &= present
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], zeros.view(np.int8), [0]))))
+        packed, position = [], 0
+        for run_start, run_end in edges.reshape(-1, 2).tolist():
+            if run_end - run_start < 2:
+                continue
+            packed.extend(values[position:run_start])
+            packed.append(run_start - run_end)
+            position = run_end
+        packed.extend(values[position:])
+        return packed
+
+    def split(self, at: np.datetime64) -> tuple["StepSeries | None", "StepSeries | None"]:
+        """The samples before `at` and the others, None for a part without samples"""
+        timestamps, steps = self.timestamps, self.steps
+        position = int(np.searchsorted(timestamps, np.datetime64(at, "us")))
+        parts = []
+        for part in (slice(None, position), slice(position, None)):
+            series = StepSeries.from_columns(StepSampleColumns(self.user_id, timestamps[part], steps[part]),
+                                             self.interval_ms)
+            if series is not None:
+                series.tz = self.tz
+            parts.append(series)
+        return parts[0], parts[1]
+
+    @property
+    def present(self) -> np.ndarray | None:
+        """Mask of the intervals Polar sent a sample for, None when it sent all of them"""
+        if self._present is None:
+            return None
+        return np.unpackbits(self._present, count=len(self.counts)).view(bool)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """datetime64[us] of the stored samples"""
+        slots = np.arange(len(self.counts), dtype=np.int64)
+        if self._present is not None:
+            slots = slots[self.present]
+        return self.start + (slots * (self.interval_ms * 1000)).astype("timedelta64[us]")
+
+    @property
+    def steps(self) -> np.ndarray:
+        return self.counts if self._present is None else self.counts[self.present]
+
+    @property
+    def nbytes(self) -> int:
+        return self.counts.nbytes + (self._present.nbytes if self._present is not None else 0)
+
+    def records(self) -> Iterator[tuple[str, dt.datetime, int]]:
+        """(user_id, timestamp, steps) per stored sample"""
+        timestamps = self.timestamps.tolist()
+        if self.tz is not None:
+            timestamps = [t.replace(tzinfo=self.tz) for t in timestamps]
+        return zip(repeat(self.user_id), timestamps, self.steps.tolist())
+
+    def to_pandas(self) -> pd.Series:
+        """Counts of every interval indexed by their start, missing intervals as zero.
+        The series is a view of `counts`, nothing is copied."""
+        index = pd.date_range(start=pd.Timestamp(self.start), periods=len(self.counts),
+                              freq=pd.Timedelta(milliseconds=self.interval_ms), tz=self.tz, name="timestamp")
+        return pd.Series(self.counts, index=index, name="steps", copy=False)
+
+    def __len__(self):
+        if self._present is None:
+            return len(self.counts)
+        return int(np.unpackbits(self._present).sum())
+
+    def __eq__(self, other):
+        if not isinstance(other, StepSeries):
+            return NotImplemented
+        return (self.user_id == other.user_id
+                and self.start == other.start
+                and self.interval_ms == other.interval_ms
+                and np.array_equal(self.counts, other.counts)
+                and np.array_equal(self.present if self._present is not None else [],
+                                   other.present if other._present is not None else []))
+
+    def __repr__(self):
+        return "StepSeries(user_id={!r}, start={}, interval_ms={}, samples={})".format(
+            self.user_id, self.start, self.interval_ms, len(self))
+
+
+def step_sample_records(samples: Iterable[Sequence[StepSampleDTO] | StepSampleColumns | StepSeries | None]
+                        ) -> Iterator[tuple[str, dt.datetime, int]]:
+    """(user_id, timestamp, steps) of every sample of several days, columnar days without per-sample models"""
+    for day in samples:
+        if isinstance(day, (StepSampleColumns, StepSeries)):
+            yield from day.records()
+        else:
+            for s in day or ():
+                yield s.user_id, s.timestamp, s.steps
+
+
+class StepBucketDTO(BaseModel):
+    """Sum of step samples in a time bucket starting at `timestamp`"""
+    timestamp: dt.datetime
+    steps: int
+    model_config = ConfigDict(from_attributes=True)
+
+
+class IngestJobDTO(BaseModel):
+    """Queued, running or finished refresh of a user's data"""
+    job_id: int
+    user_id: str
+    status: str
+    attempts: int
+    priority: int = 0
+    error: str | None = None
+    created_at: dt.datetime
+    started_at: dt.datetime | None = None
+    finished_at: dt.datetime | None = None
+    model_config = ConfigDict(from_attributes=True)
+
+
 class ActivitySummaryDTO(BaseModel):
     user_id: str
     date: dt.date
@@ -40,10 +310,10 @@ class ActivitySummaryDTO(BaseModel):
     calories: int
     active_calories: int
     total_steps: int = Field(alias="steps")
-    step_samples: list[StepSampleDTO] | None = None
+    step_samples: list[StepSampleDTO] | StepSampleColumns | StepSeries | None = None
     inactivity_alert_count: int
     distance_from_steps: float
-    model_config = ConfigDict(from_attributes=True)
+    model_config = ConfigDict(from_attributes=True, arbitrary_types_allowed=True)
 
 if __name__ == "__main__":
     from datetime import datetime
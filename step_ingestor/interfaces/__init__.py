@@ -1,7 +1,18 @@
 from .polar.accesslink import AccessLink
-from .repositories import StepIngestorRepository
+from .polar.async_accesslink import AsyncAccessLink
+from .polar.rate_limit import RateLimiter
+from .polar.archive import PayloadArchive
+from .polar.cache import ResponseCache, MemoryBackend, DiskBackend
+from .repositories import StepIngestorRepository, AsyncStepIngestorRepository
 
 __all__ = [
     "AccessLink",
-    "StepIngestorRepository"
+    "AsyncAccessLink",
+    "RateLimiter",
+    "PayloadArchive",
+    "ResponseCache",
+    "MemoryBackend",
+    "DiskBackend",
+    "StepIngestorRepository",
+    "AsyncStepIngestorRepository"
 ]
@@ -1,5 +1,16 @@
 from .accesslink import AccessLink
+from .async_accesslink import AsyncAccessLink
+from .rate_limit import RateLimiter
+from .archive import PayloadArchive, ArchivedPayload
+from .cache import ResponseCache, MemoryBackend, DiskBackend
 
 __all__ = [
-    "AccessLink"
+    "AccessLink",
+    "AsyncAccessLink",
+    "RateLimiter",
+    "PayloadArchive",
+    "ArchivedPayload",
+    "ResponseCache",
+    "MemoryBackend",
+    "DiskBackend"
 ]
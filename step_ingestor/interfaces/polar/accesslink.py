@@ -5,7 +5,10 @@ from .oauth2 import OAuth2Client
 class AccessLink(object):
     """Wrapper class for Polar Open AccessLink API v3"""
 
-    def __init__(self, api_url, auth_url, token_url, client_id, client_secret, redirect_url=None):
+    def __init__(self, api_url, auth_url, token_url, client_id, client_secret, redirect_url=None, **transport):
+        """
+        :param transport: pooling, timeout and retry settings passed on to `OAuth2Client`
+        """
         if not client_id or not client_secret:
             raise ValueError("Client id and secret must be provided.")
 
@@ -14,7 +17,8 @@ class AccessLink(object):
                                   access_token_url=token_url,
                                   client_id=client_id,
                                   client_secret=client_secret,
-                                  redirect_url=redirect_url)
+                                  redirect_url=redirect_url,
+                                  **transport)
 
         self.users = endpoints.Users(oauth=self.oauth)
         self.daily_activity_beta = endpoints.DailyActivityBeta(oauth=self.oauth)
@@ -24,6 +28,10 @@ class AccessLink(object):
         """Get the authorization url for the client"""
         return self.oauth.get_authorization_url()
 
+    def connection_stats(self):
+        """Connection reuse statistics of the underlying HTTP transport"""
+        return self.oauth.connection_stats()
+
     def get_access_token(self, authorization_code):
         """Request access token for a user.
         :param authorization_code: authorization code received from authorization endpoint.
@@ -54,3 +62,18 @@ class AccessLink(object):
                                               steps=steps,
                                               activity_zones=activity_zones,
                                               inactivity_stamps=inactivity_stamps)
+
+    def iter_activity_date_range(self,
+                                 access_token,
+                                 date_from,
+                                 date_to=None,
+                                 steps=False,
+                                 activity_zones=False,
+                                 inactivity_stamps=False):
+        """Days of the range one at a time, parsed while the response is received"""
+        return self.daily_activity_beta.iter_fetch(access_token=access_token,
+                                                   from_=date_from,
+                                                   to=date_to,
+                                                   steps=steps,
+                                                   activity_zones=activity_zones,
+                                                   inactivity_stamps=inactivity_stamps)
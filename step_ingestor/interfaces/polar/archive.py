@@ -0,0 +1,72 @@
+import os
+import gzip
+import json
+import time
+from pathlib import Path
+from typing import Iterator, NamedTuple, Any
+
+from .json_backend import loads
+
+
+class ArchivedPayload(NamedTuple):
+    user_id: str
+    date_from: str
+    date_to: str
+    fetched_at: int  # nanoseconds since epoch
+    raw: Any
+
+
+class PayloadArchive(object):
+    """Append-only archive of raw Polar responses.
+
+    Every response is written once as gzip compressed JSON to
+    `<root>/<user_id>/<date_from>_<date_to>_<fetched_at>.json.gz` and never modified afterwards,
+    so refetching a window adds a file next to the earlier ones.
+    """
+
+    SUFFIX = ".json.gz"
+
+    def __init__(self, root, compresslevel=6):
+        self.root = Path(root)
+        self.compresslevel = compresslevel
+
+    def write(self, user_id, date_from, date_to, raw) -> Path:
+        """Store the raw response of one window"""
+        directory = self.root / str(user_id)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        fetched_at = time.time_ns()
+        path = directory / "{}_{}_{}{}".format(date_from, date_to or date_from, fetched_at, self.SUFFIX)
+        tmp = path.with_name("." + path.name + ".tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=self.compresslevel) as f:
+            json.dump(raw, f)
+        # Readers never see a partially written file
+        os.replace(tmp, path)
+        return path
+
+    def user_ids(self) -> list[str]:
+        if not self.root.is_dir():
+            return []
+        return sorted(p.name for p in self.root.iterdir() if p.is_dir())
+
+    def iter_payloads(self, user_id=None) -> Iterator[ArchivedPayload]:
+        """Archived responses of one or all users. Per user they are yielded in the order they were fetched,
+        so later responses of the same window are replayed over earlier ones."""
+        for user_id_ in ([str(user_id)] if user_id else self.user_ids()):
+            directory = self.root / user_id_
+            if not directory.is_dir():
+                continue
+
+            entries = []
+            for path in directory.glob("*" + self.SUFFIX):
+                date_from, date_to, fetched_at = path.name[:-len(self.SUFFIX)].split("_")
+                entries.append((int(fetched_at), date_from, date_to, path))
+
+            for fetched_at, date_from, date_to, path in sorted(entries):
+                with gzip.open(path, "rb") as f:
+                    raw = loads(f.read())
+                yield ArchivedPayload(user_id=user_id_,
+                                      date_from=date_from,
+                                      date_to=date_to,
+                                      fetched_at=fetched_at,
+                                      raw=raw)
@@ -0,0 +1,103 @@
+import asyncio
+
+from . import endpoints
+from .async_oauth2 import AsyncOAuth2Client
+
+
+class AsyncAccessLink(object):
+    """Asynchronous wrapper class for Polar Open AccessLink API v3.
+    Requests of all users share one connection pool and at most `concurrency` are in flight at once."""
+
+    def __init__(self, api_url, auth_url, token_url, client_id, client_secret, redirect_url=None, **transport):
+        """
+        :param transport: concurrency, pooling, timeout and retry settings passed on to `AsyncOAuth2Client`
+        """
+        if not client_id or not client_secret:
+            raise ValueError("Client id and secret must be provided.")
+
+        self.oauth = AsyncOAuth2Client(api_url=api_url,
+                                       authorization_url=auth_url,
+                                       access_token_url=token_url,
+                                       client_id=client_id,
+                                       client_secret=client_secret,
+                                       redirect_url=redirect_url,
+                                       **transport)
+
+        # `Users` only passes the transport's result through, so it works with the async transport as is
+        self.users = endpoints.Users(oauth=self.oauth)
+        self.daily_activity_beta = endpoints.AsyncDailyActivityBeta(oauth=self.oauth)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.oauth.aclose()
+
+    @property
+    def authorization_url(self):
+        """Get the authorization url for the client"""
+        return self.oauth.get_authorization_url()
+
+    async def get_access_token(self, authorization_code):
+        """Request access token for a user.
+        :param authorization_code: authorization code received from authorization endpoint.
+        """
+        return await self.oauth.get_access_token(authorization_code)
+
+    async def get_activity_day(self,
+                               access_token,
+                               day,
+                               steps=False,
+                               activity_zones=False,
+                               inactivity_stamps=False):
+        return await self.daily_activity_beta.fetch(access_token, day,
+                                                    steps=steps,
+                                                    activity_zones=activity_zones,
+                                                    inactivity_stamps=inactivity_stamps)
+
+    async def get_activity_date_range(self,
+                                      access_token,
+                                      date_from,
+                                      date_to=None,
+                                      steps=False,
+                                      activity_zones=False,
+                                      inactivity_stamps=False):
+        return await self.daily_activity_beta.fetch(access_token=access_token,
+                                                    from_=date_from,
+                                                    to=date_to,
+                                                    steps=steps,
+                                                    activity_zones=activity_zones,
+                                                    inactivity_stamps=inactivity_stamps)
+
+    def iter_activity_date_range(self,
+                                 access_token,
+                                 date_from,
+                                 date_to=None,
+                                 steps=False,
+                                 activity_zones=False,
+                                 inactivity_stamps=False):
+        """Days of the range one at a time as an async iterator, parsed while the response is received"""
+        return self.daily_activity_beta.iter_fetch(access_token=access_token,
+                                                   from_=date_from,
+                                                   to=date_to,
+                                                   steps=steps,
+                                                   activity_zones=activity_zones,
+                                                   inactivity_stamps=inactivity_stamps)
+
+    async def get_activity_date_ranges(self,
+                                       access_token,
+                                       ranges,
+                                       steps=False,
+                                       activity_zones=False,
+                                       inactivity_stamps=False):
+        """Fetch several (date_from, date_to) ranges concurrently, results are in the order of `ranges`"""
+        return await asyncio.gather(*(
+            self.get_activity_date_range(access_token, date_from, date_to,
+                                         steps=steps,
+                                         activity_zones=activity_zones,
+                                         inactivity_stamps=inactivity_stamps)
+            for date_from, date_to in ranges
+        ))
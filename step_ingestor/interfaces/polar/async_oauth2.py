@@ -0,0 +1,205 @@
+import asyncio
+
+import httpx
+from requests.exceptions import HTTPError
+
+from .oauth2 import OAuth2Client, RETRY_STATUSES, retry_delay
+from .json_backend import loads
+from .streaming import JsonArrayParser
+
+
+class AsyncOAuth2Client(object):
+    """Asynchronous counterpart of `OAuth2Client`, on a pooled `httpx.AsyncClient`"""
+
+    def __init__(self, api_url, authorization_url, access_token_url, redirect_url,
+                 client_id, client_secret,
+                 concurrency=8, pool_size=10, timeout=(3.05, 30), retries=3, backoff_factor=0.5, backoff_jitter=0.5,
+                 rate_limiter=None, cache=None):
+        """
+        :param concurrency: maximum number of requests in flight at once, across all users of the client
+        :param pool_size: number of keep-alive connections kept open
+        :param timeout: (connect, read) timeout in seconds for every request
+        :param retries: retries on connection errors and on 429/5xx responses, `Retry-After` is honoured
+        :param backoff_factor: base of the exponential backoff between retries in seconds
+        :param backoff_jitter: maximum random seconds added to each backoff
+        :param rate_limiter: `RateLimiter` every request and retry waits for, fed with the rate-limit headers of the responses
+        :param cache: `ResponseCache` for user level GET requests
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be positive")
+
+        self.url = api_url
+        self.authorization_url = authorization_url
+        self.access_token_url = access_token_url
+        self.redirect_url = redirect_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backoff_jitter = backoff_jitter
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+
+        connect, read = timeout
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=max(pool_size, concurrency), max_keepalive_connections=pool_size),
+        )
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # Created lazily, so it binds to the event loop the client is used in
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def get_auth_headers(self, access_token):
+        """Get authorization headers for user level api resources"""
+        return OAuth2Client.get_auth_headers(self, access_token)
+
+    def get_authorization_url(self, response_type="code"):
+        """Build authorization url for the client"""
+        return OAuth2Client.get_authorization_url(self, response_type)
+
+    async def get_access_token(self, authorization_code):
+        """Exchange authorization code for an access token"""
+
+        headers = {
+            "Content-Type" : "application/x-www-form-urlencoded",
+            "Accept" : "application/json;charset=UTF-8"
+        }
+
+        data = {
+            "grant_type" : "authorization_code",
+            "code" : authorization_code
+        }
+
+        if self.redirect_url:
+            data["redirect_uri"] = self.redirect_url
+
+        return await self.post(endpoint=None,
+                               url=self.access_token_url,
+                               data=data,
+                               headers=headers)
+
+    def __build_request_kwargs(self, **kwargs):
+        """Endpoint url and authentication, see `OAuth2Client`"""
+
+        if "endpoint" in kwargs:
+            if kwargs["endpoint"] is not None:
+                kwargs["url"] = self.url + kwargs["endpoint"]
+            del kwargs["endpoint"]
+
+        if "access_token" in kwargs:
+            headers = self.get_auth_headers(kwargs["access_token"])
+
+            if "headers" in kwargs:
+                headers.update(kwargs["headers"])
+
+            kwargs["headers"] = headers
+            del kwargs["access_token"]
+        elif "auth" not in kwargs:
+            kwargs["auth"] = httpx.BasicAuth(self.client_id, self.client_secret)
+
+        return kwargs
+
+    def __parse_response(self, response):
+        if response.status_code >= 400:
+            message = "{code} {reason}: {body}".format(code=response.status_code,
+                                                       reason=response.reason_phrase,
+                                                       body=response.text.encode('utf-8'))
+            raise HTTPError(message, response=response)
+
+        if response.status_code == 204:
+            return {}
+
+        try:
+            return loads(response.content)
+        except ValueError:
+            return response.text
+
+    def _retry_delay(self, attempt, response=None):
+        return retry_delay(attempt, response, self.backoff_factor, self.backoff_jitter)
+
+    async def __send(self, method, stream=False, **kwargs):
+        kwargs = self.__build_request_kwargs(**kwargs)
+        auth = kwargs.pop("auth", httpx.USE_CLIENT_DEFAULT)
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                if self.rate_limiter:
+                    await self.rate_limiter.acquire_async()
+                try:
+                    request = self.client.build_request(method, **kwargs)
+                    response = await self.client.send(request, auth=auth, stream=stream)
+                except httpx.TransportError:
+                    if attempt == self.retries:
+                        raise
+                    await asyncio.sleep(self._retry_delay(attempt))
+                    continue
+                if self.rate_limiter:
+                    self.rate_limiter.update(response.headers)
+
+                # Like urllib3, POST is not repeated on error responses
+                if method != "post" and response.status_code in RETRY_STATUSES and attempt < self.retries:
+                    await response.aclose()
+                    await asyncio.sleep(self._retry_delay(attempt, response))
+                    continue
+                return response
+
+    async def __request(self, method, **kwargs):
+        return self.__parse_response(await self.__send(method, **kwargs))
+
+    async def __cached_get(self, endpoint, **kwargs):
+        """GET served from the cache while fresh, revalidated with a conditional request once stale"""
+        key = self.cache.key(kwargs["access_token"], self.url + endpoint, kwargs.get("params"))
+        entry = self.cache.get(key)
+        if entry and self.cache.is_fresh(entry):
+            return entry.body
+        if entry:
+            kwargs["headers"] = {**self.cache.conditional_headers(entry), **(kwargs.get("headers") or {})}
+
+        response = await self.__send("get", endpoint=endpoint, **kwargs)
+        if entry and response.status_code == 304:
+            return self.cache.revalidated(key, entry).body
+
+        body = self.__parse_response(response)
+        self.cache.store(key, body, response.headers)
+        return body
+
+    async def get(self, endpoint, **kwargs):
+        if self.cache is not None and endpoint is not None and "access_token" in kwargs:
+            return await self.__cached_get(endpoint, **kwargs)
+        return await self.__request("get", endpoint=endpoint, **kwargs)
+
+    async def iter_get(self, endpoint, **kwargs):
+        """GET a JSON array and yield its elements while the body is being received.
+        Responses are not cached, they are never held in memory as a whole."""
+        response = await self.__send("get", endpoint=endpoint, stream=True, **kwargs)
+        try:
+            if response.status_code >= 400 or response.status_code == 204:
+                await response.aread()
+                self.__parse_response(response)
+                return
+
+            parser = JsonArrayParser()
+            async for chunk in response.aiter_bytes():
+                for item in parser.feed(chunk):
+                    yield item
+            for item in parser.close():
+                yield item
+        finally:
+            await response.aclose()
+
+    async def post(self, endpoint, **kwargs):
+        return await self.__request("post", endpoint=endpoint, **kwargs)
+
+    async def put(self, endpoint, **kwargs):
+        return await self.__request("put", endpoint=endpoint, **kwargs)
+
+    async def delete(self, endpoint, **kwargs):
+        return await self.__request("delete", endpoint=endpoint, **kwargs)
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Any, NamedTuple
+
+
+class CachedResponse(NamedTuple):
+    body: Any
+    etag: str | None
+    last_modified: str | None
+    stored_at: float
+
+
+class MemoryBackend(object):
+    """In-process store that evicts the least recently used entry beyond `maxsize`.
+    An entry is a whole parsed response, a window of minute samples takes several MB."""
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> CachedResponse | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry: CachedResponse):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskBackend(object):
+    """One JSON file per entry in `root`. The modification time records the last use,
+    the least recently used files are removed beyond `maxsize`. Can be shared by processes."""
+
+    def __init__(self, root, maxsize=4096):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.maxsize = maxsize
+
+    def __path(self, key):
+        return self.root / (key + ".json")
+
+    def get(self, key) -> CachedResponse | None:
+        path = self.__path(key)
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                entry = CachedResponse(**json.load(f))
+            os.utime(path)
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+        return entry
+
+    def set(self, key, entry: CachedResponse):
+        path = self.__path(key)
+        tmp = path.with_name(".{}.{}.tmp".format(path.name, os.getpid()))
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(entry._asdict(), f)
+        os.replace(tmp, path)
+        self.__evict()
+
+    def __evict(self):
+        files = []
+        for path in self.root.glob("*.json"):
+            try:
+                files.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        for _, path in sorted(files)[:max(len(files) - self.maxsize, 0)]:
+            path.unlink(missing_ok=True)
+
+    def __len__(self):
+        return sum(1 for _ in self.root.glob("*.json"))
+
+
+class ResponseCache(object):
+    """Cache of user level GET responses, keyed by user, endpoint and query parameters.
+
+    Entries younger than `ttl` seconds are served without a request. Older entries are revalidated
+    with `If-None-Match` / `If-Modified-Since` when Polar sent an `ETag` / `Last-Modified`, a 304 then
+    serves the cached body. Without validators a stale entry is simply fetched again.
+    """
+
+    def __init__(self, backend=None, ttl=300):
+        """
+        :param backend: `MemoryBackend` (default) or `DiskBackend`
+        :param ttl: seconds a response is served without contacting Polar
+        """
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+
+    @staticmethod
+    def key(access_token, url, params=None) -> str:
+        # The access token identifies the user, only its hash is stored
+        user = hashlib.sha256(str(access_token).encode("utf-8")).hexdigest()
+        params = sorted((str(k), str(v)) for k, v in (params or {}).items())
+        return hashlib.sha256(json.dumps([user, url, params]).encode("utf-8")).hexdigest()
+
+    def get(self, key) -> CachedResponse | None:
+        return self.backend.get(key)
+
+    def is_fresh(self, entry: CachedResponse) -> bool:
+        return time.time() - entry.stored_at < self.ttl
+
+    @staticmethod
+    def conditional_headers(entry: CachedResponse) -> dict:
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def store(self, key, body, headers) -> CachedResponse:
+        entry = CachedResponse(body=body,
+                               etag=headers.get("ETag"),
+                               last_modified=headers.get("Last-Modified"),
+                               stored_at=time.time())
+        self.backend.set(key, entry)
+        return entry
+
+    def revalidated(self, key, entry: CachedResponse) -> CachedResponse:
+        """Entry confirmed unchanged by a 304, it is fresh for another `ttl`"""
+        entry = entry._replace(stored_at=time.time())
+        self.backend.set(key, entry)
+        return entry
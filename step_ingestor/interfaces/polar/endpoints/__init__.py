@@ -1,9 +1,10 @@
 from .polar_resource import Resource
 from .users import Users
-from .daily_activity_beta import DailyActivityBeta
+from .daily_activity_beta import DailyActivityBeta, AsyncDailyActivityBeta
 
 __all__ = [
     "Resource",
     "Users",
-    "DailyActivityBeta"
+    "DailyActivityBeta",
+    "AsyncDailyActivityBeta"
 ]
@@ -11,6 +11,31 @@ class DailyActivityBeta(Resource):
               activity_zones=False,
               inactivity_stamps=False):
         """Fetch activities for a given date or for a date range"""
+        endpoint, params = self._request_args(date, from_, to, steps, activity_zones, inactivity_stamps)
+        response = self._get(endpoint=endpoint,
+                             access_token=access_token,
+                             params=params)
+
+        if not response:
+            return None
+        return response
+
+    def iter_fetch(self, access_token,
+                   from_: str,
+                   to: str=None,
+                   steps=False,
+                   activity_zones=False,
+                   inactivity_stamps=False):
+        """Fetch activities for a date range, days are yielded one at a time while the response is received.
+        On an `AsyncOAuth2Client` this is an async iterator."""
+        endpoint, params = self._request_args(None, from_, to, steps, activity_zones, inactivity_stamps)
+        return self._iter_get(endpoint=endpoint,
+                              access_token=access_token,
+                              params=params)
+
+    @staticmethod
+    def _request_args(date, from_, to, steps, activity_zones, inactivity_stamps):
+        """Endpoint and query parameters of a fetch"""
 
         if date and from_:
             raise ValueError("Can only fetch single day or range of dates")
@@ -33,9 +58,23 @@ class DailyActivityBeta(Resource):
         if date is None:
             date = ''
 
-        response = self._get(endpoint="/users/activities/{date}".format(date=date),
-                         access_token=access_token,
-                         params=params if params else None)
+        return "/users/activities/{date}".format(date=date), params if params else None
+
+
+class AsyncDailyActivityBeta(DailyActivityBeta):
+    """`DailyActivityBeta` on an `AsyncOAuth2Client`"""
+    async def fetch(self, access_token,
+                    date: str=None,
+                    from_: str=None,
+                    to: str=None,
+                    steps=False,
+                    activity_zones=False,
+                    inactivity_stamps=False):
+        """Fetch activities for a given date or for a date range"""
+        endpoint, params = self._request_args(date, from_, to, steps, activity_zones, inactivity_stamps)
+        response = await self._get(endpoint=endpoint,
+                                   access_token=access_token,
+                                   params=params)
 
         if not response:
             return None
@@ -6,6 +6,9 @@ class Resource(object):
     def _get(self, *args, **kwargs):
         return self.oauth.get(*args, **kwargs)
 
+    def _iter_get(self, *args, **kwargs):
+        return self.oauth.iter_get(*args, **kwargs)
+
     def _post(self, *args, **kwargs):
         return self.oauth.post(*args, **kwargs)
 
@@ -0,0 +1,35 @@
+"""JSON decoding for Polar responses with the fastest installed backend.
+
+orjson is preferred, then msgspec, then the standard library. All backends accept `str` or `bytes`
+and raise `ValueError` on invalid input, like `json.loads`.
+"""
+import json
+from typing import Any, Callable
+
+BACKENDS: dict[str, Callable[[str | bytes], Any]] = {"json": json.loads}
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+else:
+    _msgspec_decoder = msgspec.json.Decoder()
+
+    def _msgspec_loads(data):
+        try:
+            return _msgspec_decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+    BACKENDS["msgspec"] = _msgspec_loads
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+else:
+    # orjson.JSONDecodeError is a ValueError
+    BACKENDS["orjson"] = orjson.loads
+
+BACKEND = next(name for name in ("orjson", "msgspec", "json") if name in BACKENDS)
+loads = BACKENDS[BACKEND]
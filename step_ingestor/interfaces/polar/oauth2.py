@@ -1,23 +1,98 @@
+import datetime as dt
+import random
+import time
+from email.utils import parsedate_to_datetime
+
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from requests.exceptions import HTTPError
 
+from .json_backend import loads
+from .streaming import JsonArrayParser
+
 try:
     from urllib.parse import urlencode
 except ImportError:
     from urllib import urlencode
 
+# Responses worth retrying
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def retry_delay(attempt, response=None, backoff_factor=0.5, backoff_jitter=0.5):
+    """Seconds to wait before retry number `attempt`, `Retry-After` takes precedence"""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            try:
+                when = parsedate_to_datetime(retry_after)
+                return max((when - dt.datetime.now(dt.timezone.utc)).total_seconds(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    return backoff_factor * (2 ** attempt) + random.uniform(0, backoff_jitter)
+
 class OAuth2Client(object):
     """Wrapper class for OAuth2 requests"""
 
     def __init__(self, api_url, authorization_url, access_token_url, redirect_url,
-                 client_id, client_secret):
+                 client_id, client_secret,
+                 pool_size=10, timeout=(3.05, 30), retries=3, backoff_factor=0.5, backoff_jitter=0.5,
+                 rate_limiter=None, cache=None):
+        """
+        :param pool_size: number of keep-alive connections kept per host
+        :param timeout: (connect, read) timeout in seconds for every request
+        :param retries: retries on connection errors and on 429/5xx responses, `Retry-After` is honoured
+        :param backoff_factor: base of the exponential backoff between retries in seconds
+        :param backoff_jitter: maximum random seconds added to each backoff
+        :param rate_limiter: `RateLimiter` every request and retry waits for, fed with the rate-limit headers of the responses
+        :param cache: `ResponseCache` for user level GET requests
+        """
         self.url = api_url
         self.authorization_url = authorization_url
         self.access_token_url = access_token_url
         self.redirect_url = redirect_url
         self.client_id = client_id
         self.client_secret = client_secret
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backoff_jitter = backoff_jitter
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.session = self.__build_session(pool_size)
+
+    @staticmethod
+    def __build_session(pool_size):
+        """Shared session, so requests reuse pooled TCP+TLS connections. Retries are sent by `__send`,
+        so each of them waits for the rate limiter."""
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def connection_stats(self):
+        """Requests sent and connections opened over the lifetime of the session, per host and in total.
+        Every request beyond the opened connections reused a keep-alive connection."""
+        stats = {"requests": 0, "connections": 0}
+        hosts = {}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                hosts[pool.host] = {"requests": pool.num_requests, "connections": pool.num_connections}
+                stats["requests"] += pool.num_requests
+                stats["connections"] += pool.num_connections
+        stats["reused"] = stats["requests"] - stats["connections"]
+        stats["hosts"] = hosts
+        return stats
+
+    def close(self):
+        self.session.close()
 
     def get_auth_headers(self, access_token):
         """Get authorization headers for user level api resources"""
@@ -113,18 +188,75 @@ class OAuth2Client(object):
             return {}
 
         try:
-            return response.json()
+            return loads(response.content)
         except ValueError:
             return response.text
 
-    def __request(self, method, **kwargs):
+    def _retry_delay(self, attempt, response=None):
+        return retry_delay(attempt, response, self.backoff_factor, self.backoff_jitter)
+
+    def __send(self, method, **kwargs):
         kwargs = self.__build_request_kwargs(**kwargs)
-        response = requests.request(method, **kwargs)
-        return self.__parse_response(response)
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            try:
+                response = self.session.request(method, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                time.sleep(self._retry_delay(attempt))
+                continue
+            if self.rate_limiter:
+                self.rate_limiter.update(response.headers)
+
+            # Like urllib3, POST is not repeated on error responses
+            if method != "post" and response.status_code in RETRY_STATUSES and attempt < self.retries:
+                response.close()
+                time.sleep(self._retry_delay(attempt, response))
+                continue
+            return response
+
+    def __request(self, method, **kwargs):
+        return self.__parse_response(self.__send(method, **kwargs))
+
+    def __cached_get(self, endpoint, **kwargs):
+        """GET served from the cache while fresh, revalidated with a conditional request once stale"""
+        key = self.cache.key(kwargs["access_token"], self.url + endpoint, kwargs.get("params"))
+        entry = self.cache.get(key)
+        if entry and self.cache.is_fresh(entry):
+            return entry.body
+        if entry:
+            kwargs["headers"] = {**self.cache.conditional_headers(entry), **(kwargs.get("headers") or {})}
+
+        response = self.__send("get", endpoint=endpoint, **kwargs)
+        if entry and response.status_code == 304:
+            return self.cache.revalidated(key, entry).body
+
+        body = self.__parse_response(response)
+        self.cache.store(key, body, response.headers)
+        return body
 
     def get(self, endpoint, **kwargs):
+        if self.cache is not None and endpoint is not None and "access_token" in kwargs:
+            return self.__cached_get(endpoint, **kwargs)
         return self.__request("get", endpoint=endpoint, **kwargs)
 
+    def iter_get(self, endpoint, chunk_size=64 * 1024, **kwargs):
+        """GET a JSON array and yield its elements while the body is being received.
+        Responses are not cached, they are never held in memory as a whole."""
+        response = self.__send("get", endpoint=endpoint, stream=True, **kwargs)
+        with response:
+            if response.status_code >= 400 or response.status_code == 204:
+                self.__parse_response(response)
+                return
+
+            parser = JsonArrayParser()
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                yield from parser.feed(chunk)
+            yield from parser.close()
+
     def post(self, endpoint, **kwargs):
         return self.__request("post", endpoint=endpoint, **kwargs)
 
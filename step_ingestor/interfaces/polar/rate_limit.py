@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import fcntl
+import asyncio
+import threading
+from contextlib import contextmanager
+
+# Polar's documented budget per client application: 500 requests per 15 minutes and 5000 per 24 hours
+# (both grow with the number of registered users, the response headers carry the actual values)
+POLAR_WINDOWS = ((500, 15 * 60), (5000, 24 * 60 * 60))
+
+
+class RateLimiter(object):
+    """Token bucket per rate-limit window of the Polar client application.
+
+    Every request takes one token from each bucket, a bucket refills at `limit / period` tokens per second.
+    Callers wait until a token is available instead of failing, so requests go out at the allowed rate.
+
+    With `path` the buckets live in a file guarded by an exclusive lock, so every process using the same
+    file shares one budget. Without it the buckets are shared by the threads and tasks of this process only.
+    """
+
+    def __init__(self, windows=POLAR_WINDOWS, path=None):
+        """
+        :param windows: (limit, period in seconds) per window, until Polar's headers report the actual limits
+        :param path: file shared by all processes that use the same client application
+        """
+        if not windows:
+            raise ValueError("At least one rate-limit window must be given")
+        self.windows = tuple((int(limit), float(period)) for limit, period in windows)
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = None
+
+    @contextmanager
+    def __locked_state(self):
+        """Current buckets, changes are persisted when the block exits"""
+        with self._lock:
+            if self.path is None:
+                if self._state is None:
+                    self._state = self.__initial_state()
+                yield self._state
+                return
+
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            with os.fdopen(fd, "r+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    content = f.read()
+                    state = json.loads(content) if content else self.__initial_state()
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(state, f)
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def __initial_state(self):
+        now = time.time()
+        return {"buckets": [{"limit": limit, "period": period, "tokens": float(limit), "updated": now}
+                            for limit, period in self.windows]}
+
+    @staticmethod
+    def __refill(bucket, now):
+        rate = bucket["limit"] / bucket["period"]
+        elapsed = max(now - bucket["updated"], 0.0)
+        bucket["tokens"] = min(bucket["tokens"] + elapsed * rate, float(bucket["limit"]))
+        bucket["updated"] = now
+
+    def _try_acquire(self):
+        """Take a token from every bucket, returns 0 on success or else the seconds to wait before trying again"""
+        with self.__locked_state() as state:
+            now = time.time()
+            wait = 0.0
+            for bucket in state["buckets"]:
+                self.__refill(bucket, now)
+                if bucket["tokens"] < 1:
+                    wait = max(wait, (1 - bucket["tokens"]) * bucket["period"] / bucket["limit"])
+            if wait == 0.0:
+                for bucket in state["buckets"]:
+                    bucket["tokens"] -= 1
+            return wait
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            wait = self._try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Wait, without blocking the event loop, until a request may be sent"""
+        while True:
+            wait = await asyncio.to_thread(self._try_acquire) if self.path else self._try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    @staticmethod
+    def _parse_header(value):
+        return [int(v.strip()) for v in value.split(",") if v.strip()]
+
+    def update(self, headers):
+        """Adopt the limits and usage reported in Polar's `RateLimit-Usage`, `RateLimit-Limit` and `RateLimit-Reset`
+        response headers. Each header lists one value per window, short-term window first."""
+        try:
+            usage = self._parse_header(headers["RateLimit-Usage"])
+            limits = self._parse_header(headers["RateLimit-Limit"])
+            resets = self._parse_header(headers.get("RateLimit-Reset", ""))
+        except (KeyError, ValueError):
+            return
+
+        with self.__locked_state() as state:
+            now = time.time()
+            buckets = state["buckets"]
+            for i, (used, limit) in enumerate(zip(usage, limits)):
+                if limit <= 0:
+                    continue
+                if i >= len(buckets):
+                    period = resets[i] if i < len(resets) and resets[i] > 0 else buckets[-1]["period"]
+                    buckets.append({"limit": limit, "period": float(period), "tokens": float(limit), "updated": now})
+                bucket = buckets[i]
+                self.__refill(bucket, now)
+                bucket["limit"] = limit
+                # Other clients of the same application may have used more than this process knows about
+                bucket["tokens"] = min(bucket["tokens"], float(max(limit - used, 0)))
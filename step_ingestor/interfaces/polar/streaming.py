@@ -0,0 +1,97 @@
+import json
+import codecs
+
+from .json_backend import loads
+
+_WHITESPACE = " \t\n\r"
+
+
+class JsonArrayParser(object):
+    """Incremental parser for a JSON array body.
+
+    Chunks of the body are fed as they arrive and every element of the top-level array is returned
+    as soon as it is complete, so only the element being parsed is buffered. Elements are decoded by
+    the C scanner of the json module, which also finds where they end. An incomplete element is retried
+    once its buffered part has doubled, which keeps parsing linear in the size of the body.
+    A body that is not an array is buffered whole and decoded by the JSON backend in `close`.
+    """
+
+    def __init__(self, encoding="utf-8"):
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._retry_at = 0  # Buffered characters of the current element needed before decoding again
+        self._state = "start"  # start -> items -> end, or start -> whole
+
+    def feed(self, chunk: bytes) -> list:
+        self._buffer += self._decoder.decode(chunk)
+        return self._drain(final=False)
+
+    def close(self) -> list:
+        self._buffer += self._decoder.decode(b"", final=True)
+        items = self._drain(final=True)
+
+        if self._state == "whole":
+            return [loads(self._buffer)]
+        if self._state == "items":
+            raise ValueError("Unterminated JSON array")
+        if self._state == "end" and self._buffer[self._pos:].strip(_WHITESPACE):
+            raise ValueError("Unexpected data after JSON array")
+        return items
+
+    def _skip_whitespace(self):
+        while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+            self._pos += 1
+
+    def _drain(self, final) -> list:
+        items = []
+        while self._state in ("start", "items"):
+            self._skip_whitespace()
+            if self._pos >= len(self._buffer):
+                break
+
+            char = self._buffer[self._pos]
+            if self._state == "start":
+                if char == "[":
+                    self._state = "items"
+                    self._pos += 1
+                else:
+                    self._state = "whole"
+                continue
+
+            if char == "]":
+                self._state = "end"
+                self._pos += 1
+                continue
+            if char == ",":
+                self._pos += 1
+                continue
+
+            buffered = len(self._buffer) - self._pos
+            if not final and buffered < self._retry_at:
+                break
+            try:
+                item, end = self._json.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                self._retry_at = 2 * buffered
+                break
+            # The element is complete once its delimiter arrived, a number such as `2.` may continue
+            delimiter = end
+            while delimiter < len(self._buffer) and self._buffer[delimiter] in _WHITESPACE:
+                delimiter += 1
+            if delimiter == len(self._buffer) or self._buffer[delimiter] not in ",]":
+                if final:
+                    raise ValueError("Expecting ',' or ']' after element at {}".format(end))
+                self._retry_at = buffered + 1
+                break
+            items.append(item)
+            self._pos = end
+            self._retry_at = 0
+
+        if self._state != "whole":
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        return items
@@ -1,5 +1,7 @@
 from .repo import StepIngestorRepository
+from .async_repo import AsyncStepIngestorRepository
 
 __all__ = [
-    "StepIngestorRepository"
+    "StepIngestorRepository",
+    "AsyncStepIngestorRepository"
 ]
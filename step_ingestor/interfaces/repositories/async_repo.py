@@ -0,0 +1,364 @@
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import time
+from typing import AsyncIterator, Callable, Sequence
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncResult, AsyncSession
+
+from step_ingestor.db import ActivitySummary, StepSample, StepDay
+from step_ingestor.db.rollups import TABLE, rollup_kind
+from step_ingestor.dto import (ActivitySummaryDTO, StepSampleDTO, StepSampleColumns, StepSeries, StepBucketDTO, UserDTO,
+                               IngestJobDTO)
+from . import statements as q
+from .repo import step_sample_staging
+from .statements import BatchTiming
+
+
+async def _group_samples_by_day(rows: AsyncResult) -> AsyncIterator[tuple[tuple[str, dt.date], list[sa.Row]]]:
+    """Async counterpart of `statements.group_samples_by_day`"""
+    key, group = None, []
+    async for r in rows:
+        if group and (r.user_id, r.day) != key:
+            yield key, group
+            group = []
+        key = (r.user_id, r.day)
+        group.append(r)
+    if group:
+        yield key, group
+
+
+async def _next(iterator: AsyncIterator, default=(None, None)):
+    """`anext` with a default, which on Python 3.11 fails for generators over an exhausted `AsyncResult`"""
+    try:
+        return await anext(iterator)
+    except StopAsyncIteration:
+        return default
+
+
+async def _packed_days(rows: AsyncResult | None) -> AsyncIterator[tuple[tuple[str, dt.date], sa.Row]]:
+    """Rows of `statements.select_step_days` keyed by (user_id, day), nothing when `rows` is None"""
+    if rows is None:
+        return
+    async for r in rows:
+        yield (r.user_id, r.day), r
+
+
+class AsyncStepIngestorRepository:
+    """Repository that saves DTOs in the database, on SQLAlchemy's asyncio extension.
+    Mirrors `StepIngestorRepository`, use one instance (and session) per concurrent task."""
+    def __init__(self,
+                 session: AsyncSession,
+                 *,
+                 autocommit: bool = False,
+                 batch_size: int | None = None,
+                 packed: bool = False,
+                 zero_runs: bool = False):
+        if session is None:
+            raise ValueError("session must be provided")
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        self.session: AsyncSession = session
+        self.autocommit: bool = autocommit
+        self.batch_size: int | None = batch_size
+        self.packed: bool = packed
+        self.zero_runs: bool = zero_runs
+        self.batch_timings: list[BatchTiming] = []
+        self._rollups: str | None = None
+        self._rollups_checked: bool = False
+
+    async def _maybe_flush(self) -> None:
+        await self.session.flush()
+
+    async def _maybe_commit(self) -> None:
+        if self.autocommit:
+            await self.session.commit()
+
+    # --- USERS ---
+    async def add_user(self, user: UserDTO) -> bool:
+        """Idempotent insert. Returns True if inserted, False if already existed."""
+        res = await self.session.execute(q.insert_user(user))
+        await self._maybe_flush()
+        await self._maybe_commit()
+
+        if user.access_token:
+            await self.update_user_access_token(user)
+
+        await self._maybe_commit()
+
+        # rowcount can be 0 if no insert happened due to conflict
+        return (res.rowcount or 0) > 0
+
+    async def update_user_access_token(self, user: UserDTO) -> bool:
+        """Create/update the user's access token (one-to-one).
+        Returns True when an insert/update occurred, False on no-op conflict.
+        """
+        res = await self.session.execute(q.upsert_access_token(user))
+        await self._maybe_flush()
+        await self._maybe_commit()
+        return (res.rowcount or 0) == 1
+
+    async def delete_user(self, user: UserDTO) -> bool:
+        """Deletes the user and associated rows in other tables (via cascade)."""
+        res = await self.session.execute(q.delete_user(user))
+        await self._maybe_flush()
+        await self._maybe_commit()
+        return (res.rowcount or 0) == 1
+
+    async def get_user_by_id(self, user_id=None, polar_user_id=None) -> UserDTO | None:
+        stmt = q.select_user(user_id=user_id, polar_user_id=polar_user_id)
+
+        row = (await self.session.execute(stmt)).one_or_none()
+        if not row:
+            return None
+        return q.row_to_user(row)
+
+    async def get_access_token(self, user: UserDTO) -> UserDTO | None:
+        token = (await self.session.execute(q.select_access_token(user))).one_or_none()
+        if token is None:
+            return None
+        user.access_token = q.row_to_token(token)
+        return user
+
+    # --- ACTIVITY DATA ---
+    async def get_user_data(self, user: UserDTO) -> list[ActivitySummaryDTO]:
+        """Return all daily summaries of the user with their step samples attached, in two queries."""
+        samples = await self.session.execute(q.select_step_samples(user))
+        samples_by_day = {day: q.to_step_samples(rows) for (_, day), rows in q.group_samples_by_day(samples)}
+        if self.packed:
+            days = await self.session.execute(q.select_step_days(user))
+            samples_by_day.update((row.day, q.to_step_series(row)) for row in days)
+        summaries = await self.session.execute(q.select_summaries(user))
+        return [q.to_summary(s, samples_by_day.get(s.date)) for s in summaries]
+
+    async def iter_user_data(self,
+                             user: UserDTO | None = None,
+                             *,
+                             chunk_size: int = 5000) -> AsyncIterator[ActivitySummaryDTO]:
+        """Stream daily summaries with their step samples attached, ordered by user and date.
+        Streams the data of all users when no user is given."""
+        options = {"yield_per": chunk_size}
+        summaries = await self.session.stream(q.select_summaries(user), execution_options=options)
+        sample_days = _group_samples_by_day(
+            await self.session.stream(q.select_step_samples(user), execution_options=options)
+        )
+        packed_days = _packed_days(
+            await self.session.stream(q.select_step_days(user), execution_options=options) if self.packed else None
+        )
+
+        key, rows = await _next(sample_days)
+        packed_key, packed_row = await _next(packed_days)
+        async for s in summaries:
+            # Skip sample days without a summary
+            while key is not None and key < (s.user_id, s.date):
+                key, rows = await _next(sample_days)
+            while packed_key is not None and packed_key < (s.user_id, s.date):
+                packed_key, packed_row = await _next(packed_days)
+
+            samples = None
+            if key == (s.user_id, s.date):
+                samples = q.to_step_samples(rows)
+                key, rows = await _next(sample_days)
+            if packed_key == (s.user_id, s.date):
+                samples = q.to_step_series(packed_row)
+                packed_key, packed_row = await _next(packed_days)
+            yield q.to_summary(s, samples)
+
+    async def get_step_series(self,
+                              user: UserDTO,
+                              freq: str,
+                              start: dt.datetime | None = None,
+                              end: dt.datetime | None = None) -> list[StepBucketDTO]:
+        """Return the user's steps summed per time bucket of size `freq`, ordered by time."""
+        rollups = await self._rollup_kind()
+        # Continuous aggregates are defined on `step_sample` only, they miss the packed days
+        use_rollups = rollups == TABLE if self.packed else rollups is not None
+        stmt = q.select_step_series(user, freq, start, end, use_rollups=use_rollups, packed=self.packed)
+        return q.to_step_buckets(await self.session.execute(stmt))
+
+    async def _rollup_kind(self) -> str | None:
+        if not self._rollups_checked:
+            connection = await self.session.connection()
+            self._rollups = await connection.run_sync(rollup_kind)
+            self._rollups_checked = True
+        return self._rollups
+
+    async def ingest_payload(self,
+                             payload: Sequence[ActivitySummaryDTO] | ActivitySummaryDTO,
+                             *,
+                             use_copy: bool = False) -> bool:
+        """Store daily summaries and their step samples, see `StepIngestorRepository.ingest_payload`."""
+        payloads = [payload] if not isinstance(payload, list) else payload
+
+        stored = not payloads or await self._upsert_activity_summary(payloads) > 0
+        if stored and payloads:
+            samples = [samples or [] for samples in await self._store_step_days(payloads)]
+            if use_copy and await self._supports_copy():
+                await self._copy_step_samples(samples)
+            else:
+                await self._upsert_step_samples_batch(samples)
+
+        if stored and await self._rollup_kind() == TABLE:
+            for stmt in q.refresh_step_rollups(payloads, packed=self.packed):
+                await self.session.execute(stmt)
+            await self._maybe_flush()
+            await self._maybe_commit()
+        return stored
+
+    async def _upsert_activity_summary(self, summaries: Sequence[ActivitySummaryDTO]) -> int:
+        rows = q.summary_rows(summaries)
+        result = await self._execute_batched(ActivitySummary.__table__, rows, q.upsert_activity_summaries)
+        await self._maybe_flush()
+        await self._maybe_commit()
+        return result
+
+    async def _store_step_days(self,
+                               payloads: Sequence[ActivitySummaryDTO]
+                               ) -> list[Sequence[StepSampleDTO] | StepSampleColumns | StepSeries | None]:
+        """See `StepIngestorRepository._store_step_days`"""
+        if not self.packed:
+            return [summary.step_samples for summary in payloads]
+
+        packed = q.pack_step_days(payloads, zero_runs=self.zero_runs)
+        for stmt in q.delete_packed_step_samples(packed.spans):
+            await self.session.execute(stmt)
+        if packed.rows:
+            await self._execute_batched(StepDay.__table__, packed.rows, q.upsert_step_days)
+        await self._maybe_flush()
+        await self._maybe_commit()
+        return packed.unpacked
+
+    async def _upsert_step_samples_batch(self,
+                                         samples: Sequence[Sequence[StepSampleDTO] | StepSampleColumns | StepSeries]
+                                         ) -> int:
+        rows = q.step_sample_rows(samples)
+        if not rows:
+            return 1
+        result = await self._execute_batched(StepSample.__table__, rows, q.insert_step_samples)
+        await self._maybe_flush()
+        await self._maybe_commit()
+        return result
+
+    async def _execute_batched(self,
+                               table: sa.Table,
+                               rows: list[dict],
+                               build_stmt: Callable[[list[dict]], sa.Executable]) -> int:
+        total = 0
+        for batch in q.batches(rows, self.batch_size, max_params=q.ASYNCPG_MAX_BIND_PARAMS):
+            t_start = time.perf_counter()
+            result = await self.session.execute(build_stmt(batch))
+            timing = BatchTiming(table=table.name, rows=len(batch), seconds=time.perf_counter() - t_start)
+            self.batch_timings.append(timing)
+            logging.debug("Wrote {} rows to {} in {:.3f}s".format(timing.rows, timing.table, timing.seconds))
+            total += q.rowcount(result)
+        return total
+
+    async def _driver_connection(self):
+        connection = await self.session.connection()
+        raw = await connection.get_raw_connection()
+        return raw.driver_connection
+
+    async def _supports_copy(self) -> bool:
+        return hasattr(await self._driver_connection(), "copy_records_to_table")
+
+    async def _copy_step_samples(self,
+                                 samples: Sequence[Sequence[StepSampleDTO] | StepSampleColumns | StepSeries]) -> int:
+        """Copy step samples into the staging table and merge them into `step_sample`."""
+        records = list(q.step_sample_records(samples))
+        if not records:
+            return 1
+
+        connection = await self.session.connection()
+        await connection.run_sync(step_sample_staging.create, checkfirst=True)
+
+        columns = ["user_id", "timestamp", "steps"]
+        driver = await self._driver_connection()
+        await driver.copy_records_to_table(step_sample_staging.name, records=records, columns=columns)
+
+        stmt = (
+            pg_insert(StepSample)
+            .from_select(columns, sa.select(*(step_sample_staging.c[c] for c in columns)))
+            .on_conflict_do_nothing(index_elements=[StepSample.user_id, StepSample.timestamp])
+        )
+        result = await self.session.execute(stmt)
+        await self.session.execute(sa.delete(step_sample_staging))
+        await self._maybe_flush()
+        await self._maybe_commit()
+        return q.rowcount(result)
+
+    async def get_latest_summary_date(self, user: UserDTO) -> dt.date | None:
+        """Return the most recent date stored in the daily summary table."""
+        return (await self.session.execute(q.select_latest_summary_date(user))).scalar_one_or_none()
+
+    # --- COVERAGE ---
+    async def get_covered_ranges(self, user: UserDTO, since: dt.date) -> list[tuple[dt.date, dt.date]]:
+        """Ranges of days from `since` on that need no fetching, the ranges recorded by `add_synced_range`"""
+        return [(row[0], row[1]) for row in (await self.session.execute(q.select_covered_ranges(user, since)))]
+
+    async def add_synced_range(self, user: UserDTO, date_from: dt.date, date_to: dt.date) -> None:
+        """Record that all days from `date_from` to `date_to` were fetched"""
+        await self.session.execute(q.add_synced_range(user, date_from, date_to))
+        await self._maybe_flush()
+        await self._maybe_commit()
+
+    # --- INGEST JOBS ---
+    async def enqueue_refresh(self, user: UserDTO, priority: int = 0) -> int:
+        """Queue a refresh of the user's data. Returns the id of the new job, or of the job that is
+        already queued or running for the user. A queued job is raised to `priority`."""
+        job_id = None
+        while job_id is None:
+            job_id = (await self.session.execute(q.enqueue_job(user, priority))).scalar_one_or_none()
+            if job_id is None:
+                # The running job may finish in between, then the next insert succeeds
+                job_id = (await self.session.execute(q.select_active_job_id(user))).scalar_one_or_none()
+        await self._maybe_commit()
+        return job_id
+
+    async def enqueue_stale_users(self,
+                                  today: dt.date,
+                                  stale_after: dt.timedelta,
+                                  *,
+                                  max_priority: int = 365,
+                                  limit: int | None = None) -> list[int]:
+        """Queue a refresh of at most `limit` users last synced more than `stale_after` ago, least recently first.
+        A sync is their latest data or their last finished job, their priority is the number of days since then,
+        at most `max_priority`.
+        Returns the ids of the queued jobs."""
+        stmt = q.enqueue_stale_users(today, stale_after, max_priority, limit)
+        job_ids = (await self.session.execute(stmt)).scalars().all()
+        await self._maybe_commit()
+        return list(job_ids)
+
+    async def claim_job(self,
+                        *,
+                        lease: dt.timedelta,
+                        max_attempts: int = 3,
+                        shard: tuple[int, int] | None = None,
+                        max_running: int | None = None) -> IngestJobDTO | None:
+        """Mark the queued job of the highest priority as running and return it, None when there is nothing to do.
+        Concurrent workers claim different jobs. With `autocommit` the claim is committed right away.
+
+        :param shard: (index, count), only claim jobs of the users in this shard of `count`
+        :param max_running: claim nothing while this many jobs are running, in all workers together
+        """
+        await self.session.execute(q.fail_expired_jobs(lease, max_attempts))
+        if max_running is not None:
+            await self.session.execute(q.lock_job_claims())
+            if (await self.session.execute(q.count_running_jobs(lease))).scalar_one() >= max_running:
+                await self._maybe_commit()
+                return None
+        row = (await self.session.execute(q.claim_job(lease, max_attempts, shard))).one_or_none()
+        await self._maybe_commit()
+        return q.to_job(row) if row else None
+
+    async def finish_job(self, job_id: int, error: str | None = None) -> None:
+        """Mark the job as done, or as failed with `error`"""
+        await self.session.execute(q.finish_job(job_id, error))
+        await self._maybe_commit()
+
+    async def get_latest_job(self, user: UserDTO) -> IngestJobDTO | None:
+        row = (await self.session.execute(q.select_latest_job(user))).one_or_none()
+        return q.to_job(row) if row else None
@@ -1,23 +1,63 @@
 from __future__ import annotations
 
+import csv
 import datetime as dt
-from typing import Sequence
+import io
+import logging
+import time
+from functools import cached_property
+from typing import Callable, Iterator, Sequence
 
 import sqlalchemy as sa
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
-from pydantic import TypeAdapter
 
-from step_ingestor.db import AppUser, ActivitySummary, StepSample, AccessToken
-from step_ingestor.dto import ActivitySummaryDTO, StepSampleDTO, UserDTO, TokenDTO
+from step_ingestor.db import ActivitySummary, StepSample, StepDay
+from step_ingestor.db.rollups import TABLE, rollup_kind
+from step_ingestor.dto import (ActivitySummaryDTO, StepSampleDTO, StepSampleColumns, StepSeries, StepBucketDTO, UserDTO,
+                               IngestJobDTO)
+from . import statements as q
+from .statements import BatchTiming
+
+# Session-local staging table for COPY based ingestion, not part of the application schema
+_staging_metadata = sa.MetaData()
+step_sample_staging = sa.Table(
+    "step_sample_staging",
+    _staging_metadata,
+    sa.Column("user_id", sa.String, nullable=False),
+    sa.Column("timestamp", sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column("steps", sa.Integer, nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DELETE ROWS",
+)
 
 class StepIngestorRepository:
     """Repository that saves DTOs in the database."""
-    def __init__(self, session: Session, *, autocommit: bool = False):
+    def __init__(self,
+                 session: Session,
+                 *,
+                 autocommit: bool = False,
+                 batch_size: int | None = None,
+                 packed: bool = False,
+                 zero_runs: bool = False):
+        """
+        :param batch_size: maximum number of rows per insert statement, by default as many as
+            the bind parameter limit allows
+        :param packed: store the step samples of a day as one `step_day` row instead of a `step_sample` row
+            per sample. Days whose samples are not on the interval grid are still stored as rows,
+            reads combine both tables.
+        :param zero_runs: in the packed layout, store runs of samples without steps by their length
+        """
         if session is None:
             raise ValueError("session must be provided")
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be positive")
         self.session: Session = session
         self.autocommit: bool = autocommit
+        self.batch_size: int | None = batch_size
+        self.packed: bool = packed
+        self.zero_runs: bool = zero_runs
+        self.batch_timings: list[BatchTiming] = []
 
     def _maybe_flush(self) -> None:
         self.session.flush()
@@ -29,13 +69,7 @@ class StepIngestorRepository:
     # --- USERS ---
     def add_user(self, user: UserDTO) -> bool:
         """Idempotent insert. Returns True if inserted, False if already existed."""
-        stmt = (
-            pg_insert(AppUser)
-            .values(user.model_dump(exclude={"access_token"}, by_alias=True))
-            .on_conflict_do_nothing(index_elements=[AppUser.user_id])
-        )
-
-        res = self.session.execute(stmt)
+        res = self.session.execute(q.insert_user(user))
         self._maybe_flush()
         self._maybe_commit()
 
@@ -51,23 +85,7 @@ class StepIngestorRepository:
         """Create/update the user's access token (one-to-one).
         Returns True when an insert/update occurred, False on no-op conflict.
         """
-        if not user.access_token:
-            raise ValueError("No access token provided.")
-
-        data = user.access_token.model_dump(by_alias=True)
-        data["user_id"] = user.user_id
-
-        stmt = pg_insert(AccessToken).values(data)
-        stmt = stmt.on_conflict_do_update(
-            index_elements=[AccessToken.user_id],
-            set_={
-                "access_token": stmt.excluded.access_token,
-                "issuer": stmt.excluded.issuer,
-                "expires_at": stmt.excluded.expires_at,
-                "updated_at": sa.func.now(),
-            },
-        )
-        res = self.session.execute(stmt)
+        res = self.session.execute(q.upsert_access_token(user))
         self._maybe_flush()
         self._maybe_commit()
         # With Postgres dialect, upsert returns rowcount 1 for insert or update
@@ -75,130 +93,335 @@ class StepIngestorRepository:
 
     def delete_user(self, user: UserDTO) -> bool:
         """Deletes the user and associated rows in other tables (via cascade)."""
-        stmt = sa.delete(AppUser).where(AppUser.user_id == user.user_id)
-        res = self.session.execute(stmt)
+        res = self.session.execute(q.delete_user(user))
         self._maybe_flush()
         self._maybe_commit()
         return (res.rowcount or 0) == 1
 
     def get_user_by_id(self, user_id=None, polar_user_id=None) -> UserDTO | None:
-        if user_id:
-            stmt = (
-                sa.select(AppUser, AccessToken)
-                .outerjoin(AccessToken, AppUser.user_id == AccessToken.user_id)
-                .where(AppUser.user_id == user_id)
-            )
-
-        elif polar_user_id:
-            stmt = (
-                sa.select(AppUser, AccessToken)
-                .outerjoin(AccessToken, AppUser.user_id == AccessToken.user_id)
-                .where(AppUser.polar_user_id == polar_user_id)
-            )
-        else:
-            raise ValueError("No user ID provided")
+        """Single-row lookup of the user and its access token. Only the needed columns are selected,
+        no ORM entities or relationships are loaded."""
+        stmt = q.select_user(user_id=user_id, polar_user_id=polar_user_id)
 
         row = self.session.execute(stmt).one_or_none()
         if not row:
             return None
-        user, token = row
-        u = UserDTO.model_validate(user)
-        if token:
-            u.access_token = TokenDTO.model_validate(token, by_alias=True)
-        return u
+        return q.row_to_user(row)
 
     def get_access_token(self, user: UserDTO) -> UserDTO | None:
-        stmt = sa.select(AccessToken).where(AccessToken.user_id == user.user_id)
-
-        token = self.session.execute(stmt).scalar_one_or_none()
+        token = self.session.execute(q.select_access_token(user)).one_or_none()
         if token is None:
             return None
-        user.access_token = TokenDTO.model_validate(token)
+        user.access_token = q.row_to_token(token)
         return user
 
     # --- ACTIVITY DATA ---
     def get_user_data(self, user: UserDTO) -> list[ActivitySummaryDTO]:
-        stmt_summary = sa.select(ActivitySummary).where(ActivitySummary.user_id == user.user_id)
-
-        data: list[ActivitySummaryDTO] = []
-        for s in self.session.execute(stmt_summary).scalars():
-            dto = ActivitySummaryDTO.model_validate(s)
-
-            t_start = dt.datetime.combine(dto.date, dt.time.min)
-            t_end = t_start + dt.timedelta(days=1)
+        """Return all daily summaries of the user with their step samples attached.
 
-            stmt_steps = sa.select(StepSample).where(
-                StepSample.user_id == dto.user_id,
-                StepSample.timestamp >= t_start,
-                StepSample.timestamp < t_end
+        Uses one query for the summaries and one for the samples, regardless of the length of the history.
+        Samples are grouped per day in a single pass over the ordered result.
+        Packed days are read with one more query and attached as `StepSeries`.
+        """
+        samples_by_day = {
+            day: q.to_step_samples(rows)
+            for (_, day), rows in q.group_samples_by_day(self.session.execute(q.select_step_samples(user)))
+        }
+        if self.packed:
+            samples_by_day.update(
+                (row.day, q.to_step_series(row)) for row in self.session.execute(q.select_step_days(user))
             )
+        return [
+            q.to_summary(s, samples_by_day.get(s.date))
+            for s in self.session.execute(q.select_summaries(user))
+        ]
 
-            steps = self.session.execute(stmt_steps).scalars().all()
-            adapter = TypeAdapter(list[StepSampleDTO])
-            samples = adapter.validate_python(steps)
-
-            dto.step_samples = samples
-            data.append(dto)
-        return data
+    def iter_user_data(self, user: UserDTO | None = None, *, chunk_size: int = 5000) -> Iterator[ActivitySummaryDTO]:
+        """Stream daily summaries with their step samples attached, ordered by user and date.
 
-    def ingest_payload(self, payload: Sequence[ActivitySummaryDTO] | ActivitySummaryDTO) -> bool:
+        Summaries and samples are read through server-side cursors in chunks of `chunk_size` rows and
+        merged day by day, so memory stays bounded by one chunk and one day of samples.
+        Streams the data of all users when no user is given.
+        """
+        options = {"stream_results": True, "yield_per": chunk_size}
+        summaries = self.session.execute(q.select_summaries(user), execution_options=options)
+        sample_days = q.group_samples_by_day(
+            self.session.execute(q.select_step_samples(user), execution_options=options)
+        )
+        packed_days = iter(())
+        if self.packed:
+            packed_days = (((row.user_id, row.day), row)
+                           for row in self.session.execute(q.select_step_days(user), execution_options=options))
+
+        key, rows = next(sample_days, (None, None))
+        packed_key, packed_row = next(packed_days, (None, None))
+        for s in summaries:
+            # Skip sample days without a summary
+            while key is not None and key < (s.user_id, s.date):
+                key, rows = next(sample_days, (None, None))
+            while packed_key is not None and packed_key < (s.user_id, s.date):
+                packed_key, packed_row = next(packed_days, (None, None))
+
+            samples = None
+            if key == (s.user_id, s.date):
+                samples = q.to_step_samples(rows)
+                key, rows = next(sample_days, (None, None))
+            if packed_key == (s.user_id, s.date):
+                samples = q.to_step_series(packed_row)
+                packed_key, packed_row = next(packed_days, (None, None))
+            yield q.to_summary(s, samples)
+
+    def get_step_series(self,
+                        user: UserDTO,
+                        freq: str,
+                        start: dt.datetime | None = None,
+                        end: dt.datetime | None = None) -> list[StepBucketDTO]:
+        """Return the user's steps summed per time bucket of size `freq`, ordered by time.
+
+        The aggregation runs in the database, only one row per bucket is transferred.
+        `start` is inclusive, `end` is exclusive.
+        """
+        stmt = q.select_step_series(user, freq, start, end, use_rollups=self._use_rollups, packed=self.packed)
+        return q.to_step_buckets(self.session.execute(stmt))
+
+    @property
+    def _use_rollups(self) -> bool:
+        # Continuous aggregates are defined on `step_sample` only, they miss the packed days
+        if self.packed:
+            return self._rollup_kind == TABLE
+        return self._rollup_kind is not None
+
+    @cached_property
+    def _rollup_kind(self) -> str | None:
+        return rollup_kind(self.session.connection())
+
+    def ingest_payload(self,
+                       payload: Sequence[ActivitySummaryDTO] | ActivitySummaryDTO,
+                       *,
+                       use_copy: bool = False) -> bool:
+        """Store daily summaries and their step samples.
+
+        With `use_copy` the samples of the whole payload are streamed with COPY into a staging table
+        and merged into `step_sample` with a single statement. Falls back to the multi-VALUES insert
+        when the database driver does not support COPY.
+        In the packed layout the days are upserted into `step_day`, only the other days go to `step_sample`.
+        """
         payloads = [payload] if not isinstance(payload, list) else payload
 
-        return all(
-            self._upsert_activity_summary(summary) and self._upsert_step_samples_batch(summary.step_samples)
-            for summary in payloads
-        )
+        if use_copy and payloads and self._supports_copy():
+            stored = self._upsert_activity_summary(payloads) > 0
+            if stored:
+                self._copy_step_samples(self._store_step_days(payloads))
+        else:
+            stored = not payloads or self._upsert_activity_summary(payloads) > 0
+            if stored:
+                self._upsert_step_samples_batch([samples or [] for samples in self._store_step_days(payloads)])
+
+        if stored and self._rollup_kind == TABLE:
+            self._refresh_step_rollups(payloads)
+        return stored
+
+    def _store_step_days(self,
+                         payloads: Sequence[ActivitySummaryDTO]
+                         ) -> list[Sequence[StepSampleDTO] | StepSampleColumns | StepSeries | None]:
+        """Upsert the packed days of the payload into `step_day` when the packed layout is in use.
+        Returns the samples that are stored as `step_sample` rows."""
+        if not self.packed:
+            return [summary.step_samples for summary in payloads]
+
+        packed = q.pack_step_days(payloads, zero_runs=self.zero_runs)
+        for stmt in q.delete_packed_step_samples(packed.spans):
+            self.session.execute(stmt)
+        if packed.rows:
+            self._execute_batched(StepDay.__table__, packed.rows, q.upsert_step_days)
+        self._maybe_flush()
+        self._maybe_commit()
+        return packed.unpacked
 
     def _upsert_activity_summary(self, summary: ActivitySummaryDTO | Sequence[ActivitySummaryDTO]) -> int:
         if isinstance(summary, ActivitySummaryDTO):
             summary = [summary]
 
-        rows = [s.model_dump(exclude={"step_samples"}, by_alias=True) for s in summary]
-
-        stmt = pg_insert(ActivitySummary).values(rows)
-        stmt = stmt.on_conflict_do_update(
-            index_elements=[ActivitySummary.user_id, ActivitySummary.date],
-            set_={
-                "start_time": stmt.excluded.start_time,
-                "end_time": stmt.excluded.end_time,
-                "active_duration": stmt.excluded.active_duration,
-                "inactive_duration": stmt.excluded.inactive_duration,
-                "daily_activity": stmt.excluded.daily_activity,
-                "calories": stmt.excluded.calories,
-                "active_calories": stmt.excluded.active_calories,
-                "steps": stmt.excluded.steps,
-                "inactivity_alert_count": stmt.excluded.inactivity_alert_count,
-                "distance_from_steps": stmt.excluded.distance_from_steps,
-                "updated_at": sa.func.now(),
-            },
-        )
-        result = self.session.execute(stmt)
+        rows = q.summary_rows(summary)
+
+        result = self._execute_batched(ActivitySummary.__table__, rows, q.upsert_activity_summaries)
         self._maybe_flush()
         self._maybe_commit()
-        return 0 if result.rowcount in (None, -1) else result.rowcount
+        return result
 
     def _upsert_step_samples_batch(self,
-                                   samples: Sequence[StepSampleDTO] | Sequence[Sequence[StepSampleDTO]]) -> int:
+                                   samples: Sequence[StepSampleDTO] | StepSampleColumns | StepSeries
+                                   | Sequence[Sequence[StepSampleDTO] | StepSampleColumns | StepSeries]) -> int:
+        """Insert step samples, skipping samples already stored for the same user and timestamp.
+        Returns the number of newly inserted rows."""
         # When no samples are available for the day:
         if not samples:
             return 1
 
-        # If it's a flat list for a single day, wrap it
-        if samples and isinstance(samples[0], StepSampleDTO):
+        # If it's a single day, wrap it
+        if isinstance(samples, (StepSampleColumns, StepSeries)) or isinstance(samples[0], StepSampleDTO):
             samples = [samples]
 
         # Flatten nested list
-        rows = [s.model_dump() for day in samples for s in day]
+        rows = q.step_sample_rows(samples)
+        if not rows:
+            return 1
 
-        stmt = pg_insert(StepSample).values(rows).on_conflict_do_nothing()
+        result = self._execute_batched(StepSample.__table__, rows, q.insert_step_samples)
+        self._maybe_flush()
+        self._maybe_commit()
+        return result
+
+    def _execute_batched(self,
+                         table: sa.Table,
+                         rows: list[dict],
+                         build_stmt: Callable[[list[dict]], sa.Executable]) -> int:
+        """Execute `build_stmt` for consecutive slices of `rows`, each within the bind parameter limit
+        and at most `batch_size` rows. Every statement is timed in `batch_timings`.
+        Returns the summed rowcount."""
+        total = 0
+        for batch in q.batches(rows, self.batch_size):
+            t_start = time.perf_counter()
+            result = self.session.execute(build_stmt(batch))
+            timing = BatchTiming(table=table.name, rows=len(batch), seconds=time.perf_counter() - t_start)
+            self.batch_timings.append(timing)
+            logging.debug("Wrote {} rows to {} in {:.3f}s".format(timing.rows, timing.table, timing.seconds))
+            total += q.rowcount(result)
+        return total
+
+    def batch_report(self) -> dict[str, dict[str, float]]:
+        """Summarise `batch_timings` per table: statements, rows, seconds and rows per second."""
+        report: dict[str, dict[str, float]] = {}
+        for timing in self.batch_timings:
+            entry = report.setdefault(timing.table, {"statements": 0, "rows": 0, "seconds": 0.0})
+            entry["statements"] += 1
+            entry["rows"] += timing.rows
+            entry["seconds"] += timing.seconds
+        for entry in report.values():
+            entry["rows_per_second"] = entry["rows"] / entry["seconds"] if entry["seconds"] else 0.0
+        return report
+
+    def _supports_copy(self) -> bool:
+        cursor = self.session.connection().connection.dbapi_connection.cursor()
+        try:
+            return hasattr(cursor, "copy_expert")
+        finally:
+            cursor.close()
+
+    def _copy_step_samples(self,
+                           samples: Sequence[Sequence[StepSampleDTO] | StepSampleColumns | StepSeries | None]) -> int:
+        """Stream step samples with COPY into the staging table and merge them into `step_sample`.
+        Returns the number of newly inserted rows."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for user_id, timestamp, steps in q.step_sample_records(samples):
+            writer.writerow((user_id, timestamp.isoformat(), steps))
+
+        # When no samples are available for the payload:
+        if not buffer.tell():
+            return 1
+        buffer.seek(0)
+
+        connection = self.session.connection()
+        step_sample_staging.create(connection, checkfirst=True)
+
+        cursor = connection.connection.dbapi_connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY step_sample_staging (user_id, timestamp, steps) FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+        finally:
+            cursor.close()
+
+        columns = ["user_id", "timestamp", "steps"]
+        stmt = (
+            pg_insert(StepSample)
+            .from_select(columns, sa.select(*(step_sample_staging.c[c] for c in columns)))
+            .on_conflict_do_nothing(index_elements=[StepSample.user_id, StepSample.timestamp])
+        )
         result = self.session.execute(stmt)
+        self.session.execute(sa.delete(step_sample_staging))
+        self._maybe_flush()
+        self._maybe_commit()
+        return q.rowcount(result)
+
+    def _refresh_step_rollups(self, payloads: Sequence[ActivitySummaryDTO]) -> None:
+        """Recompute the rollup buckets of the days touched by the payload."""
+        for stmt in q.refresh_step_rollups(payloads, packed=self.packed):
+            self.session.execute(stmt)
         self._maybe_flush()
         self._maybe_commit()
-        return 0 if result.rowcount in (None, -1) else result.rowcount
 
     def get_latest_summary_date(self, user: UserDTO) -> dt.date | None:
         """Return the most recent date stored in the daily summary table."""
-        stmt = sa.select(sa.func.max(ActivitySummary.date)).where(
-            ActivitySummary.user_id == user.user_id
-        )
-        return self.session.execute(stmt).scalar_one_or_none()
+        return self.session.execute(q.select_latest_summary_date(user)).scalar_one_or_none()
+
+    # --- COVERAGE ---
+    def get_covered_ranges(self, user: UserDTO, since: dt.date) -> list[tuple[dt.date, dt.date]]:
+        """Ranges of days from `since` on that need no fetching, the ranges recorded by `add_synced_range`"""
+        return [(row[0], row[1]) for row in self.session.execute(q.select_covered_ranges(user, since))]
+
+    def add_synced_range(self, user: UserDTO, date_from: dt.date, date_to: dt.date) -> None:
+        """Record that all days from `date_from` to `date_to` were fetched"""
+        self.session.execute(q.add_synced_range(user, date_from, date_to))
+        self._maybe_flush()
+        self._maybe_commit()
+
+    # --- INGEST JOBS ---
+    def enqueue_refresh(self, user: UserDTO, priority: int = 0) -> int:
+        """Queue a refresh of the user's data. Returns the id of the new job, or of the job that is
+        already queued or running for the user. A queued job is raised to `priority`."""
+        job_id = None
+        while job_id is None:
+            job_id = self.session.execute(q.enqueue_job(user, priority)).scalar_one_or_none()
+            if job_id is None:
+                # The running job may finish in between, then the next insert succeeds
+                job_id = self.session.execute(q.select_active_job_id(user)).scalar_one_or_none()
+        self._maybe_commit()
+        return job_id
+
+    def enqueue_stale_users(self,
+                            today: dt.date,
+                            stale_after: dt.timedelta,
+                            *,
+                            max_priority: int = 365,
+                            limit: int | None = None) -> list[int]:
+        """Queue a refresh of at most `limit` users last synced more than `stale_after` ago, least recently first.
+        A sync is their latest data or their last finished job, their priority is the number of days since then,
+        at most `max_priority`.
+        Returns the ids of the queued jobs."""
+        job_ids = self.session.execute(q.enqueue_stale_users(today, stale_after, max_priority, limit)).scalars().all()
+        self._maybe_commit()
+        return list(job_ids)
+
+    def claim_job(self,
+                  *,
+                  lease: dt.timedelta,
+                  max_attempts: int = 3,
+                  shard: tuple[int, int] | None = None,
+                  max_running: int | None = None) -> IngestJobDTO | None:
+        """Mark the queued job of the highest priority as running and return it, None when there is nothing to do.
+        Concurrent workers claim different jobs. With `autocommit` the claim is committed right away.
+
+        :param shard: (index, count), only claim jobs of the users in this shard of `count`
+        :param max_running: claim nothing while this many jobs are running, in all workers together
+        """
+        self.session.execute(q.fail_expired_jobs(lease, max_attempts))
+        if max_running is not None:
+            self.session.execute(q.lock_job_claims())
+            if self.session.execute(q.count_running_jobs(lease)).scalar_one() >= max_running:
+                self._maybe_commit()
+                return None
+        row = self.session.execute(q.claim_job(lease, max_attempts, shard)).one_or_none()
+        self._maybe_commit()
+        return q.to_job(row) if row else None
+
+    def finish_job(self, job_id: int, error: str | None = None) -> None:
+        """Mark the job as done, or as failed with `error`"""
+        self.session.execute(q.finish_job(job_id, error))
+        self._maybe_commit()
+
+    def get_latest_job(self, user: UserDTO) -> IngestJobDTO | None:
+        row = self.session.execute(q.select_latest_job(user)).one_or_none()
+        return q.to_job(row) if row else None
@@ -0,0 +1,581 @@
+"""SQL statements and row mapping shared by the synchronous and the asynchronous repository."""
+from __future__ import annotations
+
+import datetime as dt
+from itertools import groupby
+from typing import Iterable, Iterator, NamedTuple, Sequence
+
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from pydantic import TypeAdapter
+
+from step_ingestor.db import AppUser, ActivitySummary, StepSample, StepDay, SyncedRange, IngestJob, AccessToken
+from step_ingestor.db.rollups import STEP_ROLLUPS
+from step_ingestor.dto import (ActivitySummaryDTO, StepSampleDTO, StepSampleColumns, StepSeries, StepBucketDTO, UserDTO,
+                               TokenDTO, IngestJobDTO, step_sample_records)
+
+# PostgreSQL accepts at most 65535 bind parameters in one statement, asyncpg at most 32767
+MAX_BIND_PARAMS = 65535
+ASYNCPG_MAX_BIND_PARAMS = 32767
+
+# Supported step series frequencies and their `date_trunc` field
+STEP_SERIES_FREQS = {
+    "hour": "hour",
+    "day": "day",
+    "week": "week",
+    "month": "month",
+    "quarterly": "quarter",
+    "year": "year",
+}
+
+# Interval of Polar's step samples, used to pack days that were not parsed into a `StepSeries`
+DEFAULT_INTERVAL_MS = 60_000
+_MILLISECOND = sa.literal_column("INTERVAL '1 millisecond'", type_=sa.Interval)
+
+# Columns of the projection-only user and token lookups
+_user_columns = (AppUser.user_id, AppUser.polar_user_id, AppUser.created_at, AppUser.updated_at)
+_token_columns = (AccessToken.access_token, AccessToken.issuer, AccessToken.issued_at, AccessToken.expires_at)
+
+# Ingest job states, a user has at most one job in the active states
+JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED = "queued", "running", "done", "failed"
+_ACTIVE_JOB = IngestJob.status.in_([JOB_QUEUED, JOB_RUNNING])
+_job_columns = (IngestJob.job_id, IngestJob.user_id, IngestJob.status, IngestJob.attempts, IngestJob.priority,
+                IngestJob.error, IngestJob.created_at, IngestJob.started_at, IngestJob.finished_at)
+# Claims of jobs are serialized on this advisory lock while a cap on the running jobs is enforced
+_JOB_CLAIM_LOCK = 0x5354_4550
+
+_step_samples_adapter = TypeAdapter(list[StepSampleDTO])
+_step_buckets_adapter = TypeAdapter(list[StepBucketDTO])
+
+
+class BatchTiming(NamedTuple):
+    """Duration of one multi-row statement"""
+    table: str
+    rows: int
+    seconds: float
+
+
+class PackedDays(NamedTuple):
+    """Step samples of a payload split by storage layout"""
+    rows: list[dict]  # `step_day` rows
+    spans: dict[str, list[tuple[dt.datetime, dt.datetime]]]  # First and last sample of the packed days per user
+    unpacked: list[Sequence[StepSampleDTO] | StepSampleColumns | None]  # Days off the interval grid, stored as rows
+
+
+# --- USERS ---
+def insert_user(user: UserDTO) -> sa.Executable:
+    return (
+        pg_insert(AppUser)
+        .values(user.model_dump(exclude={"access_token"}, by_alias=True))
+        .on_conflict_do_nothing(index_elements=[AppUser.user_id])
+    )
+
+
+def upsert_access_token(user: UserDTO) -> sa.Executable:
+    if not user.access_token:
+        raise ValueError("No access token provided.")
+
+    data = user.access_token.model_dump(by_alias=True)
+    data["user_id"] = user.user_id
+
+    stmt = pg_insert(AccessToken).values(data)
+    return stmt.on_conflict_do_update(
+        index_elements=[AccessToken.user_id],
+        set_={
+            "access_token": stmt.excluded.access_token,
+            "issuer": stmt.excluded.issuer,
+            "expires_at": stmt.excluded.expires_at,
+            "updated_at": sa.func.now(),
+        },
+    )
+
+
+def delete_user(user: UserDTO) -> sa.Executable:
+    return sa.delete(AppUser).where(AppUser.user_id == user.user_id)
+
+
+def select_user(user_id=None, polar_user_id=None) -> sa.Select:
+    if user_id:
+        criterion = AppUser.user_id == user_id
+    elif polar_user_id:
+        criterion = AppUser.polar_user_id == polar_user_id
+    else:
+        raise ValueError("No user ID provided")
+
+    return (
+        sa.select(*_user_columns, *_token_columns)
+        .outerjoin(AccessToken, AppUser.user_id == AccessToken.user_id)
+        .where(criterion)
+    )
+
+
+def row_to_user(row: sa.Row) -> UserDTO:
+    u = UserDTO.model_validate({c.key: row._mapping[c.key] for c in _user_columns})
+    if row.access_token is not None:
+        u.access_token = TokenDTO.model_validate(row)
+    return u
+
+
+def select_access_token(user: UserDTO) -> sa.Select:
+    return sa.select(*_token_columns).where(AccessToken.user_id == user.user_id)
+
+
+def row_to_token(row: sa.Row) -> TokenDTO:
+    return TokenDTO.model_validate(row)
+
+
+# --- ACTIVITY DATA ---
+def select_summaries(user: UserDTO | None) -> sa.Select:
+    """Summary columns of one or all users, ordered by user and date"""
+    stmt = sa.select(*ActivitySummary.__table__.columns)
+    if user is not None:
+        stmt = stmt.where(ActivitySummary.user_id == user.user_id)
+    else:
+        # Byte order, so the database sorts user ids the same way Python compares them
+        stmt = stmt.order_by(ActivitySummary.user_id.collate("C"))
+    return stmt.order_by(ActivitySummary.date)
+
+
+def select_step_samples(user: UserDTO | None) -> sa.Select:
+    """Step samples of one or all users with the day they belong to, ordered by user and time"""
+    day = sa.cast(StepSample.timestamp, sa.Date).label("day")
+    stmt = sa.select(day, StepSample.user_id, StepSample.timestamp, StepSample.steps)
+    if user is not None:
+        stmt = stmt.where(StepSample.user_id == user.user_id)
+    else:
+        stmt = stmt.order_by(StepSample.user_id.collate("C"))
+    return stmt.order_by(StepSample.timestamp)
+
+
+def group_samples_by_day(rows: Iterable[sa.Row]) -> Iterator[tuple[tuple[str, dt.date], Iterator[sa.Row]]]:
+    """Group rows of `select_step_samples` per (user_id, day)"""
+    return groupby(rows, key=lambda r: (r.user_id, r.day))
+
+
+def to_step_samples(rows: Iterable[sa.Row]) -> list[StepSampleDTO]:
+    return _step_samples_adapter.validate_python(list(rows))
+
+
+def select_step_days(user: UserDTO | None) -> sa.Select:
+    """Packed step days of one or all users, ordered by user and day like `select_step_samples`"""
+    stmt = sa.select(StepDay.user_id, StepDay.day, StepDay.start, StepDay.interval_ms, StepDay.counts)
+    if user is not None:
+        stmt = stmt.where(StepDay.user_id == user.user_id)
+    else:
+        stmt = stmt.order_by(StepDay.user_id.collate("C"))
+    return stmt.order_by(StepDay.day)
+
+
+def to_step_series(row: sa.Row) -> StepSeries:
+    return StepSeries.from_packed(row.user_id, row.start, row.interval_ms, row.counts)
+
+
+def unpacked_step_days(user_id: str | None = None) -> sa.Subquery:
+    """`step_day` expanded to one row per sample with the columns of `step_sample`: user_id, timestamp, steps"""
+    element = (sa.func.unnest(StepDay.counts)
+               .table_valued("value", with_ordinality="position")
+               .render_derived(name="element")
+               .lateral())
+    # A run of zeros covers as many intervals as its length, every other element one
+    width = sa.case((element.c.value < 0, -element.c.value), else_=1)
+    slot = sa.func.sum(width).over(partition_by=(StepDay.user_id, StepDay.day), order_by=element.c.position) - width
+    slots = (
+        sa.select(StepDay.user_id, StepDay.start, StepDay.interval_ms, element.c.value, slot.label("slot"))
+        .select_from(StepDay)
+        .join(element, sa.true())
+    )
+    if user_id is not None:
+        slots = slots.where(StepDay.user_id == user_id)
+    slots = slots.subquery("slots")
+
+    run = (sa.func.generate_series(0, sa.case((slots.c.value < 0, -slots.c.value - 1), else_=0))
+           .table_valued("n")
+           .render_derived(name="run")
+           .lateral())
+    timestamp = slots.c.start + (slots.c.slot + run.c.n) * slots.c.interval_ms * _MILLISECOND
+    return (
+        sa.select(slots.c.user_id, timestamp.label("timestamp"), sa.func.greatest(slots.c.value, 0).label("steps"))
+        .select_from(slots)
+        .join(run, sa.true())
+        .where(slots.c.value.is_not(None))
+        .subquery("step_day_samples")
+    )
+
+
+def step_sample_source(user_id: str | None = None, packed: bool = False) -> sa.FromClause:
+    """`step_sample`, combined with the samples of `step_day` when the packed layout is in use"""
+    if not packed:
+        return StepSample.__table__
+    rows = sa.select(StepSample.user_id, StepSample.timestamp, StepSample.steps)
+    if user_id is not None:
+        rows = rows.where(StepSample.user_id == user_id)
+    return sa.union_all(rows, sa.select(unpacked_step_days(user_id))).subquery("step_samples")
+
+
+def to_summary(row: sa.Row, step_samples: list[StepSampleDTO] | StepSeries | None) -> ActivitySummaryDTO:
+    dto = ActivitySummaryDTO.model_validate(row)
+    dto.step_samples = step_samples if step_samples is not None else []
+    return dto
+
+
+def select_step_series(user: UserDTO,
+                       freq: str,
+                       start: dt.datetime | None,
+                       end: dt.datetime | None,
+                       use_rollups: bool,
+                       packed: bool = False) -> sa.Select:
+    if freq not in STEP_SERIES_FREQS:
+        raise ValueError("Unsupported frequency: {}".format(freq))
+
+    # Read precomputed hourly or daily totals when available, raw samples otherwise
+    if use_rollups:
+        rollup = STEP_ROLLUPS["hour" if freq == "hour" else "day"][0]
+        user_id, timestamp, steps = rollup.c.user_id, rollup.c.bucket, rollup.c.steps
+    else:
+        source = step_sample_source(user.user_id, packed)
+        user_id, timestamp, steps = source.c.user_id, source.c.timestamp, source.c.steps
+
+    # Field is taken from the whitelist above, rendered inline so SELECT and GROUP BY match
+    field = sa.literal_column("'{}'".format(STEP_SERIES_FREQS[freq]))
+    bucket = sa.func.date_trunc(field, timestamp)
+
+    stmt = (
+        sa.select(bucket.label("timestamp"), sa.func.sum(steps).label("steps"))
+        .where(user_id == user.user_id)
+        .group_by(bucket)
+        .order_by(bucket)
+    )
+    if start is not None:
+        stmt = stmt.where(timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(timestamp < end)
+    return stmt
+
+
+def to_step_buckets(rows: Iterable[sa.Row]) -> list[StepBucketDTO]:
+    return _step_buckets_adapter.validate_python(list(rows))
+
+
+def select_latest_summary_date(user: UserDTO) -> sa.Select:
+    return sa.select(sa.func.max(ActivitySummary.date)).where(ActivitySummary.user_id == user.user_id)
+
+
+# --- INGESTION ---
+def summary_rows(summaries: Sequence[ActivitySummaryDTO]) -> list[dict]:
+    return [s.model_dump(exclude={"step_samples"}, by_alias=True) for s in summaries]
+
+
+def step_sample_rows(samples: Iterable[Sequence[StepSampleDTO] | StepSampleColumns | StepSeries | None]) -> list[dict]:
+    return [{"user_id": user_id, "timestamp": timestamp, "steps": steps}
+            for user_id, timestamp, steps in step_sample_records(samples)]
+
+
+def upsert_activity_summaries(rows: list[dict]) -> sa.Executable:
+    stmt = pg_insert(ActivitySummary).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[ActivitySummary.user_id, ActivitySummary.date],
+        set_={
+            "start_time": stmt.excluded.start_time,
+            "end_time": stmt.excluded.end_time,
+            "active_duration": stmt.excluded.active_duration,
+            "inactive_duration": stmt.excluded.inactive_duration,
+            "daily_activity": stmt.excluded.daily_activity,
+            "calories": stmt.excluded.calories,
+            "active_calories": stmt.excluded.active_calories,
+            "steps": stmt.excluded.steps,
+            "inactivity_alert_count": stmt.excluded.inactivity_alert_count,
+            "distance_from_steps": stmt.excluded.distance_from_steps,
+            "updated_at": sa.func.now(),
+        },
+    )
+
+
+def insert_step_samples(rows: list[dict]) -> sa.Executable:
+    return (
+        pg_insert(StepSample)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=[StepSample.user_id, StepSample.timestamp])
+    )
+
+
+def as_step_series(samples: Sequence[StepSampleDTO] | StepSampleColumns | StepSeries | None) -> StepSeries | None:
+    """Samples of one day as a `StepSeries`, None when there are none or they are not on the interval grid"""
+    if isinstance(samples, StepSeries) or not samples:
+        return samples or None
+    if isinstance(samples, StepSampleColumns):
+        return StepSeries.from_columns(samples, DEFAULT_INTERVAL_MS)
+
+    timestamps, tz = [s.timestamp for s in samples], None
+    if timestamps[0].tzinfo is not None:
+        timestamps, tz = [t.astimezone(dt.timezone.utc).replace(tzinfo=None) for t in timestamps], dt.timezone.utc
+    columns = StepSampleColumns(samples[0].user_id,
+                                np.array(timestamps, dtype="datetime64[us]"),
+                                np.fromiter((s.steps for s in samples), dtype=np.int32, count=len(samples)))
+    series = StepSeries.from_columns(columns, DEFAULT_INTERVAL_MS)
+    if series is not None:
+        series.tz = tz
+    return series
+
+
+def pack_step_days(summaries: Sequence[ActivitySummaryDTO], zero_runs: bool = False) -> PackedDays:
+    """`step_day` rows of the days whose samples are on the interval grid, the samples of other days are
+    returned for the `step_sample` table.
+
+    A packed day holds the samples of its own date. Polar may also send the first sample of the next day,
+    such samples are stored as rows unless a packed day of the payload covers them.
+    """
+    packed = PackedDays(rows=[], spans={}, unpacked=[])
+    next_day_samples = []
+    for summary in summaries:
+        series, next_day = as_step_series(summary.step_samples), None
+        if series is not None and series.tz is None:
+            series, next_day = series.split(np.datetime64(summary.date + dt.timedelta(days=1)))
+        if series is None:
+            packed.unpacked.append(summary.step_samples)
+            continue
+        if next_day is not None:
+            next_day_samples.append(next_day)
+
+        start = series.start.item().replace(tzinfo=series.tz)
+        last = start + dt.timedelta(milliseconds=(len(series.counts) - 1) * series.interval_ms)
+        packed.rows.append({"user_id": summary.user_id,
+                            "day": summary.date,
+                            "start": start,
+                            "interval_ms": series.interval_ms,
+                            "counts": series.pack(zero_runs=zero_runs)})
+        packed.spans.setdefault(summary.user_id, []).append((start, last))
+
+    for series in next_day_samples:
+        spans = packed.spans.get(series.user_id, [])
+        samples = [StepSampleDTO(user_id=user_id, timestamp=timestamp, steps=steps)
+                   for user_id, timestamp, steps in series.records()
+                   if not any(first <= timestamp <= last for first, last in spans)]
+        if samples:
+            packed.unpacked.append(samples)
+    return packed
+
+
+def upsert_step_days(rows: list[dict]) -> sa.Executable:
+    """A refetched day replaces the stored one, Polar always sends the complete day"""
+    stmt = pg_insert(StepDay).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[StepDay.user_id, StepDay.day],
+        set_={
+            "start": stmt.excluded.start,
+            "interval_ms": stmt.excluded.interval_ms,
+            "counts": stmt.excluded.counts,
+        },
+    )
+
+
+def delete_packed_step_samples(spans: dict[str, list[tuple[dt.datetime, dt.datetime]]]) -> Iterator[sa.Executable]:
+    """Statements that remove `step_sample` rows of days that are stored packed, so no sample is read twice"""
+    for user_id, user_spans in spans.items():
+        yield sa.delete(StepSample).where(
+            StepSample.user_id == user_id,
+            sa.or_(*(StepSample.timestamp.between(first, last) for first, last in user_spans)),
+        )
+
+
+def batches(rows: list[dict],
+            batch_size: int | None,
+            max_params: int = MAX_BIND_PARAMS) -> Iterator[list[dict]]:
+    """Consecutive slices of `rows` of at most `batch_size` rows, within the bind parameter limit"""
+    if not rows:
+        return
+    limit = max_params // max(len(rows[0]), 1)
+    size = min(batch_size or limit, limit)
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def refresh_step_rollups(payloads: Sequence[ActivitySummaryDTO], packed: bool = False) -> Iterator[sa.Executable]:
+    """Statements that recompute the rollup buckets of the days touched by the payload.
+    Continuous aggregates are maintained by TimescaleDB and do not need these."""
+    ranges: dict[str, tuple[dt.datetime, dt.datetime]] = {}
+    for summary in payloads:
+        samples = summary.step_samples
+        if isinstance(samples, (StepSampleColumns, StepSeries)):
+            if not len(samples):
+                continue
+            day_first, day_last = samples.timestamps.min().item(), samples.timestamps.max().item()
+            first, last = ranges.get(samples.user_id, (day_first, day_last))
+            ranges[samples.user_id] = (min(first, day_first), max(last, day_last))
+            continue
+        for s in samples or ():
+            first, last = ranges.get(s.user_id, (s.timestamp, s.timestamp))
+            ranges[s.user_id] = (min(first, s.timestamp), max(last, s.timestamp))
+
+    day = sa.literal_column("'day'")
+    for user_id, (first, last) in ranges.items():
+        source = step_sample_source(user_id, packed)
+        for freq, (rollup, _, _) in STEP_ROLLUPS.items():
+            bucket = sa.func.date_trunc(sa.literal_column("'{}'".format(freq)), source.c.timestamp)
+            select = (
+                sa.select(source.c.user_id, bucket, sa.func.sum(source.c.steps))
+                .where(
+                    source.c.user_id == user_id,
+                    source.c.timestamp >= sa.func.date_trunc(day, first),
+                    source.c.timestamp < sa.func.date_trunc(day, last) + dt.timedelta(days=1),
+                )
+                .group_by(source.c.user_id, bucket)
+            )
+            stmt = pg_insert(rollup).from_select(["user_id", "bucket", "steps"], select)
+            yield stmt.on_conflict_do_update(
+                index_elements=[rollup.c.user_id, rollup.c.bucket],
+                set_={"steps": stmt.excluded.steps},
+            )
+
+
+# --- COVERAGE ---
+def select_covered_ranges(user: UserDTO, since: dt.date) -> sa.Select:
+    """Synced ranges ending on or after `since`. Stored summaries do not count, a summary is committed before
+    the samples of its day, so a day whose samples failed to be written is fetched again."""
+    return sa.select(SyncedRange.date_from, SyncedRange.date_to).where(SyncedRange.user_id == user.user_id,
+                                                                       SyncedRange.date_to >= since)
+
+
+def add_synced_range(user: UserDTO, date_from: dt.date, date_to: dt.date) -> sa.Executable:
+    """Replace the ranges overlapping or adjacent to the new one by a single range spanning all of them"""
+    one_day = dt.timedelta(days=1)
+    merged = (
+        sa.delete(SyncedRange)
+        .where(SyncedRange.user_id == user.user_id,
+               SyncedRange.date_from <= date_to + one_day,
+               SyncedRange.date_to >= date_from - one_day)
+        .returning(SyncedRange.date_from, SyncedRange.date_to)
+        .cte("merged")
+    )
+    # Without merged ranges the aggregates are NULL, which LEAST and GREATEST ignore
+    span = sa.select(sa.literal(user.user_id, sa.String),
+                     sa.func.least(sa.literal(date_from, sa.Date), sa.func.min(merged.c.date_from)),
+                     sa.func.greatest(sa.literal(date_to, sa.Date), sa.func.max(merged.c.date_to)))
+    return pg_insert(SyncedRange).from_select(["user_id", "date_from", "date_to"], span).add_cte(merged)
+
+
+# --- INGEST JOBS ---
+def enqueue_job(user: UserDTO, priority: int = 0) -> sa.Executable:
+    """Queue a job unless the user already has a queued or running one, returns the job's id unless it is running.
+    A queued job takes the higher of both priorities."""
+    stmt = pg_insert(IngestJob).values(user_id=user.user_id, priority=priority)
+    return (
+        stmt.on_conflict_do_update(index_elements=[IngestJob.user_id],
+                                   index_where=_ACTIVE_JOB,
+                                   set_={"priority": sa.func.greatest(IngestJob.priority, stmt.excluded.priority)},
+                                   where=IngestJob.status == JOB_QUEUED)
+        .returning(IngestJob.job_id)
+    )
+
+
+def enqueue_stale_users(today: dt.date,
+                        stale_after: dt.timedelta,
+                        max_priority: int,
+                        limit: int | None = None) -> sa.Executable:
+    """Queue a job for every user last synced more than `stale_after` ago, the least recently synced users first
+    and with the days since their last sync as priority. A user's last sync is the later of their latest summary
+    and their last finished or failed job, so users without data or with a revoked token are not queued again
+    right after their job ended. Users never synced get `max_priority`. Users with a queued or running job are
+    skipped. Returns the ids of the queued jobs."""
+    latest_summary = sa.select(sa.func.max(ActivitySummary.date)).where(ActivitySummary.user_id == AppUser.user_id)
+    last_attempt = (sa.select(sa.func.max(sa.cast(IngestJob.finished_at, sa.Date)))
+                    .where(IngestJob.user_id == AppUser.user_id))
+    # GREATEST ignores NULL, it is NULL only for users never synced
+    synced = (
+        sa.select(AppUser.user_id,
+                  sa.func.greatest(latest_summary.scalar_subquery(), last_attempt.scalar_subquery()).label("last_sync"))
+        .where(~sa.exists().where(IngestJob.user_id == AppUser.user_id, _ACTIVE_JOB))
+        .subquery()
+    )
+    staleness = sa.func.least(sa.func.coalesce(sa.literal(today, sa.Date) - synced.c.last_sync, max_priority),
+                              max_priority)
+    stale = (
+        sa.select(synced.c.user_id, staleness.label("priority"))
+        .where(sa.or_(synced.c.last_sync.is_(None), synced.c.last_sync < today - stale_after))
+        .order_by(synced.c.last_sync.asc().nulls_first(), synced.c.user_id)
+        .limit(limit)
+    )
+    return (
+        pg_insert(IngestJob)
+        .from_select(["user_id", "priority"], stale)
+        .on_conflict_do_nothing(index_elements=[IngestJob.user_id], index_where=_ACTIVE_JOB)
+        .returning(IngestJob.job_id)
+    )
+
+
+def select_active_job_id(user: UserDTO) -> sa.Select:
+    return sa.select(IngestJob.job_id).where(IngestJob.user_id == user.user_id, _ACTIVE_JOB)
+
+
+def lock_job_claims() -> sa.Executable:
+    """Transaction level lock held by one claiming worker at a time"""
+    return sa.select(sa.func.pg_advisory_xact_lock(_JOB_CLAIM_LOCK))
+
+
+def count_running_jobs(lease: dt.timedelta) -> sa.Select:
+    return sa.select(sa.func.count()).where(IngestJob.status == JOB_RUNNING,
+                                            IngestJob.started_at >= sa.func.now() - lease)
+
+
+def claim_job(lease: dt.timedelta, max_attempts: int, shard: tuple[int, int] | None = None) -> sa.Executable:
+    """Mark the claimable job of the highest priority, and the oldest of those, as running and return it.
+    Jobs locked by another worker are skipped. A running job whose worker did not finish it within `lease` is
+    claimed again, up to `max_attempts` times. With `shard` (index, count) only users hashed to the shard are claimed."""
+    expired = sa.and_(IngestJob.status == JOB_RUNNING, IngestJob.started_at < sa.func.now() - lease)
+    candidate = (
+        sa.select(IngestJob.job_id)
+        .where(sa.or_(IngestJob.status == JOB_QUEUED, expired), IngestJob.attempts < max_attempts)
+    )
+    if shard is not None:
+        index, count = shard
+        candidate = candidate.where(sa.func.abs(sa.func.hashtext(IngestJob.user_id) % count) == index)
+    candidate = (
+        candidate
+        .order_by(IngestJob.priority.desc(), IngestJob.created_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    return (
+        sa.update(IngestJob)
+        .where(IngestJob.job_id == candidate)
+        .values(status=JOB_RUNNING, attempts=IngestJob.attempts + 1, started_at=sa.func.now(), finished_at=None)
+        .returning(*_job_columns)
+    )
+
+
+def fail_expired_jobs(lease: dt.timedelta, max_attempts: int) -> sa.Executable:
+    """Give up on running jobs whose worker was lost on each of the `max_attempts` attempts,
+    so the user can be queued again"""
+    return (
+        sa.update(IngestJob)
+        .where(IngestJob.status == JOB_RUNNING,
+               IngestJob.started_at < sa.func.now() - lease,
+               IngestJob.attempts >= max_attempts)
+        .values(status=JOB_FAILED, error="Worker lost", finished_at=sa.func.now())
+    )
+
+
+def finish_job(job_id: int, error: str | None = None) -> sa.Executable:
+    return (
+        sa.update(IngestJob)
+        .where(IngestJob.job_id == job_id)
+        .values(status=JOB_FAILED if error else JOB_DONE, error=error, finished_at=sa.func.now())
+    )
+
+
+def select_latest_job(user: UserDTO) -> sa.Select:
+    return (
+        sa.select(*_job_columns)
+        .where(IngestJob.user_id == user.user_id)
+        .order_by(IngestJob.created_at.desc(), IngestJob.job_id.desc())
+        .limit(1)
+    )
+
+
+def to_job(row: sa.Row) -> IngestJobDTO:
+    return IngestJobDTO.model_validate(row)
+
+
+def rowcount(result: sa.CursorResult) -> int:
+    return 0 if result.rowcount in (None, -1) else result.rowcount
@@ -1,5 +1,6 @@
-from .src.service import UserStepPlotter
+from .src.service import UserStepPlotter, StepSeriesPlotter
 
 __all__ = [
-    "UserStepPlotter"
+    "UserStepPlotter",
+    "StepSeriesPlotter"
 ]
\ No newline at end of file
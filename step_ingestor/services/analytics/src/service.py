@@ -1,6 +1,8 @@
 import pandas as pd
 import plotly.express as px
 
+from step_ingestor.dto import StepSeries, step_sample_records
+
 
 class UserStepPlotter:
     def __init__(self, user_data):
@@ -8,15 +10,38 @@ class UserStepPlotter:
 
     @property
     def user_steps(self):
+        # Days parsed into a StepSeries are taken over as they are, other days are converted sample by sample
+        days = [summary.step_samples.to_pandas() for summary in self.user_data
+                if isinstance(summary.step_samples, StepSeries)]
         step_records = [
-            step.model_dump() for summary in self.user_data
-            if summary.step_samples  # Case: no step samples
-            for step in summary.step_samples
+            {"timestamp": timestamp, "steps": steps}
+            for _, timestamp, steps in step_sample_records(summary.step_samples for summary in self.user_data
+                                                           if not isinstance(summary.step_samples, StepSeries))
         ]
-        return pd.DataFrame(step_records).set_index("timestamp")
+        if step_records or not days:
+            days.append(pd.DataFrame(step_records, columns=["timestamp", "steps"]).set_index("timestamp")["steps"])
+        return pd.concat(days).sort_index().to_frame("steps")
 
     def create_plot(self, freq, from_=None, to=None):
         sel = self.user_steps[from_:to]["steps"].resample(freq).sum()
         fig = px.bar(sel, x=sel.index, y="steps")
 
         return fig.to_html(include_plotlyjs='cdn', full_html=False)
+
+
+class StepSeriesPlotter:
+    def __init__(self, step_series):
+        self.step_series = step_series
+
+    @property
+    def user_steps(self):
+        return pd.DataFrame(
+            [bucket.model_dump() for bucket in self.step_series],
+            columns=["timestamp", "steps"]
+        ).set_index("timestamp")
+
+    def create_plot(self):
+        sel = self.user_steps
+        fig = px.bar(sel, x=sel.index, y="steps")
+
+        return fig.to_html(include_plotlyjs='cdn', full_html=False)
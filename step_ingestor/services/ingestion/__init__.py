@@ -1,7 +1,18 @@
 from .src.service import IngestionService
-from .src.utils import date_windows_28d
+from .src.pipeline import IngestionPipeline
+from .src.jobs import run_refresh_jobs, schedule_refreshes, LOGIN_PRIORITY
+from .src.async_service import AsyncIngestionService, refresh_users
+from .src.utils import date_windows_28d, plan_date_windows, settled_range
 
 __all__ = [
     "IngestionService",
-    "date_windows_28d"
-]
\ No newline at end of file
+    "IngestionPipeline",
+    "run_refresh_jobs",
+    "schedule_refreshes",
+    "LOGIN_PRIORITY",
+    "AsyncIngestionService",
+    "refresh_users",
+    "date_windows_28d",
+    "plan_date_windows",
+    "settled_range"
+]
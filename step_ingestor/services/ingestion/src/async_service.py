@@ -0,0 +1,139 @@
+"""Asynchronous counterpart of `IngestionService`, for workers that refresh many users concurrently."""
+import asyncio
+import inspect
+import logging
+import datetime as dt
+
+from step_ingestor.dto import UserDTO
+from step_ingestor.interfaces.repositories import AsyncStepIngestorRepository
+from .utils import date_windows_28d, plan_date_windows, settled_range
+
+
+class AsyncIngestionService:
+    def __init__(self, provider, repo, stream=False):
+        """
+        :param stream: ingest windows day by day as they are received, with an async provider such as
+            `AsyncAdapter`. About one day per window in flight is held in memory.
+        """
+        self.provider = provider
+        self.repo = repo
+        self.stream = stream
+        # Windows are fetched concurrently, but the repository's session takes one write at a time
+        self._write_lock = asyncio.Lock()
+
+    async def _fetch(self, method, **kwargs):
+        """Call a provider method, blocking providers run in a worker thread so the event loop stays free"""
+        func = getattr(self.provider, method)
+        if inspect.iscoroutinefunction(func):
+            return await func(**kwargs)
+        return await asyncio.to_thread(func, **kwargs)
+
+    async def add_user(self, *, user: UserDTO):
+        """Register the user in the database"""
+        return await self.repo.add_user(user)
+
+    async def get_user(self, *, user_id=None, polar_user_id=None):
+        if user_id and polar_user_id:
+            raise ValueError
+        if user_id:
+            return await self.repo.get_user_by_id(user_id=user_id)
+        return await self.repo.get_user_by_id(polar_user_id=polar_user_id)
+
+    async def get_access_token(self, *, user: UserDTO):
+        return await self.repo.get_access_token(user)
+
+    async def update_access_token(self, *, user: UserDTO):
+        return await self.repo.update_user_access_token(user)
+
+    async def delete_user(self, *, user: UserDTO):
+        return await self.repo.delete_user(user)
+
+    async def refresh_user_data(self, *, user: UserDTO, days_back=365):
+        """Fetch the days of the last `days_back` that were not synced yet, with as few requests as possible.
+        Gaps left by an interrupted refresh are fetched as well. Data stored before synced ranges were
+        recorded is fetched once more."""
+        today = dt.date.today()
+        covered = await self.repo.get_covered_ranges(user, since=today - dt.timedelta(days=days_back))
+        ranges = plan_date_windows(covered, today=today, days_back=days_back)
+
+        # When all available data has been saved already
+        if not ranges:
+            return True
+        return await self._populate_db_historical(user, ranges=ranges)
+
+    async def enqueue_refresh(self, *, user: UserDTO, priority=0):
+        """Queue `refresh_user_data` for a worker (see `run_refresh_jobs`), returns the job id.
+        Jobs of a higher `priority` run first."""
+        return await self.repo.enqueue_refresh(user, priority=priority)
+
+    async def get_refresh_job(self, *, user: UserDTO):
+        """Latest queued, running or finished refresh of the user"""
+        return await self.repo.get_latest_job(user)
+
+    async def _populate_db_historical(self, user: UserDTO, days_back=365, ranges=None):
+        """Stores data from Polar API from last `days_back` days in DB.
+        All windows are requested at once, the provider bounds how many are in flight (see `AsyncAccessLink`).
+        Windows are written in the order they arrive, with `stream` day by day. Every window that was stored
+        completely is recorded as synced."""
+        if ranges is None:
+            ranges = date_windows_28d(days_back=days_back)
+
+        stream = self.stream and inspect.isasyncgenfunction(getattr(self.provider, "iter_activity_date_range", None))
+
+        fetches = []
+        for date_from, date_to in ranges:
+            logging.debug("Fetching range from {} to {}".format(date_from, date_to))
+            if stream:
+                fetch = self._stream_window(date_from=date_from, date_to=date_to, user=user)
+            else:
+                fetch = self._fetch("get_activity_date_range", date_from=date_from, date_to=date_to, user=user)
+            fetches.append(asyncio.ensure_future(self._tag(fetch, date_from, date_to)))
+        try:
+            for fetch in asyncio.as_completed(fetches):
+                date_from, date_to, payload = await fetch
+                async with self._write_lock:
+                    if payload:
+                        await self.repo.ingest_payload(payload=payload)
+                    settled = settled_range(date_from, date_to)
+                    if settled:
+                        await self.repo.add_synced_range(user, *settled)
+        finally:
+            # Stop the remaining requests when a window fails
+            for fetch in fetches:
+                fetch.cancel()
+        return True
+
+    @staticmethod
+    async def _tag(fetch, date_from, date_to):
+        return date_from, date_to, await fetch
+
+    async def _stream_window(self, date_from, date_to, user: UserDTO):
+        """Ingest the days of one window as they are received"""
+        async for summary in self.provider.iter_activity_date_range(date_from=date_from, date_to=date_to, user=user):
+            async with self._write_lock:
+                await self.repo.ingest_payload(payload=summary)
+        return None
+
+    async def get_user_data(self, *, user):
+        return await self.repo.get_user_data(user)
+
+    def iter_user_data(self, *, user=None, chunk_size=5000):
+        return self.repo.iter_user_data(user, chunk_size=chunk_size)
+
+    async def get_step_series(self, *, user, freq, start=None, end=None):
+        return await self.repo.get_step_series(user, freq, start=start, end=end)
+
+
+async def refresh_users(users, *, provider, session_factory, concurrency=8, stream=False, **repo_kwargs):
+    """Refresh the data of many users concurrently, at most `concurrency` at a time.
+    Every user gets its own session from `session_factory` (an `async_sessionmaker`).
+    Returns the results in the order of `users`, exceptions are returned instead of raised."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def refresh(user):
+        async with semaphore, session_factory() as session:
+            repo = AsyncStepIngestorRepository(session=session, autocommit=True, **repo_kwargs)
+            service = AsyncIngestionService(provider=provider, repo=repo, stream=stream)
+            return await service.refresh_user_data(user=user)
+
+    return await asyncio.gather(*(refresh(u) for u in users), return_exceptions=True)
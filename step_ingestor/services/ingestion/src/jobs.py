@@ -0,0 +1,72 @@
+"""Worker loop for the refresh jobs queued by `IngestionService.enqueue_refresh`, and the scheduler that
+queues refreshes of users whose data went stale."""
+import time
+import logging
+import datetime as dt
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from .service import IngestionService
+
+# A user waiting on the dashboard goes before scheduled refreshes, whose priority is their staleness in days
+LOGIN_PRIORITY = 1000
+MAX_STALE_PRIORITY = 365
+
+
+def schedule_refreshes(repo, *, stale_after=dt.timedelta(days=1), limit=None, today=None) -> list[int]:
+    """Queue a refresh of every user neither with data nor with a finished job in the last `stale_after`,
+    the least recently synced users first.
+    With `limit`, at most that many users are queued per call, so calling it periodically spreads
+    the requests to Polar over time. Returns the ids of the queued jobs."""
+    job_ids = repo.enqueue_stale_users(today or dt.date.today(),
+                                       stale_after,
+                                       max_priority=MAX_STALE_PRIORITY,
+                                       limit=limit)
+    logging.info("Scheduled refresh of {} stale users".format(len(job_ids)))
+    return job_ids
+
+
+def run_refresh_jobs(session_factory,
+                     service_factory: Callable[[Session], IngestionService],
+                     *,
+                     once=False,
+                     poll_interval=5.0,
+                     lease=dt.timedelta(minutes=30),
+                     max_attempts=3,
+                     shard=None,
+                     max_running=None) -> int:
+    """Claim and run queued refresh jobs, one at a time, each in its own session from `session_factory`.
+    Start several workers to run jobs in parallel. Returns the number of jobs run.
+
+    :param service_factory: builds the service of a job from its session, its repository should commit
+        every payload, so the user sees the windows that were already written
+    :param once: return when no job can be claimed instead of polling every `poll_interval` seconds
+    :param lease: a running job that is not finished within this time is assumed lost and is claimed again
+    :param max_attempts: claims of a job before it is failed
+    :param shard: (index, count), only run the jobs of the users in this shard
+    :param max_running: jobs running at the same time in all workers together, at most
+    """
+    n_run = 0
+    while True:
+        with session_factory() as session:
+            service = service_factory(session)
+            job = service.repo.claim_job(lease=lease, max_attempts=max_attempts, shard=shard, max_running=max_running)
+            if job is None:
+                if once:
+                    return n_run
+                time.sleep(poll_interval)
+                continue
+
+            logging.info("Running refresh job {} of user {}, attempt {}".format(job.job_id, job.user_id, job.attempts))
+            error = None
+            try:
+                user = service.get_user(user_id=job.user_id)
+                service.refresh_user_data(user=user)
+            except Exception as e:
+                logging.exception("Refresh job {} failed".format(job.job_id))
+                session.rollback()
+                error = "{}: {}".format(type(e).__name__, e)
+            service.repo.finish_job(job.job_id, error=error)
+            session.commit()
+            n_run += 1
@@ -0,0 +1,195 @@
+"""Staged ingestion: Polar fetch -> `Adapter` parse -> repository write, connected by bounded queues.
+
+Every stage runs on its own threads, so requests are in flight while earlier windows are parsed and written.
+A full queue blocks the stage in front of it, which bounds the windows held in memory to the queue sizes
+plus one per worker.
+"""
+import time
+import queue
+import logging
+import threading
+
+from step_ingestor.interfaces.repositories import StepIngestorRepository
+from .utils import settled_range
+
+_DONE = object()  # Marks the end of a queue for one worker of the next stage
+_POLL = 0.1  # Seconds between checks whether another stage failed, while blocked on a queue
+
+
+class _Stage(object):
+    def __init__(self, name, workers, inbox: queue.Queue):
+        self.name = name
+        self.workers = workers
+        self.inbox = inbox
+        self.items = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self.running = workers
+        self.lock = threading.Lock()
+
+    def stats(self, elapsed):
+        with self.lock:
+            return {"workers": self.workers,
+                    "items": self.items,
+                    "per_second": self.items / elapsed if elapsed else 0.0,
+                    "busy_seconds": self.busy,
+                    "queue_depth": self.inbox.qsize(),
+                    "max_queue_depth": self.max_depth}
+
+
+class IngestionPipeline(object):
+    """Ingest windows of many users with the network, the CPU and the database busy at the same time.
+
+    Windows are `(user, date_from, date_to)`. The provider needs `fetch_activity_date_range` and
+    `parse_payload`, see `Adapter`. Writers use the repository passed to `run`, or each open a session
+    from `session_factory` and write with their own `StepIngestorRepository`. A written window is
+    recorded as synced, see `IngestionService.refresh_user_data`.
+    """
+
+    STAGES = ("fetch", "parse", "write")
+
+    def __init__(self, provider, session_factory=None, fetch_workers=4, parse_workers=1, write_workers=1,
+                 queue_size=4, **repo_kwargs):
+        """
+        :param session_factory: `sessionmaker` the writers open their sessions from, required for more than one writer
+        :param queue_size: responses waiting to be parsed, and parsed windows waiting to be written, at most
+        :param repo_kwargs: passed to the `StepIngestorRepository` of every writer
+        """
+        self.provider = provider
+        self.session_factory = session_factory
+        self.workers = {"fetch": fetch_workers, "parse": parse_workers, "write": write_workers}
+        self.queue_size = queue_size
+        self.repo_kwargs = repo_kwargs
+        self._stages = {}
+        self._started = None
+        self._finished = None
+
+    def run(self, windows, repo=None):
+        """Ingest all windows, returns True or raises the first error of any stage, the remaining windows
+        are dropped then. `repo` is written with by a single writer thread."""
+        if repo is None and self.session_factory is None:
+            raise ValueError("Pass a repository or a session_factory")
+        if repo is not None and self.workers["write"] > 1:
+            raise ValueError("A repository is not shared between writers, use session_factory")
+
+        inboxes = [queue.Queue(), queue.Queue(self.queue_size), queue.Queue(self.queue_size)]
+        for window in windows:
+            inboxes[0].put(window)
+        self._stages = {name: _Stage(name, self.workers[name], inbox) for name, inbox in zip(self.STAGES, inboxes)}
+        for _ in range(self.workers["fetch"]):
+            inboxes[0].put(_DONE)
+
+        stop = threading.Event()
+        errors = []
+        fetch, parse, write = (self._stages[name] for name in self.STAGES)
+        fetch.max_depth = fetch.inbox.qsize() - fetch.workers
+        targets = [(fetch, self._worker, (fetch, self._fetch, parse, stop, errors)),
+                   (parse, self._worker, (parse, self._parse, write, stop, errors)),
+                   (write, self._write_worker, (write, repo, stop, errors))]
+        threads = [threading.Thread(target=target, args=args, name="ingest-{}-{}".format(stage.name, i), daemon=True)
+                   for stage, target, args in targets
+                   for i in range(stage.workers)]
+
+        self._started, self._finished = time.perf_counter(), None
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._finished = time.perf_counter()
+
+        logging.debug("Ingestion pipeline stats: {}".format(self.stats()))
+        if errors:
+            raise errors[0]
+        return True
+
+    def stats(self):
+        """Windows processed per stage, in total and per second of the run, time spent working and the depth
+        of the queue in front of the stage. Can be called while `run` is in progress."""
+        if self._started is None:
+            return {}
+        elapsed = (self._finished or time.perf_counter()) - self._started
+        return {name: stage.stats(elapsed) for name, stage in self._stages.items()}
+
+    def _fetch(self, window):
+        user, date_from, date_to = window
+        logging.debug("Fetching range from {} to {}".format(date_from, date_to))
+        return window, self.provider.fetch_activity_date_range(date_from=date_from, date_to=date_to, user=user)
+
+    def _parse(self, item):
+        window, raw = item
+        user, _, _ = window
+        return window, self.provider.parse_payload(raw, user_id=user.user_id) if raw else None
+
+    @staticmethod
+    def _store(repo, item):
+        """Write the payload of a window and record the window as synced, also when it had no data"""
+        (user, date_from, date_to), payload = item
+        if payload:
+            repo.ingest_payload(payload=payload)
+        settled = settled_range(date_from, date_to)
+        if settled:
+            repo.add_synced_range(user, *settled)
+
+    @staticmethod
+    def _get(inbox, stop):
+        while not stop.is_set():
+            try:
+                return inbox.get(timeout=_POLL)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    @staticmethod
+    def _put(outbox, item, stop):
+        while not stop.is_set():
+            try:
+                return outbox.put(item, timeout=_POLL)
+            except queue.Full:
+                continue
+
+    def _process(self, stage, item, step):
+        start = time.perf_counter()
+        result = step(item)
+        with stage.lock:
+            stage.items += 1
+            stage.busy += time.perf_counter() - start
+        return result
+
+    def _worker(self, stage, step, next_stage, stop, errors):
+        try:
+            while True:
+                item = self._get(stage.inbox, stop)
+                if item is _DONE:
+                    break
+                result = self._process(stage, item, step)
+                self._put(next_stage.inbox, result, stop)
+                with next_stage.lock:
+                    next_stage.max_depth = max(next_stage.max_depth, next_stage.inbox.qsize())
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            with stage.lock:
+                stage.running -= 1
+                last = stage.running == 0
+            # The last worker of a stage ends the next one
+            if last:
+                for _ in range(next_stage.workers):
+                    self._put(next_stage.inbox, _DONE, stop)
+
+    def _write_worker(self, stage, repo, stop, errors):
+        try:
+            if repo is not None:
+                return self._write(stage, repo, stop)
+            with self.session_factory() as session:
+                self._write(stage, StepIngestorRepository(session=session, autocommit=True, **self.repo_kwargs), stop)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    def _write(self, stage, repo, stop):
+        while True:
+            item = self._get(stage.inbox, stop)
+            if item is _DONE:
+                return
+            self._process(stage, item, lambda item_: self._store(repo, item_))
@@ -0,0 +1,37 @@
+"""Rebuild the database from a `PayloadArchive`, without calling the Polar API.
+
+    python -m step_ingestor.services.ingestion.src.replay <archive dir> [--user-id <user_id>]
+"""
+import argparse
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from step_ingestor.db import db_url
+from step_ingestor.dto import ActivitySummaryDTO, StepSampleDTO
+from step_ingestor.adapters import Adapter
+from step_ingestor.interfaces import StepIngestorRepository, PayloadArchive
+from .service import IngestionService
+
+
+def replay(archive: PayloadArchive, session_factory, user_ids=None) -> int:
+    """Replay the archive user by user, each user in its own transaction. Returns the number of replayed responses."""
+    adapter = Adapter(dto_dact=ActivitySummaryDTO, dto_step=StepSampleDTO, series=True)
+    replayed = 0
+    for user_id in user_ids or archive.user_ids():
+        with session_factory() as session, session.begin():
+            repo = StepIngestorRepository(session=session, autocommit=False)
+            service = IngestionService(provider=adapter, repo=repo)
+            replayed += service.replay_archive(archive=archive, user_id=user_id)
+    return replayed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("archive", help="root directory of the payload archive")
+    parser.add_argument("--user-id", action="append", dest="user_ids", help="only replay this user, repeatable")
+    args = parser.parse_args()
+
+    engine = create_engine(db_url)
+    n_replayed = replay(PayloadArchive(args.archive), sessionmaker(bind=engine), user_ids=args.user_ids)
+    print("Replayed {} archived responses".format(n_replayed))
@@ -1,15 +1,26 @@
 """Contains operational application logic to retrieve data from the polar API and store it in the database."""
 import logging
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from step_ingestor.dto import UserDTO
-from .utils import date_windows_28d
+from .utils import date_windows_28d, plan_date_windows, settled_range
 
 
 class IngestionService:
-    def __init__(self, provider, repo):
+    def __init__(self, provider, repo, stream=False, workers=1, pipeline=None):
+        """
+        :param stream: fetch windows day by day as they are received, so about one day is held in memory
+        :param workers: number of threads fetching windows concurrently. Fetched windows are written
+            by the calling thread, so the repository's session is only used by one thread.
+        :param pipeline: `IngestionPipeline` that fetches, parses and writes the windows in separate stages,
+            writing with `repo`. Takes precedence over `stream` and `workers`.
+        """
         self.provider = provider
         self.repo = repo
+        self.stream = stream
+        self.workers = workers
+        self.pipeline = pipeline
 
     def add_user(self, *, user: UserDTO):
         """Register the user in the database"""
@@ -31,39 +42,101 @@ class IngestionService:
     def delete_user(self, *, user: UserDTO):
         return self.repo.delete_user(user)
 
-    def refresh_user_data(self, *, user: UserDTO):
-        # Get latest stored date
-        latest_date = self.repo.get_latest_summary_date(user)
-
-        # When the user does not have data in the DB
-        if latest_date is None:
-            return self._populate_db_historical(user)
-
-        # Get date after latest saved day
-        next_date = latest_date + dt.timedelta(days=1)
+    def refresh_user_data(self, *, user: UserDTO, days_back=365):
+        """Fetch the days of the last `days_back` that were not synced yet, with as few requests as possible.
+        Gaps left by an interrupted refresh are fetched as well. Data stored before synced ranges were
+        recorded is fetched once more."""
         today = dt.date.today()
-        days_back = (today - next_date).days
+        covered = self.repo.get_covered_ranges(user, since=today - dt.timedelta(days=days_back))
+        ranges = plan_date_windows(covered, today=today, days_back=days_back)
 
         # When all available data has been saved already
-        if next_date > today:
+        if not ranges:
             return True
+        return self._populate_db_historical(user, ranges=ranges)
+
+    def enqueue_refresh(self, *, user: UserDTO, priority=0):
+        """Queue `refresh_user_data` for a worker (see `run_refresh_jobs`), returns the job id.
+        Jobs of a higher `priority` run first."""
+        return self.repo.enqueue_refresh(user, priority=priority)
+
+    def get_refresh_job(self, *, user: UserDTO):
+        """Latest queued, running or finished refresh of the user"""
+        return self.repo.get_latest_job(user)
 
-        # When there are other dates in the API and not in the DB
-        else:
-            return self._populate_db_historical(user, days_back=days_back)
+    def _populate_db_historical(self, user: UserDTO, days_back=365, ranges=None):
+        """Stores data from Polar API from last 365 days in DB, or of the windows in `ranges`.
+        Every window that was stored completely is recorded as synced."""
+        if ranges is None:
+            ranges = date_windows_28d(days_back=days_back)
+        if self.pipeline is not None:
+            return self.pipeline.run([(user, date_from, date_to) for date_from, date_to in ranges], repo=self.repo)
+        if self.workers > 1 and len(ranges) > 1:
+            return self._populate_db_parallel(user, ranges)
 
-    def _populate_db_historical(self, user: UserDTO, days_back=365):
-        """Stores data from Polar API from last 365 days in DB."""
-        ranges = date_windows_28d(days_back=days_back)
         for r in ranges:
             date_from, date_to = r
             logging.debug("Fetching range from {} to {}".format(date_from, date_to))
+            if self.stream:
+                for summary in self.provider.iter_activity_date_range(date_from=date_from,
+                                                                      date_to=date_to,
+                                                                      user=user):
+                    self.repo.ingest_payload(payload=summary)
+                self._mark_synced(user, date_from, date_to)
+                continue
+
             payload = self.provider.get_activity_date_range(date_from=date_from,
                                                             date_to=date_to,
                                                             user=user)
             if payload:
                 self.repo.ingest_payload(payload=payload)
+            self._mark_synced(user, date_from, date_to)
         return True
 
+    def _populate_db_parallel(self, user: UserDTO, ranges):
+        """Fetch the windows on `workers` threads and write each one as soon as it arrives.
+        With `stream` a worker still maps its window day by day, but holds the days until the window is complete."""
+        def fetch(date_from, date_to):
+            logging.debug("Fetching range from {} to {}".format(date_from, date_to))
+            if self.stream:
+                return list(self.provider.iter_activity_date_range(date_from=date_from, date_to=date_to, user=user))
+            return self.provider.get_activity_date_range(date_from=date_from, date_to=date_to, user=user)
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(ranges)),
+                                thread_name_prefix="backfill") as executor:
+            fetches = {executor.submit(fetch, date_from, date_to): (date_from, date_to)
+                       for date_from, date_to in ranges}
+            try:
+                for done in as_completed(fetches):
+                    payload = done.result()
+                    if payload:
+                        self.repo.ingest_payload(payload=payload)
+                    self._mark_synced(user, *fetches[done])
+            finally:
+                # Windows that were not started yet are dropped when a window fails
+                for pending in fetches:
+                    pending.cancel()
+        return True
+
+    def _mark_synced(self, user: UserDTO, date_from, date_to):
+        settled = settled_range(date_from, date_to)
+        if settled:
+            self.repo.add_synced_range(user, *settled)
+
+    def replay_archive(self, *, archive, user_id=None, use_copy=True):
+        """Re-ingest the raw responses in `archive`, of one or all users, through the provider's adapter
+        without calling the API. Returns the number of replayed responses."""
+        replayed = 0
+        for _, payload in self.provider.replay(archive, user_id=user_id):
+            self.repo.ingest_payload(payload=payload, use_copy=use_copy)
+            replayed += 1
+        return replayed
+
     def get_user_data(self, *, user):
         return self.repo.get_user_data(user)
+
+    def iter_user_data(self, *, user=None, chunk_size=5000):
+        return self.repo.iter_user_data(user, chunk_size=chunk_size)
+
+    def get_step_series(self, *, user, freq, start=None, end=None):
+        return self.repo.get_step_series(user, freq, start=start, end=end)
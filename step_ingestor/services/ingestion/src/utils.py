@@ -1,5 +1,7 @@
 from datetime import date, timedelta
-from typing import List, Tuple, Optional
+from typing import Iterable, List, Tuple, Optional
+
+import numpy as np
 
 def date_windows_28d(today: Optional[date] = None,
                      days_back: int = 365,
@@ -37,3 +39,73 @@ def date_windows_28d(today: Optional[date] = None,
         window_end = window_start - one_day  # step back with no overlap
 
     return windows
+
+
+def plan_date_windows(covered: Iterable[Tuple[date, date]],
+                      today: Optional[date] = None,
+                      days_back: int = 365,
+                      window_days: int = 28) -> List[Tuple[str, str]]:
+    """
+    Build the fewest date windows that fetch every day not `covered`, from `days_back` days before
+    `today` up to and including `today`.
+
+    - Covered days are marked in a bitmap of the period, one entry per day.
+    - Each window starts at the oldest missing day not fetched yet and spans at most `window_days`,
+      it ends at the last missing day it can reach, so no window fetches covered days at its ends.
+    - Covered days between missing days of one window are fetched again, that is cheaper than
+      another request.
+
+    Args:
+        covered: (start_date, end_date) ranges of days that need no fetching, both ends included.
+            Ranges may overlap and may extend outside the period.
+        days_back: How many days back from today to cover (default 365).
+        window_days: Maximum size of each window in days (default 28).
+        today: Override for current date (useful for testing).
+
+    Returns:
+        List of (start_date, end_date) tuples as 'YYYY-MM-DD' strings,
+        ordered from newest to oldest window, like `date_windows_28d`.
+    """
+    if today is None:
+        today = date.today()
+
+    start_bound = today - timedelta(days=days_back)
+    missing = np.ones(days_back + 1, dtype=bool)
+    for date_from, date_to in covered:
+        first = max((date_from - start_bound).days, 0)
+        last = min((date_to - start_bound).days, days_back)
+        if first <= last:
+            missing[first:last + 1] = False
+
+    days = np.flatnonzero(missing)
+    windows: List[Tuple[str, str]] = []
+    i = 0
+    while i < len(days):
+        # Last missing day within reach of the window
+        j = np.searchsorted(days, days[i] + window_days - 1, side="right")
+        window_start = start_bound + timedelta(days=int(days[i]))
+        window_end = start_bound + timedelta(days=int(days[j - 1]))
+        windows.append((window_start.isoformat(), window_end.isoformat()))
+        i = j
+
+    windows.reverse()
+    return windows
+
+
+def settled_range(date_from: str,
+                  date_to: str,
+                  today: Optional[date] = None) -> Optional[Tuple[date, date]]:
+    """
+    Days of a fetched window that will not change anymore, the days before `today`.
+    Today is still being recorded by the device, so it is fetched again by the next refresh.
+
+    Returns:
+        (start_date, end_date) with both ends included, or None when the window only covers today.
+    """
+    if today is None:
+        today = date.today()
+    date_from_, date_to_ = date.fromisoformat(date_from), date.fromisoformat(date_to)
+    date_to_ = min(date_to_, today - timedelta(days=1))
+    if date_from_ > date_to_:
+        return None
+    return date_from_, date_to_
@@ -0,0 +1,36 @@
+"""Decode time of the bundled mock data per installed JSON backend.
+
+    python tests/bench_json_decode.py [repeat]
+"""
+import sys
+import timeit
+from pathlib import Path
+
+from step_ingestor.interfaces.polar.json_backend import BACKENDS, BACKEND
+from step_ingestor.interfaces.polar.streaming import JsonArrayParser
+
+DATA = Path(__file__).resolve().parent / "mockserver" / "mockdata" / "mockdata.json"
+
+
+def stream(body, chunk_size=64 * 1024):
+    parser = JsonArrayParser()
+    days = []
+    for i in range(0, len(body), chunk_size):
+        days.extend(parser.feed(body[i:i + chunk_size]))
+    days.extend(parser.close())
+    return days
+
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    body = DATA.read_bytes()
+    print("{:.1f} MB, selected backend: {}".format(len(body) / 1e6, BACKEND))
+
+    baseline = None
+    for name, loads in BACKENDS.items():
+        best = min(timeit.repeat(lambda loads=loads: loads(body), number=1, repeat=repeat))
+        baseline = baseline or best
+        print("{:<8} {:8.2f} ms  {:5.1f}x".format(name, best * 1000, baseline / best))
+
+    best = min(timeit.repeat(lambda: stream(body), number=1, repeat=repeat))
+    print("{:<8} {:8.2f} ms  (JsonArrayParser, 64 KiB chunks)".format("stream", best * 1000))
@@ -2,6 +2,7 @@ import os
 import json
 import random
 import uuid
+import datetime as dt
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from pathlib import Path
@@ -9,13 +10,14 @@ from pathlib import Path
 import pytest
 from dotenv import load_dotenv
 import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import sessionmaker
 from testcontainers.postgres import PostgresContainer
 from testcontainers.core.container import DockerContainer
 from testcontainers.core.image import DockerImage
 from testcontainers.core.wait_strategies import LogMessageWaitStrategy
 
-from step_ingestor.db import Base, AppUser, ActivitySummary, StepSample
+from step_ingestor.db import AppUser, ActivitySummary, StepSample, bootstrap_schema
 from step_ingestor.interfaces import AccessLink
 from step_ingestor.dto import ActivitySummaryDTO, StepSampleDTO, UserDTO
 from step_ingestor.adapters import Adapter
@@ -145,7 +147,8 @@ def engine(testdb_config, request):
     pg.start()
     url = pg.get_connection_url()
     engine = sa.create_engine(url)
-    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        bootstrap_schema(conn, compress_after=dt.timedelta(days=30))
 
     def stop_db():
         pg.stop()
@@ -200,7 +203,8 @@ def seed_user_data(user_activity_dto, test_session):
         rows_steps.append(ss.model_dump(include={"user_id", "timestamp", "steps"}))
 
     stmt_act = sa.insert(ActivitySummary).values(rows_act)
-    stmt_steps = sa.insert(StepSample).values(rows_steps)
+    # Mock data can contain a sample twice, keep the first one like the repository does
+    stmt_steps = pg_insert(StepSample).values(rows_steps).on_conflict_do_nothing()
 
     with test_session as db:
         db.execute(stmt_act)
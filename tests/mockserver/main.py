@@ -1,6 +1,14 @@
 import datetime as dt
+import importlib.util
 from typing import Annotated
 from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import JSONResponse
+
+# Same fast JSON backend as the client when it is installed
+if importlib.util.find_spec("orjson") is not None:
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+else:
+    DefaultResponse = JSONResponse
 
 from src import SampleMocker, token_ok, get_dates_interval
 
@@ -9,7 +17,7 @@ sample_mocker = SampleMocker(fp="mockdata/mockdata.json")
 USER_DB = {"a263a8c1610f45df8125348bd0de72e1": "123",
            "a8f90d69837b4c3d840413beaed4c799": "456",
            "6789b404d3d446b8b896d4453f574f1e": "789"}
-app = FastAPI()
+app = FastAPI(default_response_class=DefaultResponse)
 
 
 @app.get("/users/activities/")
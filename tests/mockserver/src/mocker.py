@@ -3,6 +3,11 @@ import datetime as dt
 import isodate
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class SampleMocker:
     def __init__(self, fp):
@@ -12,8 +17,8 @@ class SampleMocker:
     @property
     def mockdata(self):
         if self._mockdata is None:
-            with open(self.fp, "r") as f:
-                data = json.load(f)
+            with open(self.fp, "rb") as f:
+                data = orjson.loads(f.read()) if orjson else json.load(f)
                 self._mockdata = data
         return self._mockdata
 
@@ -1,3 +1,10 @@
+from step_ingestor.adapters import Adapter
+import numpy as np
+
+from step_ingestor.dto import ActivitySummaryDTO, StepSampleDTO, StepSampleColumns, StepSeries
+from step_ingestor.interfaces import PayloadArchive
+
+
 # --- Mapping to DTOs test
 def test_mapping_empty_daily_summary(adapter):
     raw = {}
@@ -12,3 +19,71 @@ def test_mapping_single_empty_step_samples(adapter, random_raw_payload):
 def test_mapping_mock_data(adapter, raw_payloads):
     results = adapter._raw_payload_to_dto(raw=raw_payloads, user_id="123")
     assert all(results)
+
+# --- Payload archive
+def test_replay_archived_payloads(raw_payloads, tmp_path):
+    archive = PayloadArchive(tmp_path)
+    archive.write("123", "2025-09-01", "2025-09-28", raw_payloads)
+    archive.write("123", "2025-09-01", "2025-09-28", raw_payloads[:1])
+
+    offline = Adapter(dto_dact=ActivitySummaryDTO, dto_step=StepSampleDTO)
+    replayed = list(offline.replay(archive, user_id="123"))
+    # Responses come back in the order they were fetched
+    assert [len(p) if isinstance(p, list) else 1 for _, p in replayed] == [len(raw_payloads), 1]
+    assert all(user_id == "123" for user_id, _ in replayed)
+
+# --- Columnar parsing
+def test_columnar_mapping_matches_dtos(raw_payloads):
+    per_sample = Adapter(dto_dact=ActivitySummaryDTO, dto_step=StepSampleDTO)._raw_payload_to_dto(raw_payloads, "123")
+    columnar = Adapter(dto_dact=ActivitySummaryDTO, dto_step=StepSampleDTO,
+                       columnar=True)._raw_payload_to_dto(raw_payloads, "123")
+
+    for expected, summary in zip(per_sample, columnar):
+        # Other tests may have removed the samples of a day from the shared payloads
+        if not expected.step_samples:
+            assert not summary.step_samples
+            continue
+        assert isinstance(summary.step_samples, StepSampleColumns)
+        assert len(summary.step_samples) == len(expected.step_samples)
+        assert list(summary.step_samples.records()) == [(s.user_id, s.timestamp, s.steps) for s in expected.step_samples]
+
+# --- Step series
+def test_series_mapping_matches_dtos(raw_payloads):
+    per_sample = Adapter(dto_dact=ActivitySummaryDTO, dto_step=StepSampleDTO)._raw_payload_to_dto(raw_payloads, "123")
+    series = Adapter(dto_dact=ActivitySummaryDTO, dto_step=StepSampleDTO,
+                     series=True)._raw_payload_to_dto(raw_payloads, "123")
+
+    column_bytes = series_bytes = 0
+    for expected, summary in zip(per_sample, series):
+        if not expected.step_samples:
+            assert not summary.step_samples
+            continue
+        assert isinstance(summary.step_samples, StepSeries)
+        assert len(summary.step_samples) == len(expected.step_samples)
+        assert list(summary.step_samples.records()) == [(s.user_id, s.timestamp, s.steps) for s in expected.step_samples]
+
+        columns = StepSampleColumns.from_samples([s.model_dump() for s in expected.step_samples], "123")
+        column_bytes += columns.timestamps.nbytes + columns.steps.nbytes
+        series_bytes += summary.step_samples.nbytes
+
+        # The pandas view shares the counts and keeps the total of the day
+        steps = summary.step_samples.to_pandas()
+        assert np.shares_memory(steps.to_numpy(), summary.step_samples.counts)
+        assert steps.sum() == sum(s.steps for s in expected.step_samples)
+    assert series_bytes < column_bytes
+
+
+def test_series_falls_back_to_columns_off_grid():
+    samples = [{"timestamp": "2025-09-01T00:00:00", "steps": 3}, {"timestamp": "2025-09-01T00:00:30", "steps": 4}]
+    assert isinstance(StepSeries.from_samples(samples, "123", interval_ms=60_000), StepSampleColumns)
+
+
+def test_series_pack_round_trip():
+    samples = [{"timestamp": "2025-09-01T00:{:02d}:00".format(minute), "steps": steps}
+               for minute, steps in [(0, 0), (1, 0), (2, 0), (3, 12), (5, 0), (6, 7), (7, 0), (8, 0)]]
+    series = StepSeries.from_samples(samples, "123", interval_ms=60_000)
+
+    assert series.pack() == [0, 0, 0, 12, None, 0, 7, 0, 0]
+    assert series.pack(zero_runs=True) == [-3, 12, None, 0, 7, -2]
+    for packed in (series.pack(), series.pack(zero_runs=True)):
+        assert StepSeries.from_packed("123", series.start.item(), series.interval_ms, packed) == series
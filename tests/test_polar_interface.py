@@ -1,6 +1,20 @@
+import io
+import json
+import time
+import asyncio
+import datetime as dt
+
 import pytest
+import requests
 from requests import HTTPError
 
+from step_ingestor.interfaces import (AccessLink, AsyncAccessLink, RateLimiter,
+                                     ResponseCache, MemoryBackend, DiskBackend)
+from step_ingestor.interfaces.polar.json_backend import BACKENDS
+from step_ingestor.interfaces.polar.oauth2 import OAuth2Client
+from step_ingestor.interfaces.polar.streaming import JsonArrayParser
+from step_ingestor.services.ingestion import date_windows_28d
+
 def test_get_activity_date_range_3(polar_interface, access_token):
     activities = polar_interface.get_activity_date_range(access_token=access_token,
                                                          date_from="2025-09-01",
@@ -41,3 +55,130 @@ def test_get_range_too_old(polar_interface, access_token, mockserver):
         polar_interface.get_activity_date_range(access_token=access_token,
                                                 date_from="2024-06-01",
                                                 steps=True)
+
+def test_connections_are_reused(polar_interface, access_token, mockserver):
+    today = dt.date.today()
+    for days_back in (3, 2, 1):
+        polar_interface.get_activity_date_range(access_token=access_token,
+                                                date_from=str(today - dt.timedelta(days=days_back)),
+                                                date_to=str(today - dt.timedelta(days=days_back)),
+                                                steps=True)
+
+    stats = polar_interface.connection_stats()
+    assert stats["requests"] >= 3
+    assert stats["reused"] > 0
+
+def test_async_windows_fetched_concurrently(polar_interface, access_token, mockserver):
+    ranges = date_windows_28d(days_back=83)
+
+    async def fetch():
+        async with AsyncAccessLink(api_url=polar_interface.oauth.url,
+                                   auth_url=None,
+                                   token_url=None,
+                                   client_id=polar_interface.oauth.client_id,
+                                   client_secret=polar_interface.oauth.client_secret,
+                                   concurrency=2) as api:
+            return await api.get_activity_date_ranges(access_token, ranges, steps=True)
+
+    windows = asyncio.run(fetch())
+    assert len(windows) == len(ranges)
+    assert [len(w) for w in windows] == [28, 28, 28]
+
+def test_rate_limiter_queues_and_shares_budget(tmp_path):
+    path = str(tmp_path / "rate_limit.json")
+    worker_a = RateLimiter(windows=[(2, 1)], path=path)
+    worker_b = RateLimiter(windows=[(2, 1)], path=path)
+
+    start = time.monotonic()
+    for limiter in (worker_a, worker_b, worker_a):
+        limiter.acquire()
+    # Third request waited for a token instead of failing
+    assert time.monotonic() - start >= 0.4
+
+    worker_b.update({"RateLimit-Usage": "2", "RateLimit-Limit": "2", "RateLimit-Reset": "1"})
+    assert worker_a._try_acquire() > 0
+
+def test_retries_wait_for_rate_limiter():
+    class Limiter:
+        acquired, updates = 0, 0
+
+        def acquire(self):
+            self.acquired += 1
+
+        def update(self, headers):
+            self.updates += 1
+
+    def respond(status):
+        response = requests.Response()
+        response.status_code, response.headers["Retry-After"], response.raw = status, "0", io.BytesIO(b"{}")
+        return response
+
+    responses = [respond(429), respond(503), respond(200)]
+    limiter = Limiter()
+    client = OAuth2Client("http://polar", None, None, None, "id", "secret", rate_limiter=limiter)
+    client.session.request = lambda method, **kwargs: responses.pop(0)
+    assert client.get(endpoint="/users") == {}
+    assert (limiter.acquired, limiter.updates) == (3, 3)
+
+
+def test_cached_ranges_are_not_refetched(polar_interface, access_token, mockserver):
+    api = AccessLink(api_url=polar_interface.oauth.url,
+                     auth_url=None,
+                     token_url=None,
+                     client_id=polar_interface.oauth.client_id,
+                     client_secret=polar_interface.oauth.client_secret,
+                     cache=ResponseCache(ttl=60))
+    date_from = str(dt.date.today() - dt.timedelta(days=10))
+    date_to = str(dt.date.today() - dt.timedelta(days=5))
+
+    first = api.get_activity_date_range(access_token, date_from, date_to, steps=True)
+    second = api.get_activity_date_range(access_token, date_from, date_to, steps=True)
+    # Mock responses are random, so an equal body was served from the cache
+    assert first == second
+    assert api.connection_stats()["requests"] == 1
+
+@pytest.mark.parametrize("backend", ["memory", "disk"])
+def test_response_cache_evicts_least_recently_used(backend, tmp_path):
+    store = MemoryBackend(maxsize=2) if backend == "memory" else DiskBackend(tmp_path, maxsize=2)
+    cache = ResponseCache(backend=store)
+    keys = [cache.key("token", "/users/activities/", {"from": d}) for d in ("a", "b", "c")]
+
+    cache.store(keys[0], [1], {"ETag": "v1"})
+    time.sleep(0.01)
+    cache.store(keys[1], [2], {})
+    time.sleep(0.01)
+    assert cache.get(keys[0]).etag == "v1"  # Now more recently used than keys[1]
+    time.sleep(0.01)
+    cache.store(keys[2], [3], {})
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]).body == [1]
+    assert cache.conditional_headers(cache.get(keys[0])) == {"If-None-Match": "v1"}
+
+def test_iter_activity_date_range_yields_days(polar_interface, access_token, mockserver):
+    date_from = dt.date.today() - dt.timedelta(days=30)
+    days = polar_interface.iter_activity_date_range(access_token=access_token,
+                                                    date_from=str(date_from),
+                                                    date_to=str(date_from + dt.timedelta(days=27)),
+                                                    steps=True)
+    assert not isinstance(days, list)
+    days = list(days)
+    assert len(days) == 28
+    assert all(isinstance(day, dict) for day in days)
+
+@pytest.mark.parametrize("chunk_size", [1, 13, 64 * 1024])
+def test_json_array_parser_is_chunk_size_independent(raw_payloads, chunk_size):
+    body = json.dumps(raw_payloads[:3]).encode("utf-8")
+    parser = JsonArrayParser()
+    days = []
+    for i in range(0, len(body), chunk_size):
+        days.extend(parser.feed(body[i:i + chunk_size]))
+    days.extend(parser.close())
+    assert days == raw_payloads[:3]
+
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_json_backends_decode_alike(backend, raw_payloads):
+    body = json.dumps(raw_payloads).encode("utf-8")
+    assert BACKENDS[backend](body) == raw_payloads
+    with pytest.raises(ValueError):
+        BACKENDS[backend](b"[{")
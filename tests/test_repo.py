@@ -1,6 +1,28 @@
+import asyncio
+import datetime as dt
+import contextlib
+
 import pytest
 import sqlalchemy as sa
-from step_ingestor.interfaces import StepIngestorRepository
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from step_ingestor.dto import step_sample_records
+from step_ingestor.interfaces import StepIngestorRepository, AsyncStepIngestorRepository
+
+
+@contextlib.contextmanager
+def count_queries(session):
+    """Counts the statements sent to the database within the context"""
+    statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    sa.event.listen(engine, "before_cursor_execute", _count)
+    try:
+        yield statements
+    finally:
+        sa.event.remove(engine, "before_cursor_execute", _count)
 
 
 @pytest.mark.parametrize("user_index", [0, 1, 2])
@@ -35,3 +57,222 @@ def test_repo_can_retrieve_user_data(user_index, seeded_user, seed_user_data, te
     user = test_users[user_index]
     data = repo.get_user_data(user=user)
     assert data
+
+
+@pytest.mark.parametrize("user_index", [0])
+def test_repo_user_data_query_count_is_constant(user_index, seeded_user, user_activity_dto, test_session):
+    """Benchmark: the number of queries to read a user's history does not grow with the history"""
+    repo = StepIngestorRepository(session=test_session, autocommit=False)  # only flush
+
+    repo.ingest_payload(payload=user_activity_dto[:1])
+    with count_queries(test_session) as short_history:
+        data_short = repo.get_user_data(user=seeded_user)
+
+    repo.ingest_payload(payload=user_activity_dto[1:])
+    with count_queries(test_session) as long_history:
+        data_long = repo.get_user_data(user=seeded_user)
+
+    assert len(data_short) == 1
+    assert len(data_long) == len(user_activity_dto)
+    assert len(short_history) == len(long_history)
+    test_session.rollback()
+
+
+@pytest.mark.parametrize("user_index", [0, 1, 2])
+def test_repo_can_ingest_daily_activities_with_copy(user_index, seeded_user, user_activity_dto, test_session):
+    repo = StepIngestorRepository(session=test_session, autocommit=False)  # only flush
+    result = repo.ingest_payload(payload=user_activity_dto, use_copy=True)
+    assert result
+
+    data = repo.get_user_data(user=seeded_user)
+    n_samples = len({ss.timestamp for s in user_activity_dto if s.step_samples for ss in s.step_samples})
+    assert sum(len(s.step_samples) for s in data) == n_samples
+    test_session.rollback()
+
+
+@pytest.mark.parametrize("use_copy", [False, True])
+@pytest.mark.parametrize("user_index", [0])
+def test_repo_reingest_is_idempotent(user_index, use_copy, seeded_user, user_activity_dto, test_session):
+    repo = StepIngestorRepository(session=test_session, autocommit=False)  # only flush
+    stmt = sa.text("""SELECT COUNT(*) FROM step_sample""")
+
+    assert repo.ingest_payload(payload=user_activity_dto, use_copy=use_copy)
+    n_samples = test_session.execute(stmt).scalar()
+
+    assert repo.ingest_payload(payload=user_activity_dto, use_copy=use_copy)
+    assert test_session.execute(stmt).scalar() == n_samples
+    test_session.rollback()
+
+
+@pytest.mark.parametrize("user_index", [0])
+def test_repo_step_series_sums_samples_per_bucket(user_index, seeded_user, user_activity_dto, test_session):
+    repo = StepIngestorRepository(session=test_session, autocommit=False)  # only flush
+    repo.ingest_payload(payload=user_activity_dto)  # Also refreshes the rollups
+    data = repo.get_user_data(user=seeded_user)
+    n_steps = sum(ss.steps for s in data for ss in s.step_samples)
+
+    days = repo.get_step_series(seeded_user, "day")
+    hours = repo.get_step_series(seeded_user, "hour")
+
+    assert len(days) <= len(data)
+    assert len(days) <= len(hours)
+    assert sum(b.steps for b in days) == n_steps
+    assert sum(b.steps for b in hours) == n_steps
+    with pytest.raises(ValueError):
+        repo.get_step_series(seeded_user, "minute")
+    test_session.rollback()
+
+
+@pytest.mark.parametrize("user_index", [0])
+def test_repo_reingest_keeps_rollups_consistent(user_index, seeded_user, user_activity_dto, test_session):
+    repo = StepIngestorRepository(session=test_session, autocommit=False)  # only flush
+    repo.ingest_payload(payload=user_activity_dto)
+    first = repo.get_step_series(seeded_user, "hour")
+
+    repo.ingest_payload(payload=user_activity_dto[:3])
+    assert repo.get_step_series(seeded_user, "hour") == first
+    test_session.rollback()
+
+
+@pytest.mark.parametrize("zero_runs", [False, True])
+@pytest.mark.parametrize("user_index", [0])
+def test_repo_packed_layout_reads_like_rows(user_index, zero_runs, seeded_user, user_activity_dto, test_session):
+    # The mock data repeats the first sample of the next day on some days, with another count.
+    # Rows keep the sample stored first, packed days the sample of the day it belongs to.
+    for s in user_activity_dto:
+        s.step_samples = [ss for ss in s.step_samples or () if ss.timestamp.date() == s.date] or None
+
+    rows = StepIngestorRepository(session=test_session, autocommit=False)  # only flush
+    rows.ingest_payload(payload=user_activity_dto)
+    expected = rows.get_user_data(user=seeded_user)
+    hours = rows.get_step_series(seeded_user, "hour")
+
+    # Packing the same days replaces their rows
+    packed = StepIngestorRepository(session=test_session, autocommit=False, packed=True, zero_runs=zero_runs)
+    assert packed.ingest_payload(payload=user_activity_dto)
+    n_days = sum(1 for s in user_activity_dto if s.step_samples)
+    assert test_session.execute(sa.text("""SELECT COUNT(*) FROM step_day""")).scalar() == n_days
+    assert test_session.execute(sa.text("""SELECT COUNT(*) FROM step_sample""")).scalar() == 0
+
+    data = packed.get_user_data(user=seeded_user)
+    assert list(step_sample_records(s.step_samples for s in data)) == \
+           list(step_sample_records(s.step_samples for s in expected))
+    assert packed.get_step_series(seeded_user, "hour") == hours
+    assert list(packed.iter_user_data(seeded_user, chunk_size=7)) == data
+    test_session.rollback()
+
+
+@pytest.mark.parametrize("user_index", [0])
+def test_repo_packed_layout_stores_next_day_sample_once(user_index, seeded_user, user_activity_dto, test_session):
+    repo = StepIngestorRepository(session=test_session, autocommit=False, packed=True)  # only flush
+    assert repo.ingest_payload(payload=user_activity_dto)
+
+    timestamps = [t for _, t, _ in step_sample_records(s.step_samples for s in repo.get_user_data(user=seeded_user))]
+    n_samples = len({ss.timestamp for s in user_activity_dto if s.step_samples for ss in s.step_samples})
+    assert len(timestamps) == len(set(timestamps)) == n_samples
+    test_session.rollback()
+
+
+@pytest.mark.parametrize("user_index", [0])
+def test_repo_refresh_job_is_claimed_by_one_worker(user_index, seeded_user, session_factory):
+    with session_factory() as first, session_factory() as second:
+        repo = StepIngestorRepository(session=first, autocommit=True)
+        job_id = repo.enqueue_refresh(seeded_user)
+        assert repo.enqueue_refresh(seeded_user) == job_id  # One active job per user
+
+        claiming = StepIngestorRepository(session=first, autocommit=False)
+        job = claiming.claim_job(lease=dt.timedelta(minutes=5))
+        assert (job.job_id, job.status, job.attempts) == (job_id, "running", 1)
+        # The claim is not committed yet, its row lock is skipped
+        assert StepIngestorRepository(session=second, autocommit=True).claim_job(lease=dt.timedelta(minutes=5)) is None
+        claiming.finish_job(job.job_id)
+        first.commit()
+
+        job = repo.get_latest_job(seeded_user)
+        assert (job.status, job.error) == ("done", None) and job.finished_at is not None
+        assert repo.enqueue_refresh(seeded_user) != job_id
+
+
+@pytest.mark.parametrize("user_index", [0])
+def test_enqueue_retries_when_running_job_finishes_in_between(user_index, seeded_user, session_factory, monkeypatch):
+    from step_ingestor.interfaces.repositories import statements
+
+    with session_factory() as session:
+        repo = StepIngestorRepository(session=session, autocommit=True)
+        running = repo.enqueue_refresh(seeded_user)
+        assert repo.claim_job(lease=dt.timedelta(minutes=5)).job_id == running
+
+        select_active_job_id = statements.select_active_job_id
+
+        def finish_first(user):
+            # The job finishes after the insert conflicted with it. The conflict locks the job's row until
+            # the enqueue commits, so the job is finished in the enqueue's own transaction.
+            StepIngestorRepository(session=session, autocommit=False).finish_job(running)
+            return select_active_job_id(user)
+
+        monkeypatch.setattr(statements, "select_active_job_id", finish_first)
+        job_id = repo.enqueue_refresh(seeded_user)
+        assert job_id != running
+        assert repo.get_latest_job(seeded_user).status == "queued"
+
+
+def test_step_sample_is_compressed_hypertable(test_session):
+    stmt = sa.text("""SELECT compression_enabled FROM timescaledb_information.hypertables
+                      WHERE hypertable_name = 'step_sample'""")
+    assert test_session.execute(stmt).scalar_one()
+
+
+@pytest.mark.parametrize("user_index", [0])
+def test_repo_user_lookup_is_single_query(user_index, seeded_user, user_activity_dto, test_session):
+    repo = StepIngestorRepository(session=test_session, autocommit=False)  # only flush
+    repo.ingest_payload(payload=user_activity_dto)
+
+    with count_queries(test_session) as statements:
+        user = repo.get_user_by_id(user_id=seeded_user.user_id)
+
+    assert user == seeded_user
+    assert len(statements) == 1
+    test_session.rollback()
+
+
+@pytest.mark.parametrize("user_index", [0, 1])
+def test_repo_streamed_user_data_matches(user_index, seeded_user, user_activity_dto, test_session):
+    repo = StepIngestorRepository(session=test_session, autocommit=False)  # only flush
+    repo.ingest_payload(payload=user_activity_dto)
+
+    streamed = list(repo.iter_user_data(seeded_user, chunk_size=100))
+    assert streamed == repo.get_user_data(user=seeded_user)
+    test_session.rollback()
+
+
+@pytest.mark.parametrize("user_index", [0])
+def test_repo_writes_in_batches_of_batch_size(user_index, seeded_user, user_activity_dto, test_session):
+    repo = StepIngestorRepository(session=test_session, autocommit=False, batch_size=1000)  # only flush
+    assert repo.ingest_payload(payload=user_activity_dto)
+
+    sample_batches = [t for t in repo.batch_timings if t.table == "step_sample"]
+    n_samples = sum(len(s.step_samples) for s in user_activity_dto if s.step_samples)
+    assert all(t.rows <= 1000 for t in repo.batch_timings)
+    assert sum(t.rows for t in sample_batches) == n_samples
+    assert len(sample_batches) == -(-n_samples // 1000)
+    assert repo.batch_report()["step_sample"]["statements"] == len(sample_batches)
+    test_session.rollback()
+
+
+@pytest.mark.parametrize("packed", [False, True])
+@pytest.mark.parametrize("user_index", [1])
+def test_async_repo_matches_sync_repo(user_index, packed, engine, seeded_user, user_activity_dto, test_session):
+    async def ingest_and_read():
+        async_engine = create_async_engine(engine.url.set(drivername="postgresql+asyncpg"))
+        try:
+            async with async_sessionmaker(async_engine)() as session:
+                repo = AsyncStepIngestorRepository(session=session, autocommit=True, packed=packed)
+                assert await repo.ingest_payload(payload=user_activity_dto)
+                assert await repo.get_user_by_id(user_id=seeded_user.user_id) == seeded_user
+                return await repo.get_user_data(user=seeded_user)
+        finally:
+            await async_engine.dispose()
+
+    data = asyncio.run(ingest_and_read())
+    repo = StepIngestorRepository(session=test_session, autocommit=False, packed=packed)
+    assert data == repo.get_user_data(user=seeded_user)
@@ -1,5 +1,25 @@
 import datetime as dt
-from step_ingestor.services.ingestion import date_windows_28d
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+
+from step_ingestor.db import ActivitySummary, AppUser, SyncedRange
+from step_ingestor.interfaces import StepIngestorRepository
+from step_ingestor.services.ingestion import (
+    LOGIN_PRIORITY,
+    IngestionPipeline,
+    IngestionService,
+    date_windows_28d,
+    plan_date_windows,
+    run_refresh_jobs,
+    schedule_refreshes,
+    settled_range,
+)
+
 
 def test_date_range_util():
     ranges = date_windows_28d()
@@ -10,4 +30,218 @@ def test_range_short():
     today = dt.date.fromisoformat("2025-10-01")
     days_back = (today - last_saved).days
     ranges = date_windows_28d(today=today, days_back=days_back)
-    assert len(ranges) == 4
\ No newline at end of file
+    assert len(ranges) == 4
+
+
+def test_parallel_backfill_writes_every_window_on_calling_thread():
+    class Provider:
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.in_flight = 0
+            self.max_in_flight = 0
+
+        def get_activity_date_range(self, date_from, date_to, user):
+            with self.lock:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            time.sleep(0.01)
+            with self.lock:
+                self.in_flight -= 1
+            return [(date_from, date_to)]
+
+    class Repo:
+        def __init__(self):
+            self.written = []
+            self.threads = set()
+
+        def ingest_payload(self, payload):
+            self.threads.add(threading.get_ident())
+            self.written.extend(payload)
+
+        def add_synced_range(self, user, date_from, date_to):
+            self.threads.add(threading.get_ident())
+
+    provider, repo = Provider(), Repo()
+    service = IngestionService(provider=provider, repo=repo, workers=4)
+    assert service._populate_db_historical(user=None)
+    assert sorted(repo.written) == sorted(date_windows_28d())
+    assert repo.threads == {threading.get_ident()}
+    assert 1 < provider.max_in_flight <= 4
+
+
+def test_pipeline_ingests_every_window_and_reports_stages():
+    empty = date_windows_28d()[-1]
+
+    class Provider:
+        def fetch_activity_date_range(self, date_from, date_to, user):
+            return None if (date_from, date_to) == empty else {"window": (date_from, date_to)}
+
+        def parse_payload(self, raw, user_id):
+            return [(user_id, raw["window"])]
+
+    class Repo:
+        def __init__(self):
+            self.written = []
+            self.synced = []
+
+        def ingest_payload(self, payload):
+            self.written.extend(payload)
+
+        def add_synced_range(self, user, date_from, date_to):
+            self.synced.append((date_from, date_to))
+
+    repo = Repo()
+    pipeline = IngestionPipeline(Provider(), fetch_workers=3, parse_workers=2, queue_size=1)
+    service = IngestionService(provider=None, repo=repo, pipeline=pipeline)
+    assert service._populate_db_historical(user=SimpleNamespace(user_id="u"))
+
+    windows = date_windows_28d()[:-1]
+    assert sorted(repo.written) == sorted(("u", w) for w in windows)
+    stats = pipeline.stats()
+    assert [stats[s]["items"] for s in ("fetch", "parse", "write")] == [len(date_windows_28d())] * 3
+    # Windows without data are synced too, today is left for the next refresh
+    assert sorted(repo.synced) == sorted(settled_range(*w) for w in date_windows_28d())
+    assert all(stats[s]["queue_depth"] == 0 and stats[s]["max_queue_depth"] <= 1 for s in ("parse", "write"))
+
+
+def test_pipeline_raises_the_first_stage_error():
+    class Provider:
+        def fetch_activity_date_range(self, date_from, date_to, user):
+            return {"window": (date_from, date_to)}
+
+        def parse_payload(self, raw, user_id):
+            raise ValueError("bad payload")
+
+    pipeline = IngestionPipeline(Provider(), queue_size=1)
+    user = SimpleNamespace(user_id="u")
+    with pytest.raises(ValueError, match="bad payload"):
+        pipeline.run([(user, w[0], w[1]) for w in date_windows_28d()], repo=SimpleNamespace(ingest_payload=None))
+
+
+def test_plan_without_coverage_matches_fixed_windows():
+    today = dt.date.fromisoformat("2025-10-01")
+    assert len(plan_date_windows([], today=today)) == len(date_windows_28d(today=today))
+
+
+def test_plan_fetches_only_missing_days_in_fewest_windows():
+    today = dt.date.fromisoformat("2025-10-01")
+    day = dt.date.fromisoformat
+    covered = [(day("2024-01-01"), day("2025-08-31")),  # Before and into the period
+               (day("2025-09-03"), day("2025-09-20")),
+               (day("2025-09-25"), day("2025-09-30"))]
+    # Two holes 22 days apart fit one window, today is missing
+    assert plan_date_windows(covered, today=today) == [("2025-10-01", "2025-10-01"), ("2025-09-01", "2025-09-24")]
+    assert plan_date_windows(covered + [(day("2025-09-01"), day("2025-10-01"))], today=today) == []
+
+    # A hole longer than a window takes the fewest windows
+    windows = plan_date_windows([(day("2024-01-01"), day("2025-08-01"))], today=today, window_days=28)
+    assert windows == [("2025-09-27", "2025-10-01"), ("2025-08-30", "2025-09-26"), ("2025-08-02", "2025-08-29")]
+
+
+def test_settled_range_leaves_today_open():
+    today = dt.date.fromisoformat("2025-10-01")
+    assert settled_range("2025-09-04", "2025-10-01", today=today) == (dt.date(2025, 9, 4), dt.date(2025, 9, 30))
+    assert settled_range("2025-10-01", "2025-10-01", today=today) is None
+
+
+@pytest.mark.parametrize("user_index", [0])
+def test_refresh_worker_records_failed_jobs(user_index, seeded_user, session_factory):
+    class Provider:
+        def get_activity_date_range(self, date_from, date_to, user):
+            raise ConnectionError("Polar unavailable")
+
+    def make_service(session):
+        return IngestionService(provider=Provider(), repo=StepIngestorRepository(session=session, autocommit=True))
+
+    with session_factory() as session:
+        StepIngestorRepository(session=session, autocommit=True).enqueue_refresh(seeded_user)
+    assert run_refresh_jobs(session_factory, make_service, once=True) == 1
+
+    with session_factory() as session:
+        job = StepIngestorRepository(session=session).get_latest_job(seeded_user)
+    assert (job.status, job.error) == ("failed", "ConnectionError: Polar unavailable")
+
+
+@pytest.mark.parametrize("user_index", [0])
+def test_scheduler_queues_most_stale_users_first(user_index, seeded_user, user_activity_dto, test_users, session_factory):
+    others = [u for u in test_users if u.user_id != seeded_user.user_id]
+    with session_factory() as session:
+        repo = StepIngestorRepository(session=session, autocommit=True)
+        for user in others:
+            repo.add_user(user.model_copy(update={"access_token": None}))
+        repo.ingest_payload(payload=user_activity_dto)
+        latest = repo.get_latest_summary_date(seeded_user)
+        today = latest + dt.timedelta(days=10)
+        try:
+            # Users without data go first, then the seeded user that is 10 days behind
+            first = schedule_refreshes(repo, limit=len(others), today=today)
+            assert len(first) == len(others) and schedule_refreshes(repo, today=today) != []
+            assert schedule_refreshes(repo, today=today) == []  # Every user has a queued job now
+            assert repo.get_latest_job(seeded_user).priority == 10
+            repo.enqueue_refresh(seeded_user, priority=LOGIN_PRIORITY)
+
+            lease = dt.timedelta(minutes=5)
+            job = repo.claim_job(lease=lease, max_running=1)
+            assert job.user_id == seeded_user.user_id
+            assert repo.claim_job(lease=lease, max_running=1) is None
+            repo.finish_job(job.job_id)
+
+            # Shards partition the users
+            claimed = [j for i in (0, 1) for j in iter(lambda i=i: repo.claim_job(lease=lease, shard=(i, 2)), None)]
+            assert sorted(j.user_id for j in claimed) == sorted(u.user_id for u in others)
+
+            # Users whose job just failed, e.g. for a revoked token, wait `stale_after` before they are queued again
+            for job in claimed:
+                repo.finish_job(job.job_id, error="Token revoked")
+            assert schedule_refreshes(repo, today=dt.date.today()) == []
+            assert len(schedule_refreshes(repo, today=dt.date.today() + dt.timedelta(days=2))) == len(test_users)
+        finally:
+            session.execute(sa.delete(AppUser).where(AppUser.user_id.in_([u.user_id for u in others])))
+            session.commit()
+
+
+@pytest.mark.parametrize("user_index", [0])
+def test_refresh_fetches_only_days_missing_from_coverage(user_index, seeded_user, session_factory):
+    class Provider:
+        def __init__(self):
+            self.requested = []
+
+        def get_activity_date_range(self, date_from, date_to, user):
+            self.requested.append((date_from, date_to))
+
+    today = dt.date.today()
+    with session_factory() as session:
+        repo = StepIngestorRepository(session=session, autocommit=True)
+        provider = Provider()
+        service = IngestionService(provider=provider, repo=repo)
+
+        assert service.refresh_user_data(user=seeded_user)
+        assert len(provider.requested) == 14
+        # Windows are merged into one range, today stays open
+        since = today - dt.timedelta(days=365)
+        assert repo.get_covered_ranges(seeded_user, since) == [(since, today - dt.timedelta(days=1))]
+
+        provider.requested.clear()
+        assert service.refresh_user_data(user=seeded_user)
+        assert provider.requested == [(today.isoformat(), today.isoformat())]
+
+        # A hole left by an interrupted refresh is fetched, and nothing around it
+        session.execute(sa.delete(SyncedRange).where(SyncedRange.user_id == seeded_user.user_id))
+        repo.add_synced_range(seeded_user, since, today - dt.timedelta(days=41))
+        repo.add_synced_range(seeded_user, today - dt.timedelta(days=30), today - dt.timedelta(days=1))
+        provider.requested.clear()
+        assert service.refresh_user_data(user=seeded_user)
+        hole = ((today - dt.timedelta(days=40)).isoformat(), (today - dt.timedelta(days=31)).isoformat())
+        assert provider.requested == [(today.isoformat(), today.isoformat()), hole]
+        assert len(repo.get_covered_ranges(seeded_user, since)) == 1
+
+        # Stored summaries are not coverage, their samples may have failed to be written
+        before = today - dt.timedelta(days=2)
+        session.execute(sa.delete(SyncedRange).where(SyncedRange.user_id == seeded_user.user_id))
+        repo.add_synced_range(seeded_user, since, today - dt.timedelta(days=3))
+        stmt = insert(ActivitySummary).values(user_id=seeded_user.user_id, date=before, steps=1)
+        session.execute(stmt.on_conflict_do_nothing())
+        session.commit()
+        provider.requested.clear()
+        assert service.refresh_user_data(user=seeded_user)
+        assert provider.requested == [(before.isoformat(), today.isoformat())]